@@ -1,28 +1,234 @@
-"""Executes the report generator and updates the reported User Stories."""
-import yaml
-
-from .taiga_api import TaigaAPI
-from .report_classes import Report, UserStory, 
-from .printer_classes import MarkdownPrinter, DocxPrinter
-
-with open("taiga_report/api.yaml", "r") as yaml_file:
-    yaml_dict = yaml.load(yaml_file, Loader=yaml.FullLoader)
-
-project = "sieel"  # TODO: Make it parameterized via CLI, bot or front-end
-api = TaigaAPI(project, yaml_dict)
-try:
-    us_list = api.download_user_stories()
-except ValueError as ex:
-    print(str(ex))
-except Exception as ex:
-    print(ex)
-
-report = Report(project, yaml_dict)
-
-for us_json in us_list:
-    us = UserStory(us_json)
-    report.classify_user_story(us)
-
-# MarkdownPrinter.print_markdown(report)
-DocxPrinter.print_docx(report)
-print("Success :)")
+"""Executes the report generator and updates the reported User Stories.
+
+Only argparse is imported up front. The API client, the printers and yaml
+are imported once the arguments ask for them, so e.g. a markdown report
+never loads python-docx and --help returns right away.
+
+"""
+import argparse
+
+PROFILE_TOP = 25
+
+FORMATS = ("docx", "md")
+
+
+def parse_args(argv=None):
+    """Parse the command line arguments."""
+    parser = argparse.ArgumentParser(prog="taiga_report",
+                                     description="Generate Taiga reports.")
+    parser.add_argument("project", nargs="?",
+                        help="project block of the yaml. Defaults to the "
+                             "first one found.")
+    parser.add_argument("-f", "--format", choices=FORMATS, action="append",
+                        dest="formats",
+                        help="format of the report (default: docx). Repeat "
+                             "it to classify once and render every format "
+                             "in parallel processes")
+    parser.add_argument("-c", "--config", metavar="PATH",
+                        help="yaml config. Defaults to $TAIGA_REPORT_CONFIG "
+                             "or the api.yaml of the package")
+    parser.add_argument("-o", "--output-dir", metavar="DIR",
+                        help="directory of the reports (default: the "
+                             "current one)")
+    parser.add_argument("--stdout", action="store_true",
+                        help="stream the markdown report to stdout instead "
+                             "of a file, the progress goes to stderr")
+    parser.add_argument("--all", action="store_true",
+                        help="generate the report of every project in the "
+                             "yaml")
+    parser.add_argument("--workers", type=int, default=4,
+                        help="projects processed at the same time with --all")
+    parser.add_argument("--async", action="store_true", dest="use_async",
+                        help="download the pages of each listing "
+                             "concurrently with asyncio, and with --all "
+                             "every project on one event loop")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="bypass the cache of API responses")
+    parser.add_argument("--incremental", action="store_true",
+                        help="only download stories modified since the last "
+                             "run and build the report from the local copy")
+    parser.add_argument("--tasks", action="store_true",
+                        help="list the tasks of each user story, fetched in "
+                             "one sweep for the whole project")
+    parser.add_argument("--month", metavar="MM-YYYY",
+                        help="only report the stories finished that month. "
+                             "Taiga filters them, so only that month is "
+                             "downloaded")
+    parser.add_argument("--since", metavar="YYYY-MM-DD",
+                        help="only report the stories finished on or after "
+                             "that day")
+    parser.add_argument("--until", metavar="YYYY-MM-DD",
+                        help="only report the stories finished on or before "
+                             "that day")
+    parser.add_argument("--milestone", type=int, metavar="ID",
+                        help="only report the stories of that sprint")
+    parser.add_argument("--force", action="store_true",
+                        help="write a new report version even if the content "
+                             "didn't change")
+    parser.add_argument("--serve", action="store_true",
+                        help="keep running, refresh the reports on the "
+                             "schedule of the yaml 'service' block and "
+                             "serve them over HTTP")
+    parser.add_argument("--port", type=int,
+                        help="port of --serve, overrides the yaml")
+    parser.add_argument("--metrics-json", metavar="PATH",
+                        help="write the phase timings and counters as JSON")
+    parser.add_argument("--metrics-prom", metavar="PATH",
+                        help="write the phase timings and counters in the "
+                             "Prometheus text format")
+    parser.add_argument("--profile", metavar="PATH",
+                        help="run under cProfile, save the stats to PATH and "
+                             "print the most expensive calls")
+    args = parser.parse_args(argv)
+    if args.stdout:
+        if args.all or args.serve:
+            parser.error("--stdout prints a single report")
+        if set(args.formats or ["md"]) != {"md"}:
+            parser.error("--stdout only prints the md format")
+        args.formats = ["md"]
+    # Repeated formats are rendered once.
+    args.formats = list(dict.fromkeys(args.formats or ["docx"]))
+    args.period = None
+    if args.month and (args.since or args.until):
+        parser.error("--month can't be combined with --since/--until")
+    if args.month or args.since or args.until or args.milestone is not None:
+        from .report_period import ReportPeriod
+
+        try:
+            if args.month:
+                args.period = ReportPeriod.parse_month(args.month,
+                                                       args.milestone)
+            else:
+                args.period = ReportPeriod.between(args.since, args.until,
+                                                   args.milestone)
+        except ValueError as ex:
+            parser.error(str(ex))
+    return args
+
+
+def run(args, yaml_dict):
+    """Generate the reports selected by args.
+
+    RETURNS: int exit code.
+
+    """
+    import sys
+    from contextlib import redirect_stdout
+    from functools import partial
+
+    from .output_manager import OutputManager
+    from .printer_classes import PRINTERS, MarkdownPrinter
+    from .runner import (find_projects, print_summary, render_formats,
+                         run_batch, run_batch_async)
+
+    if args.no_cache:
+        yaml_dict["http_cache"] = dict(yaml_dict.get("http_cache") or {},
+                                       enabled=False)
+
+    if args.serve:
+        from .service import ReportService
+
+        overrides = {"port": args.port, "output_dir": args.output_dir,
+                     "tasks": args.tasks}
+        yaml_dict["service"] = dict(
+            yaml_dict.get("service") or {},
+            **{key: value for key, value in overrides.items() if value})
+        ReportService.from_config(yaml_dict, force=args.force).serve_forever()
+        return 0
+
+    output = OutputManager(args.output_dir or ".", force=args.force,
+                           label=args.period.label if args.period else None)
+    if args.stdout:
+        printer = partial(MarkdownPrinter.print_markdown, sink=sys.stdout)
+    elif len(args.formats) == 1:
+        printer = partial(PRINTERS[args.formats[0]], output=output)
+    else:
+        printer = partial(render_formats, formats=args.formats,
+                          output=output)
+
+    if args.all:
+        batch = run_batch_async if args.use_async else run_batch
+        results, seconds = batch(yaml_dict, workers=args.workers,
+                                 printer=printer,
+                                 incremental=args.incremental,
+                                 tasks=args.tasks, period=args.period)
+        print_summary(results, seconds)
+        return 0 if all(result["ok"] for result in results) else 1
+
+    project = args.project or find_projects(yaml_dict)[0]
+    options = {"incremental": args.incremental, "tasks": args.tasks,
+               "period": args.period}
+    # With --stdout only the report goes to stdout.
+    with redirect_stdout(sys.stderr if args.stdout else sys.stdout):
+        return _run_project(args, yaml_dict, project, printer, options)
+
+
+def _run_project(args, yaml_dict, project, printer, options):
+    """Generate the report of one project, see run().
+
+    RETURNS: int exit code.
+
+    """
+    from .runner import generate_report, generate_report_async
+    from .taiga_api import TaigaAPI
+
+    try:
+        if args.use_async:
+            import asyncio
+
+            from .async_api import AsyncTaigaAPI
+
+            api = AsyncTaigaAPI(project, yaml_dict)
+            try:
+                asyncio.run(generate_report_async(api, project, yaml_dict,
+                                                  printer, **options))
+            finally:
+                api.close()
+        else:
+            api = TaigaAPI(project, yaml_dict)
+            generate_report(api, project, yaml_dict, printer, **options)
+    except ValueError as ex:
+        print(str(ex))
+        return 1
+    except Exception as ex:
+        print(ex)
+        return 1
+    print("Success :)")
+    return 0
+
+
+def main(argv=None):
+    """Run the CLI, optionally profiled, and export its metrics."""
+    from .config import load_config
+
+    args = parse_args(argv)
+    try:
+        yaml_dict = load_config(args.config)
+    except FileNotFoundError as ex:
+        print("Config not found: {}".format(ex.filename))
+        raise SystemExit(1)
+
+    if args.profile:
+        import cProfile
+        import pstats
+
+        profiler = cProfile.Profile()
+        code = profiler.runcall(run, args, yaml_dict)
+        profiler.dump_stats(args.profile)
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(
+            PROFILE_TOP)
+    else:
+        code = run(args, yaml_dict)
+
+    if args.metrics_json or args.metrics_prom:
+        from .metrics import METRICS
+
+        if args.metrics_json:
+            METRICS.write_json(args.metrics_json)
+        if args.metrics_prom:
+            METRICS.write_prometheus(args.metrics_prom)
+    raise SystemExit(code)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+"""Asyncio version of TaigaAPI that downloads the pages concurrently."""
+import asyncio
+import math
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from .epic_catalog import EpicCatalog
+from .json_stream import iter_json_array
+from .metrics import METRICS
+from .report_classes import Task, UserStory
+from .taiga_api import (TaigaAPI, build_session, connection_settings,
+                        task_listings)
+
+
+class AsyncTaigaAPI:
+    """Async API class with the listing methods of TaigaAPI.
+
+    The requests are sent by a TaigaAPI in a thread pool, so the login,
+    stored tokens, response cache, retries and metrics are the same ones.
+    After the first page of a listing, its x-pagination-count and
+    x-paginated-by headers give the number of pages and up to
+    'concurrency' of the remaining ones (see the yaml 'connection' block)
+    are requested at once. Items are still yielded in page order, and at
+    most 'concurrency' pages are held in memory.
+
+    Clients made with for_project() share the session, the thread pool and
+    the event loop, so a batch run downloads every project at once.
+
+    To use:
+        async def main():
+            api = AsyncTaigaAPI("sieel", yaml_dict)
+            async for us in api.iter_user_stories():
+                ...
+            api.close()
+
+        asyncio.run(main())
+
+    """
+
+    def __init__(self, project, yaml_dict, session=None, executor=None):
+        """Init AsyncTaigaAPI with default attr to specific project.
+
+        PARAMETERS:
+            - project: str of the project block in the yaml.
+            - yaml_dict: dict of the parsed api.yaml.
+            - session: optional requests.Session() shared with other
+                clients. A new one is built if none is given.
+            - executor: optional concurrent.futures.Executor() running the
+                requests, shared with other clients. A new one with
+                'concurrency' threads is built if none is given, and shut
+                down by close().
+
+        """
+        self.concurrency = connection_settings(yaml_dict)["concurrency"]
+        self.session = session or build_session(yaml_dict,
+                                                pool_size=self.concurrency)
+        self.api = TaigaAPI(project, yaml_dict, session=self.session)
+        self._owns_executor = executor is None
+        self.executor = executor or ThreadPoolExecutor(
+            max_workers=self.concurrency)
+
+    async def _run(self, func, *args):
+        """Run a blocking call in the thread pool and return its result."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, partial(func, *args))
+
+    def close(self):
+        """Shut the thread pool down if this client created it."""
+        if self._owns_executor:
+            self.executor.shutdown()
+
+    async def _auth(self):
+        """Add auth_token to request headers, see TaigaAPI._auth()."""
+        await self._run(self.api._auth)
+
+    async def for_project(self, project, yaml_dict):
+        """Return a client for another project reusing this login and pool.
+
+        RETURNS: AsyncTaigaAPI() object sharing session, thread pool and
+        auth_token.
+
+        """
+        if not self.api.authenticated:
+            await self._auth()
+        client = AsyncTaigaAPI(project, yaml_dict, session=self.session,
+                               executor=self.executor)
+        client.api.auth_token = self.api.auth_token
+        client.api.refresh_token = self.api.refresh_token
+        # The token is already known, no request is sent.
+        client.api._auth()
+        return client
+
+    async def project_metadata(self):
+        """Get the project id, status ids and tag colors in one request."""
+        return await self._run(self.api.project_metadata)
+
+    async def download_user_stories(self, period=None):
+        """Get every done user story in one unpaginated request."""
+        return await self._run(self.api.download_user_stories, period)
+
+    async def iter_user_stories(self, page_size=None, period=None):
+        """Yield the 'DONE' user stories of the project.
+
+        Works like TaigaAPI.iter_user_stories(), pages are downloaded
+        concurrently.
+
+        RAISES:
+            - requests.exceptions.HTTPError if any page request fails.
+            - ValueError if the project has no user stories. An empty
+                period yields nothing instead.
+
+        """
+        if not self.api.authenticated:
+            await self._auth()
+        done_id = await self._run(self.api._get_done_status)
+        while True:
+            found = False
+            params = {"project": self.api.project_id, "status": done_id}
+            if period is not None:
+                params.update(period.filters())
+            async for us in self._iter_pages("userstories", params,
+                                             page_size, UserStory.FIELDS):
+                found = True
+                yield us
+            if found or self.api.metadata_fresh or period is not None:
+                break
+            # Stale ids from the yaml or the cache, see TaigaAPI.
+            print("No user stories found, checking the project ids.")
+            ids = (self.api.project_id, done_id)
+            if self.api.metadata_cache:
+                self.api.metadata_cache.invalidate()
+            await self._run(self.api._resolve_metadata, True)
+            done_id = self.api.done_status
+            if (self.api.project_id, done_id) == ids:
+                break
+
+        if not found and period is None:
+            raise ValueError("No user stories were found.")
+
+    async def iter_modified_user_stories(self, since, page_size=None):
+        """Yield the user stories of any status modified since a date."""
+        params = {"project": await self._project_id(),
+                  "modified_date__gte": since}
+        async for us in self._iter_pages("userstories", params, page_size,
+                                         UserStory.FIELDS):
+            yield us
+
+    async def iter_tasks(self, page_size=None, user_stories=None,
+                         milestone=None):
+        """Yield every task of the project, see TaigaAPI.iter_tasks()."""
+        for params in task_listings(await self._project_id(), user_stories,
+                                    milestone):
+            async for task in self._iter_pages("tasks", params, page_size,
+                                               Task.FIELDS):
+                yield task
+
+    async def iter_epics(self, page_size=None):
+        """Yield every epic of the project, see TaigaAPI.iter_epics()."""
+        params = {"project": await self._project_id()}
+        async for epic in self._iter_pages("epics", params, page_size,
+                                           EpicCatalog.FIELDS):
+            yield epic
+
+    async def _project_id(self):
+        """Log in if needed and return the project id."""
+        if not self.api.authenticated:
+            await self._auth()
+        return await self._run(self.api._require_project_id)
+
+    async def _iter_pages(self, endpoint, params, page_size=None,
+                          fields=None):
+        """Yield every item of a paginated listing endpoint in page order.
+
+        The first page tells how many there are. The rest are requested by
+        number, keeping up to self.concurrency requests in flight. If the
+        server sends no count, the x-pagination-next links are followed one
+        by one like TaigaAPI._iter_pages() does.
+
+        """
+        url = self.api.host + endpoint
+        params = dict(params, page_size=page_size or self.api.page_size)
+        headers = self.api._paginated_headers()
+        items, response_headers = await self._run(
+            self._fetch_page, url, params, headers, fields)
+        for item in items:
+            yield item
+        pages = self._page_count(response_headers)
+
+        if pages is None:
+            next_url = response_headers.get("x-pagination-next")
+            while next_url:
+                items, response_headers = await self._run(
+                    self._fetch_page, next_url, None, headers, fields)
+                for item in items:
+                    yield item
+                next_url = response_headers.get("x-pagination-next")
+            return
+
+        pending = deque()
+        next_page = 2
+        try:
+            while pending or next_page <= pages:
+                while next_page <= pages and len(pending) < self.concurrency:
+                    pending.append(asyncio.ensure_future(self._run(
+                        self._fetch_page, url, dict(params, page=next_page),
+                        headers, fields)))
+                    next_page += 1
+                items, _ = await pending.popleft()
+                for item in items:
+                    yield item
+        finally:
+            # Pages not consumed yet, e.g. after an error or a break.
+            for future in pending:
+                future.cancel()
+
+    @staticmethod
+    def _page_count(headers):
+        """Return the number of pages of a listing, or None if unknown."""
+        if not headers.get("x-pagination-next"):
+            return 1
+        try:
+            count = int(headers["x-pagination-count"])
+            page_size = int(headers["x-paginated-by"])
+        except (KeyError, ValueError):
+            return None
+        return math.ceil(count / page_size)
+
+    def _fetch_page(self, url, params, headers, fields):
+        """Download and decode one page, runs in the thread pool.
+
+        RETURNS: a (items, headers) tuple of the page.
+
+        RAISES:
+            - requests.exceptions.HTTPError if the request fails.
+
+        """
+        print("Downloading page from {}".format(url))
+        response = self.api._get(url, params=params, headers=headers)
+        response.raise_for_status()
+        with METRICS.phase("body_decode"):
+            items = list(iter_json_array((response.content,), fields))
+        return items, response.headers
@@ -0,0 +1,7 @@
+"""Benchmarks of the report pipeline on synthetic Taiga datasets.
+
+To run:
+    python -m taiga_report.benchmarks --stories 1000 100000 -o bench.json
+    python -m taiga_report.benchmarks --stories 1000 --compare bench.json
+
+"""
@@ -0,0 +1,54 @@
+"""Runs the benchmark suite from the command line."""
+import argparse
+import json
+
+from .suite import STAGES, compare, run_end_to_end, run_suite, save_results
+
+parser = argparse.ArgumentParser(prog="taiga_report.benchmarks",
+                                 description="Benchmark the report pipeline.")
+parser.add_argument("--stories", type=int, nargs="+", default=[1000, 10000],
+                    help="user story counts of the datasets")
+parser.add_argument("--stages", nargs="+", choices=STAGES,
+                    default=[stage for stage in STAGES if stage != "docx"],
+                    help="stages to measure. The slow per-paragraph docx "
+                         "printer is left out by default")
+parser.add_argument("--seed", type=int, default=0)
+parser.add_argument("--no-memory", action="store_true",
+                    help="skip the peak memory runs")
+parser.add_argument("--e2e", action="store_true",
+                    help="also time the whole pipeline against a local stub "
+                         "of the Taiga API")
+parser.add_argument("--latency", type=float, default=0.01,
+                    help="seconds of latency of the stub API with --e2e")
+parser.add_argument("--error-rate", type=float, default=0,
+                    help="share of 503 answers of the stub API with --e2e")
+parser.add_argument("-o", "--output", help="JSON file to save results to")
+parser.add_argument("--compare", help="JSON results of a previous run")
+parser.add_argument("--threshold", type=float, default=0.1,
+                    help="relative slowdown reported as a regression")
+args = parser.parse_args()
+
+results = run_suite(args.stories, args.stages, args.seed,
+                    trace_memory=not args.no_memory)
+if args.e2e:
+    for count in args.stories:
+        results["results"].append(run_end_to_end(
+            count, seed=args.seed, latency=args.latency,
+            error_rate=args.error_rate))
+if args.output:
+    save_results(results, args.output)
+
+if args.compare:
+    with open(args.compare, "r") as file:
+        baseline = json.load(file)
+    rows = compare(baseline, results, args.threshold)
+    print("\nStage        Stories     Time     Memory")
+    for row in rows:
+        print("{:<10} {:>9} {:>8} {:>10} {}".format(
+            row["stage"], row["stories"],
+            "{:.2f}x".format(row["time_ratio"]) if row["time_ratio"] else "-",
+            "{:.2f}x".format(row["memory_ratio"])
+            if row["memory_ratio"] else "-",
+            "REGRESSION" if row["regression"] else ""))
+    if any(row["regression"] for row in rows):
+        raise SystemExit(1)
@@ -0,0 +1,86 @@
+"""Generates seeded, realistic Taiga user story payloads."""
+import datetime as dt
+import random
+
+SECTIONS = ["general", "expedientes", "remitos", "administracion"]
+WORDS = ["alta", "baja", "modificacion", "listado", "reporte", "usuario",
+         "expediente", "remito", "permiso", "filtro", "busqueda", "exportar",
+         "importar", "validacion", "pantalla", "servicio", "notificacion"]
+
+
+def project_yaml(project="bench", sections=None, host="http://localhost/"):
+    """Return a yaml dict with one project block for the given sections."""
+    return {
+        "login_data": {"type": "normal", "username": "bench",
+                       "password": "bench"},
+        "host": host,
+        "headers": {"content-type": "application/json"},
+        project: {"slug": project, "id": 1, "done_id": 35,
+                  "report_sections": list(sections or SECTIONS)},
+    }
+
+
+def generate_user_stories(count, epics=20, tags=None, sections=None, tasks=3,
+                          seed=0,
+                          project_id=1, done_id=35,
+                          start=dt.datetime(2020, 1, 1)):
+    """Yield count user story payloads shaped like Taiga's API responses.
+
+    Besides the fields the report uses, each payload carries the owner,
+    watchers, description and other fields Taiga sends, so decoding costs
+    are realistic. The same seed always yields the same stories.
+
+    PARAMETERS:
+        - count: int of user stories.
+        - epics: int of distinct epics. About a third of the stories have
+            none.
+        - tags: list of extra tag names. Defaults to 20 generic tags.
+        - sections: list of section tags. 90% of the stories get one.
+            Defaults to SECTIONS.
+        - tasks: int of maximum tasks per story.
+        - seed: int seed of the random generator.
+        - project_id: int id of the project.
+        - done_id: int id of the done status.
+        - start: datetime of the first finish date. Each story finishes a
+            few minutes after the previous one.
+
+    """
+    rng = random.Random(seed)
+    tags = tags or ["tag-{}".format(i) for i in range(20)]
+    sections = sections or SECTIONS
+    epic_list = [{"id": 1000 + i, "ref": i + 1, "project": project_id,
+                  "subject": "epic {}".format(" ".join(rng.sample(WORDS, 2))),
+                  "color": "#{:06x}".format(rng.randrange(1 << 24))}
+                 for i in range(epics)]
+    finish = start
+    for us_id in range(1, count + 1):
+        finish += dt.timedelta(minutes=rng.randrange(1, 30))
+        date = finish.strftime("%Y-%m-%dT%H:%M:%S.000Z")
+        us_tags = rng.sample(tags, rng.randrange(0, 3))
+        if rng.random() < 0.9:
+            us_tags.insert(rng.randrange(len(us_tags) + 1),
+                           rng.choice(sections))
+        yield {
+            "id": us_id,
+            "ref": us_id,
+            "project": project_id,
+            "subject": " ".join(rng.choice(WORDS) for _ in range(6)),
+            "status": done_id,
+            "is_closed": True,
+            "epics": ([rng.choice(epic_list)]
+                      if epic_list and rng.random() > 0.33 else None),
+            "tags": [[tag, None] for tag in us_tags],
+            "tasks": [{"id": us_id * 100 + i, "ref": i,
+                       "subject": "task {}".format(i), "is_closed": True}
+                      for i in range(rng.randrange(0, tasks + 1))],
+            "created_date": date,
+            "modified_date": date,
+            "finish_date": date,
+            "owner": rng.randrange(1, 50),
+            "assigned_to": rng.randrange(1, 50),
+            "watchers": rng.sample(range(1, 50), 3),
+            "description": " ".join(rng.choice(WORDS) for _ in range(40)),
+            "total_points": rng.choice([1.0, 2.0, 3.0, 5.0, 8.0]),
+            "milestone": None,
+            "version": 1,
+        }
@@ -0,0 +1,363 @@
+"""Local stand-in of the Taiga API for offline and load tests.
+
+Implements the endpoints TaigaAPI uses, with Taiga's pagination headers,
+ETags, and configurable latency, bandwidth, error rate, 429 throttling and
+token expiry.
+
+To run:
+    python -m taiga_report.benchmarks.stub_server --stories 100000 \\
+        --latency 0.05 --port 8000
+
+and point the 'host' of the yaml to http://localhost:8000/api/v1/.
+
+"""
+import argparse
+import hashlib
+import json
+import random
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+
+from .dataset import generate_user_stories
+
+API_PREFIX = "/api/v1/"
+
+
+class StubTaiga:
+    """State and behaviour of the stub server.
+
+    PARAMETERS:
+        - stories: list of user story payloads served by the API.
+        - project: dict with the 'id' and 'slug' of the only project.
+        - done_id: int id of the done status.
+        - latency: float of seconds added to every response.
+        - bandwidth: int of bytes per second sent, 0 for unlimited.
+        - error_rate: float of the share of requests answered with a 503.
+        - rate_limit: float of requests per second allowed before 429s,
+            0 for unlimited.
+        - token_ttl: float of seconds an auth_token is valid.
+        - seed: int seed of the random errors.
+
+    """
+
+    def __init__(self, stories, project=None, done_id=35, latency=0,
+                 bandwidth=0, error_rate=0, rate_limit=0, token_ttl=3600,
+                 seed=0):
+        self.stories = stories
+        self.project = project or {"id": 1, "slug": "bench"}
+        self.done_id = done_id
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.token_ttl = token_ttl
+        self.tokens = {}
+        self.refresh_tokens = set()
+        self.requests = 0
+        # Filters of each tasks listing, without the project and page.
+        self.task_filters = []
+        self._tasks = None
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._window = (time.monotonic(), 0)
+
+    def statuses(self):
+        """Return the user story statuses of the project."""
+        return [{"id": self.done_id - 1, "slug": "in-progress",
+                 "name": "In progress", "project": self.project["id"]},
+                {"id": self.done_id, "slug": "done", "name": "Done",
+                 "project": self.project["id"]}]
+
+    def tag_colors(self):
+        """Return the [tag, color] pairs of the stories' tags."""
+        colors = {tag[0]: tag[1] for us in self.stories
+                  for tag in us.get("tags") or []}
+        return sorted(colors.items())
+
+    def issue_token(self):
+        """Return a new auth payload with its token and refresh token."""
+        token = secrets.token_hex(16)
+        refresh = secrets.token_hex(16)
+        with self._lock:
+            self.tokens[token] = time.time() + self.token_ttl
+            self.refresh_tokens.add(refresh)
+        return {"auth_token": token, "refresh": refresh}
+
+    def valid_token(self, authorization):
+        """Return True if the Authorization header has a live token."""
+        token = (authorization or "").replace("Bearer ", "", 1)
+        return self.tokens.get(token, 0) > time.time()
+
+    def throttled(self):
+        """Count the request and return True if over the rate limit."""
+        with self._lock:
+            self.requests += 1
+            if not self.rate_limit:
+                return False
+            start, count = self._window
+            now = time.monotonic()
+            if now - start >= 1:
+                start, count = now, 0
+            self._window = (start, count + 1)
+            return count + 1 > self.rate_limit
+
+    def failing(self):
+        """Return True if this request should get a random 503."""
+        with self._lock:
+            return self._random.random() < self.error_rate
+
+    def epics(self):
+        """Return the epics linked to the stories, in backlog order."""
+        epics = {epic["id"]: epic for us in self.stories
+                 for epic in us.get("epics") or []}
+        return [dict(epic, epics_order=position)
+                for position, epic in enumerate(sorted(
+                    epics.values(), key=lambda epic: epic["ref"]))]
+
+    def tasks(self):
+        """Return the full task payloads of the stories' embedded tasks."""
+        if self._tasks is None:
+            self._tasks = [
+                {"id": task["id"], "ref": task["ref"],
+                 "subject": task["subject"], "user_story": us["id"],
+                 "project": self.project["id"],
+                 "is_closed": task["is_closed"],
+                 "status_extra_info": {"name": "Closed" if task[
+                     "is_closed"] else "New", "is_closed": task["is_closed"]},
+                 "assigned_to_extra_info": {
+                     "full_name_display": "User {}".format(us["owner"])},
+                 "finished_date": us.get("finish_date"),
+                 "milestone": us.get("milestone")}
+                for us in self.stories for task in us.get("tasks") or []]
+        return self._tasks
+
+    def filter_tasks(self, query):
+        """Return the tasks matching the query string filters."""
+        if query.get("page", "1") == "1":
+            with self._lock:
+                self.task_filters.append(
+                    {key: value for key, value in query.items()
+                     if key in ("user_story", "milestone")})
+        tasks = self.tasks()
+        if "user_story" in query:
+            us_id = int(query["user_story"])
+            tasks = [task for task in tasks if task["user_story"] == us_id]
+        if "milestone" in query:
+            milestone = int(query["milestone"])
+            tasks = [task for task in tasks if task["milestone"] == milestone]
+        return tasks
+
+    def filter_stories(self, query):
+        """Return the stories matching the query string filters."""
+        stories = self.stories
+        if "status" in query:
+            status = int(query["status"])
+            stories = [us for us in stories if us["status"] == status]
+        if "modified_date__gte" in query:
+            since = query["modified_date__gte"]
+            stories = [us for us in stories if us["modified_date"] >= since]
+        if "finish_date__gte" in query:
+            start = query["finish_date__gte"]
+            stories = [us for us in stories
+                       if (us.get("finish_date") or "") >= start]
+        if "finish_date__lt" in query:
+            end = query["finish_date__lt"]
+            stories = [us for us in stories
+                       if us.get("finish_date") and us["finish_date"] < end]
+        if "milestone" in query:
+            milestone = int(query["milestone"])
+            stories = [us for us in stories
+                       if us.get("milestone") == milestone]
+        return stories
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Answers the requests of one connection for the StubTaiga server."""
+
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def taiga(self):
+        return self.server.taiga
+
+    def log_message(self, format, *args):
+        """Keep the console quiet, load tests send many requests."""
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length) or b"{}")
+        if not self._preflight(auth=False):
+            return
+        path = urlparse(self.path).path[len(API_PREFIX):]
+        if path == "auth":
+            self._send_json(200, self.taiga.issue_token())
+        elif path == "auth/refresh":
+            if body.get("refresh") in self.taiga.refresh_tokens:
+                self._send_json(200, self.taiga.issue_token())
+            else:
+                self._send_json(401, {"detail": "Invalid refresh token"})
+        else:
+            self._send_json(404, {"detail": "Not found"})
+
+    def do_GET(self):
+        if not self._preflight(auth=True):
+            return
+        url = urlparse(self.path)
+        path = url.path[len(API_PREFIX):]
+        query = {key: values[-1] for key, values in parse_qs(
+            url.query).items()}
+        if path == "projects/by_slug":
+            if query.get("slug") != self.taiga.project["slug"]:
+                return self._send_json(404, {"detail": "Not found"})
+            self._send_json(200, dict(self.taiga.project,
+                                      us_statuses=self.taiga.statuses(),
+                                      tags_colors=self.taiga.tag_colors()))
+        elif path == "userstory-statuses":
+            self._send_json(200, self.taiga.statuses())
+        elif path == "userstories":
+            self._send_page(url.path, query,
+                            self.taiga.filter_stories(query))
+        elif path == "epics":
+            self._send_page(url.path, query, self.taiga.epics())
+        elif path == "tasks":
+            self._send_page(url.path, query, self.taiga.filter_tasks(query))
+        else:
+            self._send_json(404, {"detail": "Not found"})
+
+    def _preflight(self, auth):
+        """Apply latency, throttling, random errors and token checks.
+
+        RETURNS: True if the request should be answered normally.
+
+        """
+        if self.taiga.latency:
+            time.sleep(self.taiga.latency)
+        if self.taiga.throttled():
+            self._send_json(429, {"detail": "Request was throttled."},
+                            {"Retry-After": "1"})
+            return False
+        if self.taiga.failing():
+            self._send_json(503, {"detail": "Service unavailable"})
+            return False
+        if auth and not self.taiga.valid_token(
+                self.headers.get("Authorization")):
+            self._send_json(401, {"detail": "Invalid token"})
+            return False
+        return True
+
+    def _send_page(self, path, query, items):
+        """Send items, paginated unless x-disable-pagination is set."""
+        headers = {}
+        if self.headers.get("x-disable-pagination", "").lower() != "true":
+            page = int(query.get("page", 1))
+            page_size = int(query.get("page_size", 30))
+            pages = max(1, -(-len(items) // page_size))
+            if page > pages:
+                return self._send_json(404, {"detail": "Invalid page."})
+            headers = {"x-paginated": "true",
+                       "x-paginated-by": str(page_size),
+                       "x-pagination-count": str(len(items)),
+                       "x-pagination-current": str(page)}
+            if page < pages:
+                next_query = dict(query, page=page + 1)
+                headers["x-pagination-next"] = "http://{}{}?{}".format(
+                    self.headers.get("Host"), path, urlencode(next_query))
+            items = items[(page - 1) * page_size:page * page_size]
+        self._send_json(200, items, headers)
+
+    def _send_json(self, status, payload, headers=None):
+        """Send payload as JSON honouring ETags and the bandwidth limit."""
+        body = json.dumps(payload).encode("utf-8")
+        etag = '"{}"'.format(hashlib.sha1(body).hexdigest())
+        if status == 200 and self.headers.get("If-None-Match") == etag:
+            status, body = 304, b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if status in (200, 304):
+            self.send_header("ETag", etag)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self._write_limited(body)
+
+    def _write_limited(self, body):
+        bandwidth = self.taiga.bandwidth
+        if not bandwidth:
+            self.wfile.write(body)
+            return
+        chunk_size = max(1, bandwidth // 10)
+        for start in range(0, len(body), chunk_size):
+            self.wfile.write(body[start:start + chunk_size])
+            time.sleep(0.1)
+
+
+@contextmanager
+def run_stub_server(taiga, host="127.0.0.1", port=0):
+    """Serve a StubTaiga in a background thread.
+
+    To use:
+        with run_stub_server(StubTaiga(stories)) as api_url:
+            yaml_dict["host"] = api_url
+
+    YIELDS: str of the API root url, e.g. 'http://127.0.0.1:8000/api/v1/'.
+
+    """
+    server = ThreadingHTTPServer((host, port), StubHandler)
+    server.daemon_threads = True
+    server.taiga = taiga
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield "http://{}:{}{}".format(host, server.server_address[1],
+                                      API_PREFIX)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def main():
+    """Serve a generated or recorded dataset until interrupted."""
+    parser = argparse.ArgumentParser(
+        prog="taiga_report.benchmarks.stub_server",
+        description="Serve a local stand-in of the Taiga API.")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--stories", type=int, default=10000,
+                        help="user stories of the generated dataset")
+    parser.add_argument("--dataset",
+                        help="JSON file with recorded user stories to serve "
+                             "instead of a generated dataset")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--latency", type=float, default=0)
+    parser.add_argument("--bandwidth", type=int, default=0,
+                        help="bytes per second, 0 for unlimited")
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--rate-limit", type=float, default=0,
+                        help="requests per second before answering 429")
+    parser.add_argument("--token-ttl", type=float, default=3600)
+    args = parser.parse_args()
+
+    if args.dataset:
+        with open(args.dataset, "r") as file:
+            stories = json.load(file)
+    else:
+        stories = list(generate_user_stories(args.stories, seed=args.seed))
+    taiga = StubTaiga(stories, latency=args.latency,
+                      bandwidth=args.bandwidth, error_rate=args.error_rate,
+                      rate_limit=args.rate_limit, token_ttl=args.token_ttl,
+                      seed=args.seed)
+    with run_stub_server(taiga, "0.0.0.0", args.port) as url:
+        print("Serving {} user stories at {}".format(len(stories), url))
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
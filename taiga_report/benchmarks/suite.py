@@ -0,0 +1,187 @@
+"""Times each stage of the report pipeline and records its peak memory."""
+import gc
+import json
+import platform
+import tempfile
+import time
+import tracemalloc
+from functools import partial
+
+from ..output_manager import OutputManager
+from ..printer_classes import DocxPrinter, MarkdownPrinter
+from ..report_classes import Report, UserStory
+from ..runner import generate_report
+from ..taiga_api import TaigaAPI
+from .dataset import generate_user_stories, project_yaml
+from .stub_server import StubTaiga, run_stub_server
+
+STAGES = ("userstory", "classify", "markdown", "docx", "docx_bulk")
+
+
+def measure(func, trace_memory=True):
+    """Run func and return (seconds, peak bytes, result).
+
+    The time is taken on a run without tracemalloc, which slows Python
+    down, and the peak memory on a second traced run.
+
+    """
+    gc.collect()
+    start = time.perf_counter()
+    result = func()
+    seconds = time.perf_counter() - start
+    peak = None
+    if trace_memory:
+        del result
+        gc.collect()
+        tracemalloc.start()
+        try:
+            result = func()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return seconds, peak, result
+
+
+def _render(printer, report):
+    """Print report into a new directory and return the filename.
+
+    Every measured run gets its own directory, otherwise the traced run
+    would reuse the section cache (see render_cache.SectionCache) of the
+    timed one and only measure cache hits.
+
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        return printer(report, output=OutputManager(directory, force=True))
+
+
+def run_suite(counts, stages=STAGES, seed=0, trace_memory=True):
+    """Benchmark the selected stages for each story count.
+
+    PARAMETERS:
+        - counts: iterable of ints of user stories per dataset.
+        - stages: iterable with any of STAGES.
+        - seed: int seed of the dataset generator.
+        - trace_memory: bool, False skips the peak memory runs.
+
+    RETURNS: dict with the environment and a 'results' list of dicts with
+    the keys 'stage', 'stories', 'seconds' and 'peak_bytes'.
+
+    """
+    yaml_dict = project_yaml()
+    results = []
+
+    def record(stage, count, func):
+        # UserStory and classify always run since the printers need them,
+        # but they are only measured and reported if selected.
+        if stage not in stages:
+            return func()
+        seconds, peak, result = measure(func, trace_memory)
+        results.append({"stage": stage, "stories": count,
+                        "seconds": round(seconds, 6), "peak_bytes": peak})
+        print("{:<10} {:>9} stories {:>10.3f}s {:>12} bytes".format(
+            stage, count, seconds, peak if peak is not None else "-"))
+        return result
+
+    for count in counts:
+        payloads = list(generate_user_stories(count, seed=seed))
+        stories = record("userstory", count,
+                         lambda: [UserStory(us) for us in payloads])
+        del payloads
+
+        def classify():
+            report = Report("bench", yaml_dict)
+            for us in stories:
+                report.classify_user_story(us)
+            return report
+
+        report = record("classify", count, classify)
+
+        printers = {"markdown": MarkdownPrinter.print_markdown,
+                    "docx": DocxPrinter.print_docx,
+                    "docx_bulk": DocxPrinter.print_docx_bulk}
+        for stage, printer in printers.items():
+            if stage in stages:
+                record(stage, count, partial(_render, printer, report))
+
+    return {"python": platform.python_version(),
+            "platform": platform.platform(),
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "seed": seed,
+            "results": results}
+
+
+def run_end_to_end(count, page_size=100, seed=0, **conditions):
+    """Time the whole pipeline against a local stub of the Taiga API.
+
+    Logs in, downloads, classifies and prints the docx report of count
+    generated user stories, like the CLI does.
+
+    PARAMETERS:
+        - count: int of user stories served.
+        - page_size: int of user stories per page.
+        - seed: int seed of the dataset and the random errors.
+        - conditions: keyword arguments of StubTaiga, e.g. latency,
+            bandwidth, error_rate, rate_limit or token_ttl.
+
+    RETURNS: dict with 'stage' ('end_to_end'), 'stories', 'seconds',
+    'requests' and 'peak_bytes' (always None).
+
+    """
+    taiga = StubTaiga(list(generate_user_stories(count, seed=seed)),
+                      seed=seed, **conditions)
+    with run_stub_server(taiga) as url, \
+            tempfile.TemporaryDirectory() as directory:
+        yaml_dict = project_yaml(host=url)
+        yaml_dict["page_size"] = page_size
+        printer = partial(DocxPrinter.print_docx_bulk,
+                          output=OutputManager(directory, force=True))
+        start = time.perf_counter()
+        api = TaigaAPI("bench", yaml_dict)
+        generate_report(api, "bench", yaml_dict, printer)
+        seconds = time.perf_counter() - start
+    print("{:<10} {:>9} stories {:>10.3f}s {:>7} requests".format(
+        "end_to_end", count, seconds, taiga.requests))
+    return {"stage": "end_to_end", "stories": count,
+            "seconds": round(seconds, 6), "requests": taiga.requests,
+            "peak_bytes": None}
+
+
+def save_results(results, path):
+    """Write run_suite() results as JSON."""
+    with open(path, "w") as file:
+        json.dump(results, file, indent=2)
+
+
+def compare(baseline, current, threshold=0.1):
+    """Compare two run_suite() results stage by stage.
+
+    PARAMETERS:
+        - baseline: dict of previous results.
+        - current: dict of new results.
+        - threshold: float of the relative slowdown considered a regression.
+
+    RETURNS: list of dicts with 'stage', 'stories', 'time_ratio',
+    'memory_ratio' and 'regression', for the stages present in both.
+
+    """
+    previous = {(result["stage"], result["stories"]): result
+                for result in baseline["results"]}
+    rows = []
+    for result in current["results"]:
+        old = previous.get((result["stage"], result["stories"]))
+        if not old:
+            continue
+        time_ratio = result["seconds"] / old["seconds"] if old[
+            "seconds"] else None
+        memory_ratio = None
+        if result["peak_bytes"] and old["peak_bytes"]:
+            memory_ratio = result["peak_bytes"] / old["peak_bytes"]
+        rows.append({
+            "stage": result["stage"],
+            "stories": result["stories"],
+            "time_ratio": time_ratio,
+            "memory_ratio": memory_ratio,
+            "regression": any(ratio is not None and ratio > 1 + threshold
+                              for ratio in (time_ratio, memory_ratio)),
+        })
+    return rows
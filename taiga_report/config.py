@@ -0,0 +1,111 @@
+"""Locates, parses and caches the yaml configuration."""
+import hashlib
+import json
+import os
+import tempfile
+
+# Used when neither --config nor TAIGA_REPORT_CONFIG are given.
+DEFAULT_CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              "api.yaml")
+
+_parsed = dict()
+
+
+def config_path(path=None):
+    """Return the absolute path of the config file to use.
+
+    PARAMETERS:
+        - path: optional str given by the user. Defaults to the
+            TAIGA_REPORT_CONFIG environment variable, then to the api.yaml
+            next to this package, regardless of the working directory.
+
+    """
+    return os.path.abspath(
+        path or os.environ.get("TAIGA_REPORT_CONFIG") or DEFAULT_CONFIG)
+
+
+def cache_directory():
+    """Return the directory of the parsed config cache."""
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "taiga_report")
+
+
+def _cache_file(path):
+    digest = hashlib.sha256(path.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(cache_directory(), "config-{}.json".format(digest))
+
+
+def load_config(path=None, use_cache=True):
+    """Return the parsed yaml config, parsing it only when it changed.
+
+    The parsed dict is kept in memory and as JSON in cache_directory(),
+    keyed by the file's path, size and modification time. Later runs load
+    the JSON and never import yaml. The cache is written readable by the
+    user only, as the config holds the login data.
+
+    PARAMETERS:
+        - path: optional str, see config_path().
+        - use_cache: bool, False always parses the yaml.
+
+    RETURNS: a new dict of the parsed config, safe to modify.
+
+    RAISES:
+        - FileNotFoundError if the config file doesn't exist.
+
+    """
+    path = config_path(path)
+    stat = os.stat(path)
+    key = [path, stat.st_size, stat.st_mtime_ns]
+    if use_cache:
+        if _parsed.get(path, (None,))[0] == key:
+            return json.loads(_parsed[path][1])
+        cached = _read_cache(path, key)
+        if cached is not None:
+            _parsed[path] = (key, json.dumps(cached))
+            return cached
+
+    import yaml
+
+    with open(path, "r") as yaml_file:
+        yaml_dict = yaml.load(yaml_file, Loader=yaml.FullLoader)
+    try:
+        data = json.dumps(yaml_dict)
+    except TypeError:
+        # Values JSON can't hold (e.g. dates) are never cached.
+        return yaml_dict
+    _parsed[path] = (key, data)
+    if use_cache:
+        _write_cache(path, key, data)
+    return yaml_dict
+
+
+def _read_cache(path, key):
+    try:
+        with open(_cache_file(path), "r") as file:
+            cached = json.load(file)
+    except (OSError, ValueError):
+        return None
+    if cached.get("key") != key:
+        return None
+    return cached["config"]
+
+
+def _write_cache(path, key, data):
+    directory = cache_directory()
+    try:
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        # makedirs() leaves the mode of an existing directory alone.
+        os.chmod(directory, 0o700)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    except OSError:
+        return
+    try:
+        with os.fdopen(fd, "w") as file:
+            file.write('{{"key": {}, "config": {}}}'.format(
+                json.dumps(key), data))
+        # The login data is in there, keep it readable by the user only.
+        os.chmod(tmp_path, 0o600)
+        os.replace(tmp_path, _cache_file(path))
+    except OSError:
+        os.unlink(tmp_path)
@@ -0,0 +1,116 @@
+"""Keeps the epics of each project, fetched in bulk and cached on disk."""
+import json
+import os
+import tempfile
+import time
+from pathlib import Path
+
+DEFAULT_TTL_MINUTES = 60
+
+
+class EpicCatalog:
+    """Subjects and order of the epics of one project.
+
+    User stories refer to their epics by id and get the subjects from the
+    catalog, so each subject is one str shared by all its stories. Epics
+    are ordered as in Taiga's epics backlog ('epics_order', then 'ref').
+    Epics created after the catalog was fetched keep the subject sent
+    with the story and go after the known ones.
+
+    To use:
+        catalog = EpicCatalog.from_config(api, yaml_dict, project)
+        us = UserStory(us_json, catalog)
+
+    """
+
+    # Keys of the Taiga epic payload kept in the catalog.
+    FIELDS = ("id", "ref", "subject", "epics_order")
+
+    def __init__(self, epics):
+        """Set up attributes for the instance.
+
+        PARAMETERS:
+            - epics: iterable of epic dicts with the FIELDS keys.
+
+        """
+        self.epics = sorted(epics, key=lambda epic: (
+            epic.get("epics_order") or 0, epic.get("ref") or 0))
+        self._subjects = {epic["id"]: epic["subject"] for epic in self.epics}
+        # Epics sharing a subject are listed together in the report, at
+        # the place of the first one.
+        self._positions = dict()
+        for position, epic in enumerate(self.epics):
+            self._positions.setdefault(epic["subject"], position)
+
+    def __len__(self):
+        return len(self.epics)
+
+    @classmethod
+    def from_config(cls, api, yaml_dict, project):
+        """Return the catalog of a project, or None if disabled.
+
+        The optional 'epic_catalog' block of the yaml accepts 'enabled' and
+        'ttl_minutes'. The catalog is enabled by having the block. It is
+        kept under 'cache_dir'/epics and fetched again once it is older
+        than the TTL.
+
+        PARAMETERS:
+            - api: TaigaAPI() object of the project.
+            - yaml_dict: dict of the parsed api.yaml.
+            - project: str of the project block in the yaml.
+
+        """
+        settings = yaml_dict.get("epic_catalog")
+        if not settings or not settings.get("enabled", True):
+            return None
+        cache_dir = yaml_dict.get("cache_dir")
+        if not cache_dir:
+            return cls(api.iter_epics())
+        path = Path(cache_dir) / "epics" / (project + ".json")
+        ttl = settings.get("ttl_minutes", DEFAULT_TTL_MINUTES) * 60
+        epics = cls._read(path, ttl)
+        if epics is None:
+            epics = list(api.iter_epics())
+            cls._write(path, epics)
+        return cls(epics)
+
+    @staticmethod
+    def _read(path, ttl):
+        """Return the cached epics, or None if missing or expired."""
+        try:
+            with open(path, "r") as file:
+                data = json.load(file)
+        except (FileNotFoundError, ValueError):
+            return None
+        if time.time() - data.get("fetched", 0) > ttl:
+            return None
+        return data["epics"]
+
+    @staticmethod
+    def _write(path, epics):
+        """Write the epics with the current time atomically."""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=str(path.parent), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "w") as file:
+                json.dump({"fetched": time.time(), "epics": epics}, file)
+            os.replace(tmp_path, str(path))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def subjects(self, epics):
+        """Return the subjects of the epics of a story payload.
+
+        PARAMETERS:
+            - epics: list of the epic dicts of a user story.
+
+        RETURNS: list of str, the catalog's when the id is known.
+
+        """
+        return [self._subjects.get(epic.get("id"), epic["subject"])
+                for epic in epics]
+
+    def position(self, subject):
+        """Return the sort key of an epic subject, unknown ones last."""
+        return self._positions.get(subject, len(self._positions))
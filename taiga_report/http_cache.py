@@ -0,0 +1,251 @@
+"""Caches API responses on disk and revalidates them with conditional GETs."""
+import atexit
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+try:
+    import fcntl
+except ImportError:  # Windows has no flock, caches fall back to a thread lock.
+    fcntl = None
+
+DEFAULT_MAX_SIZE_MB = 200
+# Response headers kept with the body, the rest are not needed to replay it.
+KEPT_HEADERS = ("content-type", "etag", "last-modified")
+
+
+def _kept_headers(headers):
+    return {name: value for name, value in headers.items()
+            if name.lower() in KEPT_HEADERS
+            or name.lower().startswith("x-pagination")}
+
+
+# One cache per directory, see ResponseCache.shared().
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+class ResponseCache:
+    """Size bounded LRU cache of GET responses with their validators.
+
+    Each body is kept in its own file next to an index.json with the ETag,
+    Last-Modified, replayable headers, size and last use of every entry.
+    When the cache grows over max_bytes the least recently used entries are
+    dropped.
+
+    The index is re-read and merged under a lock on the directory before
+    every write, so instances and processes sharing a directory keep each
+    other's entries. Uses only touch the index in memory, they are saved
+    with the next store() or flush().
+
+    To use:
+        cache = ResponseCache.shared(yaml_dict)
+
+    """
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_SIZE_MB * 2 ** 20):
+        """Set up attributes for the instance.
+
+        PARAMETERS:
+            - directory: str or Path where the index and bodies are kept.
+            - max_bytes: int of the maximum total size of the bodies.
+
+        """
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._index = self._read_index()
+        self._dirty = False
+
+    @classmethod
+    def from_config(cls, yaml_dict):
+        """Build a cache under 'cache_dir'/http, or None if disabled.
+
+        The optional 'http_cache' block of the yaml accepts 'enabled' and
+        'max_size_mb'.
+
+        """
+        settings = yaml_dict.get("http_cache") or {}
+        cache_dir = yaml_dict.get("cache_dir")
+        if not cache_dir or not settings.get("enabled", True):
+            return None
+        max_size_mb = settings.get("max_size_mb", DEFAULT_MAX_SIZE_MB)
+        return cls(Path(cache_dir) / "http", max_size_mb * 2 ** 20)
+
+    @classmethod
+    def shared(cls, yaml_dict):
+        """Return the process-wide cache of these settings, or None.
+
+        Every TaigaAPI (one per project, see TaigaAPI.for_project()) built
+        from the same settings gets the same cache, so they share one index
+        and one size bound. Its pending uses are saved at exit.
+
+        """
+        cache = cls.from_config(yaml_dict)
+        if cache is None:
+            return None
+        key = str(cache.directory.resolve())
+        with _shared_lock:
+            if key not in _shared:
+                _shared[key] = cache
+                atexit.register(cache.flush)
+            return _shared[key]
+
+    @staticmethod
+    def key(url, user=None):
+        """Return the cache key of a full url as seen by user."""
+        return hashlib.sha1("{} {}".format(user, url).encode()).hexdigest()
+
+    def _body_path(self, key):
+        return self.directory / (key + ".body")
+
+    def _read_index(self):
+        try:
+            with open(self.directory / "index.json", "r") as file:
+                return json.load(file)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    @contextmanager
+    def _index_lock(self):
+        """Hold the thread lock and an exclusive flock on the directory."""
+        with self._lock:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            if fcntl is None:
+                yield
+                return
+            fd = os.open(str(self.directory), os.O_RDONLY)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                yield
+            finally:
+                os.close(fd)
+
+    def _write_index(self):
+        """Merge the index on disk into ours, evict and write it back.
+
+        Must be called under _index_lock(). Entries stored by others since
+        the index was read are kept, the most recently used copy of an entry
+        wins.
+
+        """
+        merged = self._read_index()
+        for key, entry in self._index.items():
+            if (key not in merged
+                    or merged[key]["last_used"] <= entry["last_used"]):
+                merged[key] = entry
+        self._index = merged
+        self._evict()
+        self._atomic_write(self.directory / "index.json",
+                           json.dumps(self._index).encode())
+        self._dirty = False
+
+    def _atomic_write(self, path, content):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=str(self.directory),
+                                        prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as file:
+                file.write(content)
+            os.replace(tmp_path, str(path))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def validators(self, key):
+        """Return the conditional request headers for key, if it is cached."""
+        with self._lock:
+            entry = self._index.get(key)
+            if not entry or not self._body_path(key).is_file():
+                return {}
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def store(self, key, response):
+        """Keep a 200 response if the server sent any validator."""
+        etag = response.headers.get("etag")
+        last_modified = response.headers.get("last-modified")
+        if not (etag or last_modified):
+            return
+        content = response.content
+        with self._index_lock():
+            self._atomic_write(self._body_path(key), content)
+            self._index[key] = {"url": response.url,
+                                "etag": etag,
+                                "last_modified": last_modified,
+                                "headers": _kept_headers(response.headers),
+                                "size": len(content),
+                                "last_used": time.time()}
+            self._write_index()
+
+    def load(self, key):
+        """Return the cached response of key as a requests.Response().
+
+        RETURNS: requests.Response() or None if the body is gone.
+
+        """
+        with self._lock:
+            entry = self._index.get(key)
+            if not entry:
+                return None
+            try:
+                content = self._body_path(key).read_bytes()
+            except FileNotFoundError:
+                return None
+            entry["last_used"] = time.time()
+            self._dirty = True
+
+        response = requests.Response()
+        response.status_code = 200
+        response._content = content
+        # Lets iter_content() replay the body, as streamed pages do.
+        response._content_consumed = True
+        response.headers = CaseInsensitiveDict(entry["headers"])
+        response.url = entry["url"]
+        response.encoding = "utf-8"
+        response.from_cache = True
+        return response
+
+    def _evict(self):
+        """Drop least recently used entries until under max_bytes."""
+        total = sum(entry["size"] for entry in self._index.values())
+        by_age = sorted(self._index, key=lambda k: self._index[k]["last_used"])
+        for key in by_age:
+            if total <= self.max_bytes:
+                break
+            total -= self._index.pop(key)["size"]
+            try:
+                self._body_path(key).unlink()
+            except FileNotFoundError:
+                pass
+
+    def flush(self):
+        """Save the last use of loaded entries, if any."""
+        if not self._dirty or not self.directory.is_dir():
+            return
+        with self._index_lock():
+            self._write_index()
+
+    def clear(self):
+        """Remove every cached response."""
+        with self._index_lock():
+            for key in set(self._index) | set(self._read_index()):
+                try:
+                    self._body_path(key).unlink()
+                except FileNotFoundError:
+                    pass
+            self._index = {}
+            self._atomic_write(self.directory / "index.json", b"{}")
+            self._dirty = False
@@ -0,0 +1,82 @@
+"""Decodes JSON arrays incrementally from a stream of chunks."""
+import codecs
+import json
+import re
+
+_decoder = json.JSONDecoder()
+_whitespace = re.compile(r"[ \t\n\r]*")
+
+
+def iter_json_array(chunks, fields=None):
+    """Yield the items of a JSON array as its chunks arrive.
+
+    Only one chunk plus the item being decoded is held in memory, instead of
+    the whole response body and every decoded item at once.
+
+    PARAMETERS:
+        - chunks: iterable of bytes (utf-8) or str pieces of the array, e.g.
+            response.iter_content(chunk_size).
+        - fields: optional iterable of keys. Object items are reduced to
+            these keys as soon as they are decoded so the rest can be freed.
+
+    YIELDS: each decoded item of the array.
+
+    RAISES:
+        - ValueError if the content is not a well formed JSON array.
+
+    """
+    decode = codecs.getincrementaldecoder("utf-8")().decode
+    chunks = iter(chunks)
+    fields = tuple(fields) if fields else None
+    buffer, pos = "", 0
+    started = after_item = False
+    first = True
+
+    while True:
+        pos = _whitespace.match(buffer, pos).end()
+        if pos == len(buffer):
+            chunk = next(chunks, None)
+            if chunk is None:
+                raise ValueError("The JSON array is truncated.")
+            buffer = buffer[pos:] + (
+                chunk if isinstance(chunk, str) else decode(chunk))
+            pos = 0
+            continue
+
+        char = buffer[pos]
+        if not started:
+            if char != "[":
+                raise ValueError("Expected a JSON array.")
+            started = True
+            pos += 1
+        elif char == "]" and (after_item or first):
+            return
+        elif after_item:
+            if char != ",":
+                raise ValueError("Expected ',' between array items.")
+            after_item = False
+            pos += 1
+        else:
+            try:
+                item, end = _decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                item, end = None, None
+            # A scalar touching the end of the buffer may continue in the
+            # next chunk, so it is decoded again with more data.
+            if end is None or (end == len(buffer)
+                               and not isinstance(item, (dict, list))):
+                chunk = next(chunks, None)
+                if chunk is None:
+                    if end is None:
+                        raise ValueError("Invalid JSON array item.")
+                else:
+                    buffer = buffer[pos:] + (
+                        chunk if isinstance(chunk, str) else decode(chunk))
+                    pos = 0
+                    continue
+            if fields and isinstance(item, dict):
+                item = {key: item[key] for key in fields if key in item}
+            yield item
+            pos = end
+            first = False
+            after_item = True
@@ -0,0 +1,130 @@
+"""Collects phase timings, counters and peak memory of a run."""
+import json
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Not available on Windows.
+    resource = None
+
+
+def peak_rss_bytes():
+    """Return the peak resident memory of the process, or None."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, Linux and the BSDs kilobytes.
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class Metrics:
+    """Thread safe registry of phase timers and counters.
+
+    Phases accumulate their seconds and calls, so a phase run by several
+    threads reports the sum of all of them.
+
+    To use:
+        with METRICS.phase("login"):
+            ...
+        METRICS.count("requests")
+        METRICS.write_json("metrics.json")
+
+    """
+
+    def __init__(self):
+        """Set up attributes for the instance."""
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Forget every phase and counter."""
+        with self._lock:
+            self.phases = dict()
+            self.counters = dict()
+
+    @contextmanager
+    def phase(self, name):
+        """Time the enclosed block as one call of the phase name."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def add_time(self, name, seconds, calls=1):
+        """Add seconds measured elsewhere to the phase name."""
+        with self._lock:
+            phase = self.phases.setdefault(name, {"seconds": 0.0, "calls": 0})
+            phase["seconds"] += seconds
+            phase["calls"] += calls
+
+    def count(self, name, value=1):
+        """Increase the counter name by value."""
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def merge(self, snapshot):
+        """Add the phases and counters of another snapshot().
+
+        Used for the metrics of worker processes. Their peak memory is
+        not merged, it is not the one of this process.
+
+        """
+        for name, phase in snapshot["phases"].items():
+            self.add_time(name, phase["seconds"], phase["calls"])
+        for name, value in snapshot["counters"].items():
+            self.count(name, value)
+
+    def snapshot(self):
+        """Return the metrics and the peak memory as a dict."""
+        with self._lock:
+            data = {"phases": {name: dict(phase)
+                               for name, phase in self.phases.items()},
+                    "counters": dict(self.counters)}
+        data["memory"] = {"peak_rss_bytes": peak_rss_bytes()}
+        if tracemalloc.is_tracing():
+            data["memory"]["peak_traced_bytes"] = (
+                tracemalloc.get_traced_memory()[1])
+        return data
+
+    def to_json(self):
+        """Return snapshot() as a JSON str."""
+        return json.dumps(self.snapshot(), indent=2)
+
+    def to_prometheus(self, prefix="taiga_report"):
+        """Return snapshot() in the Prometheus text exposition format."""
+        data = self.snapshot()
+        lines = ["# TYPE {}_phase_seconds_total counter".format(prefix)]
+        lines.extend('{}_phase_seconds_total{{phase="{}"}} {}'.format(
+            prefix, name, phase["seconds"])
+            for name, phase in sorted(data["phases"].items()))
+        lines.append("# TYPE {}_phase_calls_total counter".format(prefix))
+        lines.extend('{}_phase_calls_total{{phase="{}"}} {}'.format(
+            prefix, name, phase["calls"])
+            for name, phase in sorted(data["phases"].items()))
+        for name, value in sorted(data["counters"].items()):
+            lines.append("# TYPE {}_{}_total counter".format(prefix, name))
+            lines.append("{}_{}_total {}".format(prefix, name, value))
+        for name, value in sorted(data["memory"].items()):
+            if value is not None:
+                lines.append("# TYPE {}_{} gauge".format(prefix, name))
+                lines.append("{}_{} {}".format(prefix, name, value))
+        return "\n".join(lines) + "\n"
+
+    def write_json(self, path):
+        """Write the metrics as JSON to path."""
+        with open(path, "w") as file:
+            file.write(self.to_json())
+
+    def write_prometheus(self, path):
+        """Write the metrics in Prometheus text format to path."""
+        with open(path, "w") as file:
+            file.write(self.to_prometheus())
+
+
+# Process wide registry used by TaigaAPI, Report and the printers.
+METRICS = Metrics()
@@ -0,0 +1,275 @@
+"""Names, versions and deduplicates the report files."""
+import datetime as dt
+import errno
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+from . import render_cache
+from .render_cache import SectionCache
+
+try:
+    import fcntl
+except ImportError:  # Windows has no flock, runs fall back to a thread lock.
+    fcntl = None
+
+MANIFEST = ".report_hashes.json"
+# Directory of the rendered sections, see render_cache.SectionCache.
+SECTION_CACHE = ".section_cache"
+
+
+def _read_umask():
+    # The umask can only be read by replacing it, so it is done once, at
+    # import time, before any thread creates files.
+    umask = os.umask(0o022)
+    os.umask(umask)
+    return umask
+
+
+# Mode of the files open() creates, for files made with mkstemp() (0o600).
+FILE_MODE = 0o666 & ~_read_umask()
+
+
+class OutputManager:
+    """Assigns versioned report filenames inside an output directory.
+
+    Reports are named '<project>_report_<label>[_<version>]<ext>', where the
+    label defaults to the current 'MM-YYYY'. Reports are written to a
+    hidden temporary file and then hard linked to the next free version
+    (or moved to a name created exclusively, where there are no hard
+    links), which fails if another run took the name first. So concurrent
+    runs never get the same name, and a failed run leaves no empty or
+    partial report behind. A manifest keeps the content hash of every report,
+    which lets printers skip reports identical to the latest version.
+
+    To use:
+        output = OutputManager("reports")
+        tmp_path, digest = output.start(report, ".md")
+        ...
+        filename = output.publish(tmp_path, report.project, ".md")
+
+    """
+
+    _lock = threading.Lock()
+
+    def __init__(self, directory=".", label=None, force=False):
+        """Set up attributes for the instance.
+
+        PARAMETERS:
+            - directory: str or Path where the reports are written.
+            - label: str identifying the report period. Defaults to the
+                'MM-YYYY' of the day each report is written, so a long
+                running service follows the month.
+            - force: bool, True writes new versions even if unchanged.
+
+        """
+        self.directory = Path(directory)
+        self._label = label
+        self.force = force
+
+    @property
+    def label(self):
+        """Return the given label, or the current 'MM-YYYY'."""
+        if self._label is not None:
+            return self._label
+        today = dt.date.today()
+        return "{}-{}".format(str(today.month).rjust(2, "0"), today.year)
+
+    def base_name(self, project):
+        """Return the filename of a project's report without version."""
+        return "{}_report_{}".format(project, self.label)
+
+    def versions(self, project, ext):
+        """Return the existing versions of a report as a sorted list.
+
+        The unversioned file counts as version 0.
+
+        RETURNS: list of (int version, str filename) tuples.
+
+        """
+        pattern = re.compile(r"^{}(?:_(\d+))?{}$".format(
+            re.escape(self.base_name(project)), re.escape(ext)))
+        found = []
+        try:
+            entries = os.scandir(str(self.directory))
+        except FileNotFoundError:
+            return found
+        with entries:
+            for entry in entries:
+                match = pattern.match(entry.name)
+                if match:
+                    found.append((int(match.group(1) or 0), entry.name))
+        return sorted(found)
+
+    def _filename(self, project, ext, version):
+        suffix = "_{}".format(version) if version else ""
+        return self.base_name(project) + suffix + ext
+
+    def next_filename(self, project, ext):
+        """Return the filename of the next version, without creating it."""
+        versions = self.versions(project, ext)
+        version = versions[-1][0] + 1 if versions else 0
+        return self._filename(project, ext, version)
+
+    def reserve(self, ext):
+        """Create a hidden temporary file for a report to be written to.
+
+        RETURNS: str of the path of the temporary file, see publish().
+
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=str(self.directory),
+                                        prefix=".tmp-", suffix=ext)
+        os.close(fd)
+        # mkstemp() creates the file readable by its owner only.
+        os.chmod(tmp_path, FILE_MODE)
+        return tmp_path
+
+    def publish(self, tmp_path, project, ext):
+        """Move a written report to the next version of its filename.
+
+        PARAMETERS:
+            - tmp_path: str of the file returned by reserve().
+            - project: str of the project title.
+            - ext: str of the extension of the report.
+
+        RETURNS: str of the path of the report.
+
+        """
+        versions = self.versions(project, ext)
+        version = versions[-1][0] + 1 if versions else 0
+        while True:
+            path = self.directory / self._filename(project, ext, version)
+            try:
+                self._claim(tmp_path, str(path))
+            except FileExistsError:
+                version += 1
+                continue
+            return str(path)
+
+    @staticmethod
+    def _claim(tmp_path, path):
+        """Move tmp_path to path, raising FileExistsError if it is taken.
+
+        Unlike a rename, a link never replaces an existing file. Where hard
+        links are not supported, the name is created exclusively and then
+        replaced by the report.
+
+        """
+        try:
+            os.link(tmp_path, path)
+        except FileExistsError:
+            raise
+        except OSError as ex:
+            if ex.errno not in (errno.EPERM, errno.ENOTSUP, errno.EOPNOTSUPP):
+                raise
+            os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY,
+                             FILE_MODE))
+            try:
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.unlink(path)
+                raise
+            return
+        os.unlink(tmp_path)
+
+    @staticmethod
+    def content_hash(report):
+        """Return the sha256 of the data a report is rendered from.
+
+        The renderer version is part of it, so a report whose data didn't
+        change is still written again by a new renderer.
+
+        """
+        data = [report.project, report._report_sections, report._report,
+                render_cache.RENDER_VERSION]
+        # Only reports with task details hash them, so the hashes of
+        # reports without tasks stay the same.
+        if report._tasks:
+            data.append(report._tasks)
+        data = json.dumps(data, separators=(",", ":"))
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+    def _manifest_path(self):
+        return self.directory / MANIFEST
+
+    def _read_manifest(self):
+        try:
+            with open(self._manifest_path(), "r") as file:
+                return json.load(file)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def unchanged(self, project, ext, digest):
+        """Return the latest report filename if its hash is digest."""
+        if self.force:
+            return None
+        versions = self.versions(project, ext)
+        if not versions:
+            return None
+        latest = versions[-1][1]
+        if self._read_manifest().get(latest) == digest:
+            return str(self.directory / latest)
+        return None
+
+    @contextmanager
+    def _manifest_lock(self):
+        """Hold an exclusive lock on the manifest.
+
+        The manifest is replaced on every write, so the flock is taken on
+        the output directory instead. This keeps reports rendered by other
+        processes (see runner.render_formats()) from losing each other's
+        hashes, without leaving a lock file next to the reports.
+
+        """
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            fd = os.open(str(self.directory), os.O_RDONLY)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                yield
+            finally:
+                os.close(fd)
+
+    def record(self, filename, digest):
+        """Store the content hash of a written report."""
+        with self._manifest_lock():
+            manifest = self._read_manifest()
+            manifest[os.path.basename(filename)] = digest
+            fd, tmp_path = tempfile.mkstemp(dir=str(self.directory),
+                                            prefix=".tmp-")
+            try:
+                with os.fdopen(fd, "w") as file:
+                    json.dump(manifest, file)
+                os.replace(tmp_path, str(self._manifest_path()))
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+
+    def section_cache(self, project, ext):
+        """Return the SectionCache of a project's reports in a format."""
+        return SectionCache(self.directory / SECTION_CACHE /
+                            "{}{}.json".format(project, ext))
+
+    def start(self, report, ext):
+        """Reserve the file of a new report unless it would be unchanged.
+
+        RETURNS: a (filename, digest) tuple. digest is None when the latest
+        version already has this content, and filename is that version.
+        Otherwise filename is the temporary file to write the report to
+        and publish().
+
+        """
+        digest = self.content_hash(report)
+        latest = self.unchanged(report.project, ext, digest)
+        if latest:
+            print("Report unchanged, keeping " + latest)
+            return latest, None
+        return self.reserve(ext), digest
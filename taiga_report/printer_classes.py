@@ -1,7 +1,11 @@
 """Contains classes for the different report printers."""
-import datetime as dt
-from pathlib import Path
-from docx import Document
+import io
+import os
+from xml.sax.saxutils import escape
+
+from . import render_cache
+from .metrics import METRICS
+from .output_manager import OutputManager
 
 
 class Printer:
@@ -33,41 +37,174 @@ class Printer:
         if not cls.ext:
             raise Exception("No report extension was detected. Use a specific"
                             " format printer instead")
-        year = dt.date.today().year
-        month = str(dt.date.today().month).rjust(2, "0")
-        filename = project + "_report_{}-{}".format(month, year)
-        if Path(filename + cls.ext).is_file():
-            filename += "_1"
-        while Path(filename + cls.ext).is_file():
-            filename = filename.replace(filename[-1], str(int(filename[-1])+1))
-        filename += cls.ext
+        return OutputManager().next_filename(project, cls.ext)
+
+    @classmethod
+    def _write_output(cls, report, output, write):
+        """Write the report file and record its content hash.
+
+        The report is written to a temporary file that only gets its
+        versioned name once it is complete. Nothing is rendered when the
+        latest version of the report already has the same content.
+
+        ARGS:
+            - report: Report() object containing the US info
+            - output: OutputManager() object or None for the defaults.
+            - write: callable that receives the filename and a
+                SectionCache() of the output, and writes the report.
+
+        RETURNS: str of the filename of the report.
+
+        """
+        if not cls.ext:
+            raise Exception("No report extension was detected. Use a specific"
+                            " format printer instead")
+        output = output or OutputManager()
+        filename, digest = output.start(report, cls.ext)
+        if digest is None:
+            return filename
+        cache = output.section_cache(report.project, cls.ext)
+        try:
+            with METRICS.phase("render_" + cls.ext.lstrip(".")):
+                write(filename, cache)
+            filename = output.publish(filename, report.project, cls.ext)
+        except BaseException:
+            if os.path.exists(filename):
+                os.unlink(filename)
+            raise
+        cache.save()
+        output.record(filename, digest)
         return filename
 
 
+class BufferedSink:
+    """Collects small writes and passes them on to a sink in large chunks.
+
+    The sink can be any text or binary file-like object: a file, stdout,
+    a pipe or an io.StringIO/io.BytesIO. Binary sinks get utf-8 bytes.
+
+    To use:
+        with BufferedSink(sys.stdout) as file:
+            file.write("text")
+
+    """
+
+    def __init__(self, sink, buffer_size=64 * 1024):
+        """Set up attributes for the instance.
+
+        PARAMETERS:
+            - sink: file-like object with a write() method.
+            - buffer_size: int of characters gathered before each write.
+
+        """
+        self.sink = sink
+        self.buffer_size = buffer_size
+        self.binary = self._is_binary(sink)
+        self._parts = []
+        self._size = 0
+
+    @staticmethod
+    def _is_binary(sink):
+        if isinstance(sink, io.TextIOBase):
+            return False
+        if isinstance(sink, (io.RawIOBase, io.BufferedIOBase)):
+            return True
+        return "b" in getattr(sink, "mode", "")
+
+    def write(self, text):
+        """Buffer text, writing it out when the buffer is full."""
+        self._parts.append(text)
+        self._size += len(text)
+        if self._size >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        """Write everything buffered to the sink."""
+        if not self._parts:
+            return
+        chunk = "".join(self._parts)
+        self.sink.write(chunk.encode("utf-8") if self.binary else chunk)
+        self._parts = []
+        self._size = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.flush()
+
+
 class MarkdownPrinter(Printer):
     """Prints the report in markdown format.
 
     To use:
         MarkdownPrinter.print_markdown(report)
+        MarkdownPrinter.print_markdown(report, sink=sys.stdout)
 
     """
 
     ext = ".md"
 
     @classmethod
-    def print_markdown(cls, report):
-        """Print the report in markdown format into a file.
+    def print_markdown(cls, report, sink=None, output=None):
+        """Print the report in markdown format into a file or a sink.
+
+        Without a sink the report goes to a new versioned file, which is
+        written to a temporary file first and moved into place, so a
+        half-written report never shows up under the final name. If the
+        report didn't change since the latest version, nothing is written.
 
         ARGS:
             - report: Report() object containing the US info
+            - sink: optional text or binary file-like object to stream the
+                report into instead of a file.
+            - output: optional OutputManager() deciding the filename.
+
+        RETURNS: str of the report filename, or None if a sink was given.
 
         """
-        filename = cls._check_filename(report.project)
-        with open(filename, "a+") as file:
+        if sink is not None:
+            cls.write_markdown(report, sink)
+            return None
+        return cls._write_output(report, output, lambda filename, cache:
+                                 cls._write_markdown_file(report, filename,
+                                                          cache))
+
+    @classmethod
+    def _write_markdown_file(cls, report, filename, cache=None):
+        """Write the report to filename."""
+        with open(filename, "wb") as file:
+            cls.write_markdown(report, file, cache)
+
+    @classmethod
+    def write_markdown(cls, report, sink, cache=None):
+        """Stream the report in markdown format into a sink.
+
+        ARGS:
+            - report: Report() object containing the US info
+            - sink: text or binary file-like object.
+            - cache: optional SectionCache(). Only the sections that
+                changed since it was saved are rendered.
+
+        """
+        with BufferedSink(sink) as file:
             file.write(cls.md_title(report.project))
             for section in report._report_sections:
-                if section in report._report:
+                if section not in report._report:
+                    continue
+                if cache is None:
                     cls._print_section_md(section, file, report)
+                else:
+                    file.write(cache.render(section, report, lambda: (
+                        cls._section_md(section, report)),
+                        extra=render_cache.RENDER_VERSION))
+
+    @classmethod
+    def _section_md(cls, section, report):
+        """Return a section with it's epics and US as a str."""
+        buffer = io.StringIO()
+        cls._print_section_md(section, buffer, report)
+        return buffer.getvalue()
 
     @classmethod
     def _print_section_md(cls, section, file, report):
@@ -82,7 +219,8 @@ class MarkdownPrinter(Printer):
         file.write(cls.md_section(section))
         rep_section = report._report[section]
         if rep_section.get("user_stories"):
-            cls._print_userstories_md(rep_section["user_stories"], file)
+            cls._print_userstories_md(rep_section["user_stories"], file,
+                                      report._tasks)
 
         for epic in report._report[section]:
             if epic == "user_stories":
@@ -102,19 +240,25 @@ class MarkdownPrinter(Printer):
 
         """
         file.write(cls.md_epic(epic))
-        cls._print_userstories_md(report._report[section][epic], file)
+        cls._print_userstories_md(report._report[section][epic], file,
+                                  report._tasks)
 
     @classmethod
-    def _print_userstories_md(cls, userstories, file):
+    def _print_userstories_md(cls, userstories, file, tasks=None):
         """Write US to a file.
 
         PARAMETERS:
-            - userstories: List of US
+            - userstories: List of (subject, id) pairs of US
             - file: file-like object to which to print to
+            - tasks: optional dict of US id: list of task lines, see
+                Report.add_tasks().
 
         """
-        for us in userstories:
+        tasks = tasks or {}
+        for us, us_id in userstories:
             file.write(cls.md_user_story(us))
+            for task in tasks.get(us_id, ()):
+                file.write(cls.md_task(task))
         # Add one final newline to separate from other parts of the report
         file.write("\n")
 
@@ -166,10 +310,25 @@ class MarkdownPrinter(Printer):
         """
         return "* {}\n".format(content.capitalize())
 
+    @classmethod
+    def md_task(cls, content):
+        """Format content string as a nested Markdown list item.
+
+        PARAMETERS:
+            - content: string with a task of a user story.
+
+        RETURNS: str formatted as a list item under the user story.
+
+        """
+        return "    * {}\n".format(content)
+
 
 class DocxPrinter(Printer):
     """Prints the report in docx format.
 
+    python-docx and lxml are imported on first use, so runs that only
+    print markdown never load them.
+
     To use:
         DocxPrinter.print_markdown(report)
 
@@ -178,20 +337,176 @@ class DocxPrinter(Printer):
     ext = ".docx"
 
     @classmethod
-    def print_docx(cls, report):
+    def print_docx(cls, report, output=None):
         """Print the report in Microsoft Word format into a file.
 
         ARGS:
             - report: Report() object containing the US info
+            - output: optional OutputManager() deciding the filename.
+
+        RETURNS: str of the report filename.
 
         """
-        filename = cls._check_filename(report.project)
-        document = Document()
-        cls.docx_title(document, report.project)
+        def write(filename, cache):
+            from docx import Document
+            document = Document()
+            cls.docx_title(document, report.project)
+            # Shares the cached sections of print_docx_bulk(), both print
+            # the same paragraphs.
+            style_ids = cls.style_ids(document)
+            body = document.element.body
+            for section in report._report_sections:
+                if section not in report._report:
+                    continue
+                size = len(body)
+                xml = cache.render(section, report, lambda: (
+                    cls._print_section_docx_xml(section, document, report)),
+                    extra=[render_cache.RENDER_VERSION, style_ids])
+                if len(body) == size:
+                    # A cache hit, nothing was printed.
+                    cls.insert_body_xml(document, xml)
+            with METRICS.phase("docx_save"):
+                document.save(filename)
+
+        return cls._write_output(report, output, write)
+
+    @classmethod
+    def print_docx_bulk(cls, report, output=None):
+        """Print the report in Microsoft Word format in one XML pass.
+
+        Produces the same document as print_docx(), but the body XML is
+        built as one string straight from the report json and parsed once
+        with lxml, instead of one python-docx call per paragraph. Much
+        faster for reports with thousands of user stories.
+
+        ARGS:
+            - report: Report() object containing the US info
+            - output: optional OutputManager() deciding the filename.
+
+        RETURNS: str of the report filename.
+
+        """
+        def write(filename, cache):
+            from docx import Document
+            document = Document()
+            cls.insert_body_xml(document,
+                                cls.docx_body_xml(report, document, cache))
+            with METRICS.phase("docx_save"):
+                document.save(filename)
+
+        return cls._write_output(report, output, write)
+
+    @classmethod
+    def docx_body_xml(cls, report, document, cache=None):
+        """Return the WordprocessingML paragraphs of the whole report.
+
+        PARAMETERS:
+            - report: Report() object containing the US info.
+            - document: docx.Document() whose styles are used.
+            - cache: optional SectionCache(). Only the sections that
+                changed since it was saved are rendered.
+
+        RETURNS: str of concatenated <w:p> elements.
+
+        """
+        style_ids = cls.style_ids(document)
+        parts = [cls._paragraph_xml(report.project.capitalize(),
+                                    style_ids["title"])]
         for section in report._report_sections:
-            if section in report._report:
-                cls._print_section_docx(section, document, report)
-        document.save(filename)
+            if section not in report._report:
+                continue
+            if cache is None:
+                parts.append(cls._section_xml(section, report, style_ids))
+            else:
+                # The XML refers to the styles, a new template renders it
+                # again.
+                parts.append(cache.render(section, report, lambda: (
+                    cls._section_xml(section, report, style_ids)),
+                    extra=[render_cache.RENDER_VERSION, style_ids]))
+        return "".join(parts)
+
+    @classmethod
+    def style_ids(cls, document):
+        """Return the style ids used by each kind of paragraph.
+
+        Looked up once per document instead of once per paragraph.
+
+        """
+        styles = document.styles
+        return {"title": styles["Title"].style_id,
+                "section": styles["Heading 1"].style_id,
+                "epic": styles["Heading 5"].style_id,
+                "user_story": styles["List Bullet 2"].style_id,
+                "task": styles["List Bullet 3"].style_id}
+
+    @classmethod
+    def _section_xml(cls, section, report, style_ids):
+        """Return the paragraphs of a section with it's epics and US.
+
+        PARAMETERS:
+            - section: string of a section of the report.
+            - report: Report() object containing the US info.
+            - style_ids: dict returned by style_ids().
+
+        RETURNS: str of concatenated <w:p> elements.
+
+        """
+        paragraph = cls._paragraph_xml
+        rep_section = report._report[section]
+        parts = [paragraph(section.capitalize(), style_ids["section"])]
+        cls._userstories_xml(rep_section.get("user_stories") or [], report,
+                             style_ids, parts)
+        for epic, userstories in rep_section.items():
+            if epic == "user_stories":
+                continue
+            parts.append(paragraph(epic.capitalize(), style_ids["epic"]))
+            cls._userstories_xml(userstories, report, style_ids, parts)
+        return "".join(parts)
+
+    @classmethod
+    def _userstories_xml(cls, userstories, report, style_ids, parts):
+        """Append the paragraphs of US, and of their tasks, to parts."""
+        paragraph = cls._paragraph_xml
+        us_style = style_ids["user_story"]
+        if not report._tasks:
+            parts.extend(paragraph(us.capitalize(), us_style)
+                         for us, _ in userstories)
+            return
+        for us, us_id in userstories:
+            parts.append(paragraph(us.capitalize(), us_style))
+            parts.extend(paragraph(task, style_ids["task"])
+                         for task in report._tasks.get(us_id, ()))
+
+    @staticmethod
+    def _paragraph_xml(text, style_id):
+        """Return a <w:p> element of a single run of text as a str."""
+        return ('<w:p><w:pPr><w:pStyle w:val="{}"/></w:pPr><w:r>'
+                '<w:t xml:space="preserve">{}</w:t></w:r></w:p>').format(
+                    style_id, escape(text))
+
+    @classmethod
+    def insert_body_xml(cls, document, body_xml):
+        """Parse the paragraphs once and add them to the document body.
+
+        PARAMETERS:
+            - document: docx.Document() object to which the function prints to.
+            - body_xml: str of concatenated <w:p> elements.
+
+        """
+        from docx.oxml.ns import nsdecls
+        from lxml import etree
+
+        body = document.element.body
+        parsed = etree.fromstring(
+            "<w:body {}>{}</w:body>".format(nsdecls("w"), body_xml))
+        # Paragraphs go before the final section properties, like
+        # python-docx's add_paragraph() does.
+        sect_pr = body.sectPr
+        for element in list(parsed):
+            if sect_pr is not None:
+                sect_pr.addprevious(element)
+            else:
+                body.append(element)
 
     @classmethod
     def _print_section_docx(cls, section, document, report):
@@ -206,7 +521,8 @@ class DocxPrinter(Printer):
         cls.docx_section(document, section)
         rep_section = report._report[section]
         if rep_section.get("user_stories"):
-            cls._print_userstories_docx(rep_section["user_stories"], document)
+            cls._print_userstories_docx(rep_section["user_stories"], document,
+                                        report._tasks)
 
         for epic in report._report[section]:
             if epic == "user_stories":
@@ -214,6 +530,22 @@ class DocxPrinter(Printer):
 
             cls._print_epic_docx(section, epic, document, report)
 
+    @classmethod
+    def _print_section_docx_xml(cls, section, document, report):
+        """Write a section to a Document() and return its paragraphs.
+
+        RETURNS: str of the <w:p> elements added, to be cached.
+
+        """
+        from lxml import etree
+
+        body = document.element.body
+        start = len(body) - (body.sectPr is not None)
+        cls._print_section_docx(section, document, report)
+        end = len(body) - (body.sectPr is not None)
+        return "".join(etree.tostring(element, encoding="unicode")
+                       for element in body[start:end])
+
     @classmethod
     def _print_epic_docx(cls, section, epic, document, report):
         """Write an epic with it's US to a section in a Document().
@@ -226,19 +558,25 @@ class DocxPrinter(Printer):
 
         """
         cls.docx_epic(document, epic)
-        cls._print_userstories_docx(report._report[section][epic], document)
+        cls._print_userstories_docx(report._report[section][epic], document,
+                                    report._tasks)
 
     @classmethod
-    def _print_userstories_docx(cls, userstories, document):
+    def _print_userstories_docx(cls, userstories, document, tasks=None):
         """Write US to a Document().
 
         PARAMETERS:
-            - userstories: List of US
+            - userstories: List of (subject, id) pairs of US
             - document: docx.Document() object to which the function prints to.
+            - tasks: optional dict of US id: list of task lines, see
+                Report.add_tasks().
 
         """
-        for us in userstories:
+        tasks = tasks or {}
+        for us, us_id in userstories:
             cls.docx_user_story(document, us)
+            for task in tasks.get(us_id, ()):
+                cls.docx_task(document, task)
 
     @classmethod
     def docx_title(cls, document, content):
@@ -280,6 +618,19 @@ class DocxPrinter(Printer):
         return document.add_paragraph(content.capitalize(),
                                       style='List Bullet 2')
 
+    @classmethod
+    def docx_task(cls, document, content):
+        """Format content string as a nested Microsoft Word Bullet List Item.
+
+        PARAMETERS:
+            - document: docx.Document() object to which the function prints to.
+            - content: string with a task of a user story.
+
+        RETURNS: the paragraph of the task.
+
+        """
+        return document.add_paragraph(content, style='List Bullet 3')
+
     @classmethod
     def docx_epic(cls, document, content):
         """Format content string as Microsoft Word Heading 2.
@@ -292,3 +643,10 @@ class DocxPrinter(Printer):
 
         """
         return document.add_heading(content.capitalize(), level=5)
+
+
+# Printers selectable by format name, e.g. with the CLI's --format.
+PRINTERS = {
+    "md": MarkdownPrinter.print_markdown,
+    "docx": DocxPrinter.print_docx_bulk,
+}
@@ -0,0 +1,112 @@
+"""Resolves the ids a project's requests need and caches them on disk."""
+import json
+import os
+import tempfile
+import time
+from pathlib import Path
+
+# Project and status ids rarely change, a day is a safe default.
+DEFAULT_TTL_MINUTES = 24 * 60
+
+
+class ProjectMetadata:
+    """Project id, user story status ids and tag colors of one project.
+
+    Everything comes from one projects/by_slug response, which embeds the
+    project's user story statuses and tag colors.
+
+    """
+
+    def __init__(self, data):
+        """Set up attributes for the instance.
+
+        PARAMETERS:
+            - data: dict of a projects/by_slug response, or of to_json().
+
+        """
+        self.id = data["id"]
+        self.slug = data.get("slug")
+        self.statuses = {status["slug"]: status["id"]
+                         for status in data.get("us_statuses") or []}
+        colors = data.get("tags_colors") or {}
+        # Taiga sends [tag, color] pairs, older versions a dict.
+        self.tag_colors = dict(colors)
+
+    def status_id(self, slug):
+        """Return the id of the user story status slug, or None."""
+        return self.statuses.get(slug)
+
+    def to_json(self):
+        """Return the metadata as a dict accepted by __init__()."""
+        return {"id": self.id, "slug": self.slug,
+                "us_statuses": [{"slug": slug, "id": status_id}
+                                for slug, status_id in self.statuses.items()],
+                "tags_colors": self.tag_colors}
+
+
+class MetadataCache:
+    """Keeps the ProjectMetadata of one project on disk for a while.
+
+    To use:
+        cache = MetadataCache.from_config(yaml_dict, project)
+        metadata = cache.get()
+
+    """
+
+    def __init__(self, path, ttl=DEFAULT_TTL_MINUTES * 60):
+        """Set up attributes for the instance.
+
+        PARAMETERS:
+            - path: str or Path of the JSON file.
+            - ttl: float of seconds the metadata is trusted.
+
+        """
+        self.path = Path(path)
+        self.ttl = ttl
+
+    @classmethod
+    def from_config(cls, yaml_dict, project):
+        """Build the cache of a project under 'cache_dir', or None.
+
+        The optional 'project_metadata' block of the yaml accepts
+        'ttl_minutes'.
+
+        """
+        cache_dir = yaml_dict.get("cache_dir")
+        if not cache_dir:
+            return None
+        settings = yaml_dict.get("project_metadata") or {}
+        ttl = settings.get("ttl_minutes", DEFAULT_TTL_MINUTES) * 60
+        return cls(Path(cache_dir) / "projects" / (project + ".json"), ttl)
+
+    def get(self):
+        """Return the cached ProjectMetadata, or None if missing or old."""
+        try:
+            with open(self.path, "r") as file:
+                data = json.load(file)
+        except (FileNotFoundError, ValueError):
+            return None
+        if time.time() - data.get("fetched", 0) > self.ttl:
+            return None
+        return ProjectMetadata(data["metadata"])
+
+    def save(self, metadata):
+        """Write the metadata with the current time atomically."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=str(self.path.parent),
+                                        prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "w") as file:
+                json.dump({"fetched": time.time(),
+                           "metadata": metadata.to_json()}, file)
+            os.replace(tmp_path, str(self.path))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def invalidate(self):
+        """Forget the cached metadata, e.g. when its ids don't match."""
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,117 @@
+"""Keeps rendered report sections to reuse the ones that didn't change."""
+import hashlib
+import json
+import os
+import tempfile
+from pathlib import Path
+
+from .metrics import METRICS
+
+# Part of the key of every cached section and of the content hash of
+# every report (see OutputManager.content_hash()). Bump it when the
+# Markdown or DOCX output changes.
+RENDER_VERSION = 1
+
+
+class SectionCache:
+    """Rendered Markdown text or DOCX XML of each section of a report.
+
+    Sections are keyed by a hash of their data in Report._report (epics,
+    stories and task lines) plus anything else the output depends on,
+    e.g. the docx style ids. A regenerated report only renders the
+    sections whose hash changed and reuses the cached text of the rest.
+
+    The cache of a project and format is one JSON file. Each save() keeps
+    only the sections of the latest report, so the file never grows past
+    the size of one report.
+
+    To use:
+        cache = SectionCache("reports/.section_cache/SIEEL.md.json")
+        text = cache.render(section, report, lambda: render(section))
+        cache.save()
+
+    """
+
+    def __init__(self, path):
+        """Set up attributes for the instance.
+
+        PARAMETERS:
+            - path: str or Path of the JSON file.
+
+        """
+        self.path = Path(path)
+        self._sections = None
+        self._used = dict()
+
+    @staticmethod
+    def section_key(section, report, extra=None):
+        """Return the hash of the data a section is rendered from.
+
+        PARAMETERS:
+            - section: str of a section of the report.
+            - report: Report() object containing the US info.
+            - extra: optional JSON-serializable value the output also
+                depends on.
+
+        """
+        rep_section = report._report[section]
+        # Only the tasks of the section's stories, so a change elsewhere
+        # doesn't invalidate it.
+        tasks = [(us_id, report._tasks[us_id])
+                 for stories in rep_section.values()
+                 for _, us_id in stories if us_id in report._tasks]
+        data = json.dumps([section, list(rep_section.items()), tasks, extra],
+                          separators=(",", ":"))
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+    def _load(self):
+        try:
+            with open(self.path, "r") as file:
+                return json.load(file)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def render(self, section, report, render, extra=None):
+        """Return the cached text of a section, rendering it if needed.
+
+        PARAMETERS:
+            - section: str of a section of the report.
+            - report: Report() object containing the US info.
+            - render: callable without arguments returning the str of the
+                section.
+            - extra: see section_key().
+
+        RETURNS: str of the rendered section.
+
+        """
+        if self._sections is None:
+            self._sections = self._load()
+        key = self.section_key(section, report, extra)
+        text = self._sections.get(key)
+        if text is None:
+            text = render()
+            METRICS.count("sections_rendered")
+        else:
+            METRICS.count("section_cache_hits")
+        self._used[key] = text
+        return text
+
+    def save(self):
+        """Write the sections used since the cache was built atomically.
+
+        Nothing is written if render() was never called, e.g. by a printer
+        that doesn't use the cache, so the saved sections are kept.
+
+        """
+        if self._sections is None:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=str(self.path.parent),
+                                        prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "w") as file:
+                json.dump(self._used, file)
+            os.replace(tmp_path, str(self.path))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
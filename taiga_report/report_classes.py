@@ -1,22 +1,48 @@
 """Contains classes for the different sections of the report."""
 # import datetime as dt
+import hashlib
+import json
+import re
 
 
 class UserStory:
-    """Contains all the US info needed for the report."""
+    """Contains all the US info needed for the report.
 
-    def __init__(self, us):
+    Instances use __slots__ so big projects don't pay for a __dict__ per
+    user story.
+
+    """
+
+    __slots__ = ("id", "subject", "epic_ids", "epics", "tags", "section",
+                 "subtasks")
+
+    # Keys of the Taiga payload used by the report and the story stores.
+    # Anything else can be dropped while decoding the API responses.
+    FIELDS = ("id", "subject", "epics", "tags", "tasks", "status",
+              "modified_date", "finish_date", "milestone")
+
+    def __init__(self, us, catalog=None):
         """Set up attributes for the instance.
 
         Parameters:
         - us: Dict with all the info that comes from the Taiga
             API
+        - catalog: optional EpicCatalog() the epic subjects are taken from.
 
         """
+        self.id = us.get("id")
         self.subject = us["subject"]
-        self.epic = us["epics"][0]["subject"] if us["epics"] else []
-        self.tags = us["tags"][0] if us["tags"] else []
-        self.section = self._section
+        epics = us["epics"] or []
+        self.epic_ids = [epic.get("id") for epic in epics]
+        if catalog is not None:
+            self.epics = catalog.subjects(epics)
+        else:
+            self.epics = [epic["subject"] for epic in epics]
+        # Taiga sends tags as [name, color] pairs, only the names are kept.
+        self.tags = [tag[0] if isinstance(tag, list) else tag
+                     for tag in us["tags"] or []]
+        # Assigned by a SectionClassifier(), see Report.classify_user_story.
+        self.section = None
         self.subtasks = us["tasks"]
         # if us["due_date"]:
         #     self.due_date = dt.datetime.strptime(us["due_date"],
@@ -25,12 +51,163 @@ class UserStory:
         #     self.due_date = None
 
     @property
-    def _section(self):
-        for tag in self.tags:
-            if tag in ["general", "expedientes", "remitos", "administracion"]:
-                return tag
-            else:
-                return None
+    def epic(self):
+        """Return the subject of the first epic of the US, or []."""
+        return self.epics[0] if self.epics else []
+
+    @epic.setter
+    def epic(self, subject):
+        self.epics = [subject] if subject else []
+
+    def attach_tasks(self, task_index):
+        """Replace the embedded tasks with the full ones of task_index.
+
+        PARAMETERS:
+            - task_index: dict returned by index_tasks().
+
+        """
+        self.subtasks = task_index.get(self.id, [])
+
+
+class Task:
+    """Contains the task info shown under its US in the report."""
+
+    __slots__ = ("id", "user_story", "subject", "status", "assignee",
+                 "is_closed", "finished_date")
+
+    # Keys of the Taiga task payload used by the report.
+    FIELDS = ("id", "user_story", "subject", "status_extra_info",
+              "assigned_to_extra_info", "is_closed", "finished_date")
+
+    def __init__(self, task):
+        """Set up attributes for the instance.
+
+        PARAMETERS:
+            - task: dict of a task as sent by the Taiga API.
+
+        """
+        self.id = task["id"]
+        self.user_story = task.get("user_story")
+        self.subject = task["subject"]
+        self.status = (task.get("status_extra_info") or {}).get("name")
+        self.assignee = (task.get("assigned_to_extra_info") or {}).get(
+            "full_name_display")
+        self.is_closed = task.get("is_closed", False)
+        self.finished_date = task.get("finished_date")
+
+    def describe(self):
+        """Return the task as one line, e.g. 'Deploy (Done, Ana, 2020-01-31)'.
+
+        Only the status, assignee and finish date that are known are shown.
+
+        """
+        details = [self.status, self.assignee,
+                   (self.finished_date or "")[:10]]
+        details = ", ".join(detail for detail in details if detail)
+        if details:
+            return "{} ({})".format(self.subject, details)
+        return self.subject
+
+
+def index_tasks(tasks):
+    """Group tasks by the id of their user story in one pass.
+
+    PARAMETERS:
+        - tasks: iterable of task dicts, e.g. TaigaAPI.iter_tasks().
+
+    RETURNS: dict of user story id: list of Task() objects, in the order
+    the tasks were received.
+
+    """
+    index = dict()
+    for task in tasks:
+        task = Task(task)
+        index.setdefault(task.user_story, []).append(task)
+    return index
+
+
+class SectionClassifier:
+    """Assigns a report section to each user story from the yaml rules.
+
+    Rules are read from the 'section_rules' list of a project block, in
+    priority order (or by their 'priority' key, lower first). Each rule
+    names a 'section' and any of 'tags', 'epics' (lists of names) and
+    'subject' (a regex). A story goes to the section of the highest
+    priority rule it matches, or to 'fallback_section' if none does.
+    Without rules, each of the 'report_sections' matches its own tag.
+
+    Tags and epics are compiled into dicts, so classifying a story costs
+    one lookup per tag instead of a scan of every rule.
+
+    EXAMPLE OF YAML:
+    sieel:
+        report_sections: [general, expedientes]
+        section_rules:
+            - section: expedientes
+              tags: [expedientes, exp]
+              subject: "^EXP-"
+        fallback_section: general
+
+    """
+
+    def __init__(self, rules, fallback=None):
+        """Compile the rules into lookup structures.
+
+        PARAMETERS:
+            - rules: list of rule dicts as described in the class docstring.
+            - fallback: str of the section of stories matching no rule.
+
+        """
+        self.fallback = fallback
+        # Tells stores that saved the sections of other rules apart.
+        self.fingerprint = hashlib.sha1(json.dumps(
+            [rules, fallback], sort_keys=True).encode()).hexdigest()
+        self._by_tag = dict()
+        self._by_epic = dict()
+        self._patterns = []
+        ordered = sorted(enumerate(rules),
+                         key=lambda item: (item[1].get("priority", 0),
+                                           item[0]))
+        # setdefault keeps the highest priority rule of repeated names.
+        for priority, (_, rule) in enumerate(ordered):
+            hit = (priority, rule["section"])
+            for tag in rule.get("tags") or []:
+                self._by_tag.setdefault(tag.lower(), hit)
+            for epic in rule.get("epics") or []:
+                self._by_epic.setdefault(epic.lower(), hit)
+            if rule.get("subject"):
+                self._patterns.append(
+                    (priority, re.compile(rule["subject"]), rule["section"]))
+
+    @classmethod
+    def from_config(cls, project_dict):
+        """Build the classifier of a project block of the yaml."""
+        rules = project_dict.get("section_rules")
+        if rules is None:
+            rules = [{"section": section, "tags": [section]}
+                     for section in project_dict.get("report_sections", [])]
+        return cls(rules, project_dict.get("fallback_section"))
+
+    def classify(self, us):
+        """Return the section of a UserStory() object."""
+        best = None
+        for tag in us.tags:
+            hit = self._by_tag.get(tag.lower()) if tag else None
+            if hit and (best is None or hit < best):
+                best = hit
+        for epic in us.epics:
+            hit = self._by_epic.get(epic.lower())
+            if hit and (best is None or hit < best):
+                best = hit
+        # Patterns are sorted by priority, so only the ones above the best
+        # hit so far are tried.
+        for priority, pattern, section in self._patterns:
+            if best is not None and priority >= best[0]:
+                break
+            if pattern.search(us.subject):
+                best = (priority, section)
+                break
+        return best[1] if best else self.fallback
 
 
 class Report:
@@ -39,8 +216,10 @@ class Report:
     def __init__(self, project, yaml_dict):
         """Set up attributes for the instance."""
         self._report = dict()
+        self._tasks = dict()
         self.project = project.upper()
         self._report_sections = yaml_dict[project]["report_sections"]
+        self.classifier = SectionClassifier.from_config(yaml_dict[project])
 
     def classify_user_story(self, us):
         """Classify a US and store it in the report json.
@@ -48,32 +227,122 @@ class Report:
         PARAMETERS:
             - us: UserStory() object
 
+        Stories are kept as (subject, id) pairs, so stories sharing a
+        subject keep their own tasks (see add_tasks()).
+
         EXAMPLE OF REPORT JSON:
         report = {
             "section-1": {
-                "user_stories": ["US-1", "US-2"],
-                "epic-1": ["US-3", "US-4"]
-                "epic-2": ["US-5", "US-6"]
+                "user_stories": [("US-1", 1), ("US-2", 2)],
+                "epic-1": [("US-3", 3), ("US-4", 4)]
+                "epic-2": [("US-5", 5), ("US-6", 6)]
             },
             "section-2": {
-                "user_stories": ["US-7", "US-8"]
+                "user_stories": [("US-7", 7), ("US-8", 8)]
             }
         }
 
         """
-        if us.section not in self._report:
-            self._report[us.section] = {"user_stories": []}
-            section = self._report[us.section]
-            if us.epic:
-                section[us.epic] = [us.subject]
-            else:
-                section["user_stories"].append(us.subject)
-        else:
-            if not us.epic:
-                self._report[us.section]["user_stories"].append(us.subject)
+        us.section = self.classifier.classify(us)
+        rep_section = self._report.setdefault(us.section,
+                                              {"user_stories": []})
+        entry = (us.subject, us.id)
+        if not us.epics:
+            rep_section["user_stories"].append(entry)
+        # A US linked to several epics is listed under each of them.
+        for epic in us.epics:
+            rep_section.setdefault(epic, []).append(entry)
+
+    def sort_epics(self, catalog):
+        """Order the epics of every section as in the epic catalog.
+
+        PARAMETERS:
+            - catalog: EpicCatalog() of the project.
+
+        """
+        for section, rep_section in self._report.items():
+            epics = sorted((epic for epic in rep_section
+                            if epic != "user_stories"),
+                           key=catalog.position)
+            self._report[section] = {"user_stories":
+                                     rep_section["user_stories"]}
+            self._report[section].update(
+                (epic, rep_section[epic]) for epic in epics)
+
+    def add_tasks(self, us):
+        """Keep the task details of a classified US for the printers.
+
+        They are kept by US id, the second item of the report entries.
 
-            elif us.epic not in self._report[us.section]:
-                self._report[us.section].update({us.epic: [us.subject]})
+        PARAMETERS:
+            - us: UserStory() object with the tasks of attach_tasks().
+
+        """
+        if us.subtasks:
+            self._tasks.setdefault(us.id, []).extend(
+                task.describe() for task in us.subtasks)
+
+    def fill_from_store(self, store, start=None, end=None):
+        """Fill the report from an indexed query of a SQLiteStoryStore.
+
+        The store already knows the section and epics of every story, so
+        they are added to the report json without building UserStory
+        objects, in the order of the rows.
 
+        PARAMETERS:
+            - store: SQLiteStoryStore() object of the project.
+            - start: optional str of an ISO 8601 date. Only the stories
+                finished on or after it are added.
+            - end: optional str of an ISO 8601 date. Only the stories
+                finished before it are added.
+
+        """
+        for section, epic, subject, us_id in store.report_rows(start, end):
+            rep_section = self._report.setdefault(section,
+                                                  {"user_stories": []})
+            if epic:
+                rep_section.setdefault(epic, []).append((subject, us_id))
             else:
-                self._report[us.section][us.epic].append(us.subject)
+                rep_section["user_stories"].append((subject, us_id))
+
+    def record_metrics(self, metrics):
+        """Count the sections, epics and user stories of the report.
+
+        PARAMETERS:
+            - metrics: Metrics() object to count into.
+
+        """
+        metrics.count("sections", len(self._report))
+        for rep_section in self._report.values():
+            metrics.count("epics", len(rep_section) - 1)
+            metrics.count("report_stories", sum(
+                len(stories) for stories in rep_section.values()))
+
+    def snapshot(self):
+        """Return the data the printers need, serialized as JSON bytes.
+
+        Printers running in other processes rebuild the report from it with
+        from_snapshot(), without the yaml or the classifier.
+
+        """
+        # JSON keys are strings, the tasks go as pairs to keep their ids.
+        return json.dumps({"project": self.project,
+                           "sections": self._report_sections,
+                           "report": self._report,
+                           "tasks": list(self._tasks.items())},
+                          separators=(",", ":")).encode("utf-8")
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        """Rebuild a printable Report() from snapshot() bytes."""
+        data = json.loads(snapshot)
+        report = cls.__new__(cls)
+        report._report = {
+            section: {epic: [tuple(entry) for entry in stories]
+                      for epic, stories in rep_section.items()}
+            for section, rep_section in data["report"].items()}
+        report._tasks = {us_id: tasks for us_id, tasks in data["tasks"]}
+        report.project = data["project"]
+        report._report_sections = data["sections"]
+        report.classifier = None
+        return report
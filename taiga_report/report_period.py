@@ -0,0 +1,149 @@
+"""Limits a report to the user stories of a month, sprint or date range."""
+import datetime as dt
+
+
+class ReportPeriod:
+    """Finish date window and milestone of the reported user stories.
+
+    The period is sent to Taiga as filters of the user stories listing
+    (see filters()), so only the stories of the period are transferred and
+    decoded. Stories already stored locally are filtered with contains().
+
+    To use:
+        period = ReportPeriod.parse_month("03-2024")
+        stories = api.iter_user_stories(period=period)
+        output = OutputManager(label=period.label)
+
+    """
+
+    def __init__(self, start=None, end=None, milestone=None, label=None):
+        """Set up attributes for the instance.
+
+        PARAMETERS:
+            - start: optional datetime.date of the first day, inclusive.
+            - end: optional datetime.date of the last day, exclusive.
+            - milestone: optional int id of the sprint.
+            - label: optional str naming the period in the report
+                filenames. Built from the other values if not given.
+
+        RAISES:
+            - ValueError if the period is empty or ends before it starts.
+
+        """
+        if start is None and end is None and milestone is None:
+            raise ValueError("A report period needs dates or a milestone.")
+        if start is not None and end is not None and end <= start:
+            raise ValueError("The report period ends before it starts.")
+        self.start = start
+        self.end = end
+        self.milestone = milestone
+        self.label = label or self._default_label()
+
+    def __repr__(self):
+        return "ReportPeriod({!r})".format(self.label)
+
+    @classmethod
+    def month(cls, year, month, milestone=None):
+        """Return the period of a calendar month.
+
+        It is labeled 'MM-YYYY', as the reports always were, so a monthly
+        report keeps the filename of the unfiltered one.
+
+        PARAMETERS:
+            - year: int of the year.
+            - month: int of the month, 1 to 12.
+            - milestone: optional int id of a sprint to also filter by.
+
+        """
+        start = dt.date(year, month, 1)
+        end = dt.date(year + month // 12, month % 12 + 1, 1)
+        label = "{:02d}-{}".format(month, year)
+        if milestone is not None:
+            label = "sprint-{}_{}".format(milestone, label)
+        return cls(start, end, milestone, label)
+
+    @classmethod
+    def parse_month(cls, text, milestone=None):
+        """Return the month period of a 'MM-YYYY' or 'YYYY-MM' str.
+
+        RAISES:
+            - ValueError if text is not a month in either format.
+
+        """
+        first, _, second = text.partition("-")
+        if not (first.isdigit() and second.isdigit()):
+            raise ValueError("Invalid month: {}".format(text))
+        if len(first) == 4:
+            first, second = second, first
+        return cls.month(int(second), int(first), milestone)
+
+    @classmethod
+    def between(cls, since=None, until=None, milestone=None):
+        """Return the period between two ISO 8601 dates, both inclusive.
+
+        PARAMETERS:
+            - since: optional str of the first day, e.g. '2024-03-01'.
+            - until: optional str of the last day, e.g. '2024-03-31'.
+            - milestone: optional int id of the sprint.
+
+        RAISES:
+            - ValueError if a date is not in the ISO 8601 format.
+
+        """
+        start = dt.date.fromisoformat(since) if since else None
+        end = None
+        if until:
+            end = dt.date.fromisoformat(until) + dt.timedelta(days=1)
+        return cls(start, end, milestone)
+
+    def _default_label(self):
+        parts = []
+        if self.milestone is not None:
+            parts.append("sprint-{}".format(self.milestone))
+        if self.start is not None or self.end is not None:
+            last = self.end - dt.timedelta(days=1) if self.end else None
+            parts.append("{}_{}".format(
+                self.start.isoformat() if self.start else "",
+                last.isoformat() if last else ""))
+        return "_".join(parts)
+
+    def bounds(self):
+        """Return the (start, end) ISO 8601 str of the window, or None."""
+        return (self.start.isoformat() if self.start else None,
+                self.end.isoformat() if self.end else None)
+
+    def filters(self):
+        """Return the Taiga query parameters selecting the period.
+
+        RETURNS: dict with the 'finish_date__gte', 'finish_date__lt' and
+        'milestone' keys of the parts of the period that are set.
+
+        """
+        start, end = self.bounds()
+        filters = dict()
+        if start:
+            filters["finish_date__gte"] = start
+        if end:
+            filters["finish_date__lt"] = end
+        if self.milestone is not None:
+            filters["milestone"] = self.milestone
+        return filters
+
+    def contains(self, us):
+        """Return True if a user story payload belongs to the period.
+
+        ISO 8601 dates compare as strings, so the finish date is compared
+        without parsing it.
+
+        """
+        if (self.milestone is not None
+                and us.get("milestone") != self.milestone):
+            return False
+        start, end = self.bounds()
+        finish = us.get("finish_date")
+        if start or end:
+            if not finish:
+                return False
+            if (start and finish < start) or (end and finish >= end):
+                return False
+        return True
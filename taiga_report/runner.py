@@ -0,0 +1,426 @@
+"""Runs the report pipeline for one or many projects."""
+import multiprocessing
+import time
+from concurrent.futures import (ProcessPoolExecutor, ThreadPoolExecutor,
+                                as_completed)
+
+from .epic_catalog import EpicCatalog
+from .metrics import METRICS
+from .taiga_api import TaigaAPI, build_session, connection_settings
+from .report_classes import Report, UserStory, index_tasks
+from .printer_classes import PRINTERS, DocxPrinter
+from .story_store import make_store, sync_user_stories
+
+# Stories of a period with tasks listed one by one. Above it, every task of
+# the project is downloaded in one sweep instead, see task_filters().
+TASK_LOOKUPS_MAX = 50
+
+
+def find_projects(yaml_dict):
+    """Return the names of every project block in the yaml.
+
+    A project block is any top level mapping that has a 'slug' key.
+
+    """
+    return [name for name, block in yaml_dict.items()
+            if isinstance(block, dict) and "slug" in block]
+
+
+def generate_report(api, project, yaml_dict,
+                    printer=DocxPrinter.print_docx_bulk, incremental=False,
+                    tasks=False, period=None):
+    """Download, classify and print the report of one project.
+
+    PARAMETERS:
+        - api: TaigaAPI() object for the project.
+        - project: str of the project block in the yaml.
+        - yaml_dict: dict of the parsed api.yaml.
+        - printer: callable that receives the Report() and returns the
+            written filename.
+        - incremental: bool, if True only the stories modified since the
+            last run are downloaded and the report is built from the local
+            story store (see story_store.make_store()).
+        - tasks: bool, if True every task of the project is downloaded in
+            one sweep and listed under its user story. With a period, only
+            the tasks of its stories are, see task_filters().
+        - period: optional ReportPeriod(). Only the stories finished in it
+            are reported. Without incremental, only those are downloaded.
+
+    RETURNS: what printer returns, a str of the written filename or a list
+    of them with render_formats().
+
+    RAISES:
+        - ValueError if incremental is set but the yaml has no cache_dir.
+
+    """
+    report = Report(project, yaml_dict)
+    catalog = EpicCatalog.from_config(api, yaml_dict, project)
+    task_index = None
+    if tasks and period is None:
+        with METRICS.phase("tasks"):
+            task_index = index_tasks(api.iter_tasks())
+    if not incremental:
+        # Stories are classified as each page arrives, so memory stays flat
+        # regardless of the project size.
+        stories = api.iter_user_stories(period=period)
+        if tasks and period is not None:
+            stories, task_index = _period_tasks(api, stories, period)
+        _classify_all(report, stories, catalog, task_index)
+        return printer(report)
+    store = make_store(yaml_dict, project)
+    if store is None:
+        raise ValueError("Incremental sync needs a cache_dir in the yaml.")
+    try:
+        sync_user_stories(api, store)
+        # The store rows carry no milestones, and the task details are
+        # attached to UserStory() objects.
+        if (store.fills_reports and not tasks
+                and (period is None or period.milestone is None)):
+            with METRICS.phase("classify"):
+                report.fill_from_store(
+                    store, *(period.bounds() if period else ()))
+                if catalog is not None:
+                    report.sort_epics(catalog)
+            report.record_metrics(METRICS)
+        else:
+            stories = store.stories()
+            if period is not None:
+                stories = filter(period.contains, stories)
+                if tasks:
+                    stories, task_index = _period_tasks(api, stories,
+                                                        period)
+            _classify_all(report, stories, catalog, task_index)
+    finally:
+        store.close()
+    return printer(report)
+
+
+async def generate_report_async(api, project, yaml_dict,
+                                printer=DocxPrinter.print_docx_bulk,
+                                incremental=False, tasks=False, period=None):
+    """Download, classify and print a report with an AsyncTaigaAPI.
+
+    Same as generate_report(), but the pages of every listing are
+    downloaded concurrently and the blocking steps (epic catalog, printer)
+    run in the client's thread pool, so many reports can share one event
+    loop. Incremental runs only download the changes and are done by
+    generate_report() in the thread pool.
+
+    PARAMETERS:
+        - api: AsyncTaigaAPI() object for the project.
+        - the rest, see generate_report().
+
+    RETURNS: what printer returns.
+
+    """
+    if incremental:
+        return await api._run(generate_report, api.api, project, yaml_dict,
+                              printer, incremental, tasks, period)
+    report = Report(project, yaml_dict)
+    catalog = await api._run(EpicCatalog.from_config, api.api, yaml_dict,
+                             project)
+    if tasks and period is not None:
+        stories = [us async for us in api.iter_user_stories(period=period)]
+        with METRICS.phase("tasks"):
+            task_index = index_tasks([
+                task async for task in api.iter_tasks(
+                    **task_filters(stories, period))])
+        _classify_all(report, stories, catalog, task_index)
+        return await api._run(printer, report)
+    task_index = None
+    if tasks:
+        with METRICS.phase("tasks"):
+            task_index = index_tasks([task async for task in api.iter_tasks()])
+    classify_time = 0.0
+    async for us_json in api.iter_user_stories(period=period):
+        start = time.perf_counter()
+        _classify(report, us_json, catalog, task_index)
+        classify_time += time.perf_counter() - start
+    _finish_report(report, catalog, classify_time)
+    return await api._run(printer, report)
+
+
+def task_filters(stories, period):
+    """Return the iter_tasks() arguments listing the tasks of a period.
+
+    A period has few stories, so instead of every task the project ever
+    had, only the tasks of its milestone, or of each of its stories with
+    tasks, are listed. Periods with more than TASK_LOOKUPS_MAX of those
+    sweep the whole project, which takes fewer requests.
+
+    PARAMETERS:
+        - stories: list of the user story dicts of the period.
+        - period: ReportPeriod() of the report.
+
+    RETURNS: dict of keyword arguments of TaigaAPI.iter_tasks().
+
+    """
+    if period.milestone is not None:
+        return {"milestone": period.milestone}
+    ids = [us["id"] for us in stories if us.get("tasks")]
+    if len(ids) > TASK_LOOKUPS_MAX:
+        return {}
+    return {"user_stories": ids}
+
+
+def _period_tasks(api, stories, period):
+    """Return the stories of a period as a list and their task index."""
+    stories = list(stories)
+    with METRICS.phase("tasks"):
+        task_index = index_tasks(api.iter_tasks(**task_filters(stories,
+                                                               period)))
+    return stories, task_index
+
+
+def _classify_all(report, stories, catalog, task_index):
+    """Classify every user story payload and finish the report."""
+    # Only the classification is timed, not the download between stories.
+    classify_time = 0.0
+    for us_json in stories:
+        start = time.perf_counter()
+        _classify(report, us_json, catalog, task_index)
+        classify_time += time.perf_counter() - start
+    _finish_report(report, catalog, classify_time)
+
+
+def _classify(report, us_json, catalog, task_index):
+    """Classify one user story payload into the report."""
+    us = UserStory(us_json, catalog)
+    report.classify_user_story(us)
+    if task_index is not None:
+        us.attach_tasks(task_index)
+        report.add_tasks(us)
+
+
+def _finish_report(report, catalog, classify_time):
+    """Sort the epics and record the metrics of a classified report."""
+    if catalog is not None:
+        start = time.perf_counter()
+        report.sort_epics(catalog)
+        classify_time += time.perf_counter() - start
+    METRICS.add_time("classify", classify_time)
+    report.record_metrics(METRICS)
+
+
+def render_formats(report, formats, output=None, workers=None):
+    """Print one classified report in several formats in parallel.
+
+    The report is serialized once and every format is rendered from that
+    snapshot in its own worker process, so the wall clock time is about
+    the one of the slowest format. A single format is rendered in this
+    process.
+
+    PARAMETERS:
+        - report: Report() object already classified.
+        - formats: iterable of PRINTERS keys.
+        - output: optional OutputManager() deciding the filenames.
+        - workers: int of processes. Defaults to one per format.
+
+    RETURNS: list of str of the written filenames, in formats order.
+
+    RAISES:
+        - KeyError if a format is not in PRINTERS.
+
+    """
+    formats = list(formats)
+    for fmt in formats:
+        if fmt not in PRINTERS:
+            raise KeyError("Unknown format: {}".format(fmt))
+    if len(formats) == 1:
+        return [PRINTERS[formats[0]](report, output=output)]
+
+    snapshot = report.snapshot()
+    # Batch runs call this from worker threads, and forking a process with
+    # other threads running can copy locks they hold (sessions, METRICS).
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers or len(formats),
+                             mp_context=context) as pool:
+        futures = [pool.submit(_render_snapshot, fmt, snapshot, output)
+                   for fmt in formats]
+        filenames = []
+        for future in futures:
+            filename, metrics = future.result()
+            # Worker processes have their own METRICS, merged back here.
+            METRICS.merge(metrics)
+            filenames.append(filename)
+    return filenames
+
+
+def _render_snapshot(fmt, snapshot, output):
+    """Render a Report.snapshot() in a worker process.
+
+    RETURNS: a (filename, metrics) tuple with the worker's
+    METRICS.snapshot().
+
+    """
+    METRICS.reset()
+    report = Report.from_snapshot(snapshot)
+    filename = PRINTERS[fmt](report, output=output)
+    return filename, METRICS.snapshot()
+
+
+def run_batch(yaml_dict, projects=None, workers=4,
+              printer=DocxPrinter.print_docx_bulk, incremental=False,
+              tasks=False, period=None):
+    """Generate the reports of several projects concurrently.
+
+    All projects share one login and one connection pool. A failing project
+    is recorded in the summary and does not stop the others.
+
+    PARAMETERS:
+        - yaml_dict: dict of the parsed api.yaml.
+        - projects: list of project names. Defaults to every project found
+            in the yaml.
+        - workers: int of projects processed at the same time.
+        - printer: callable that receives the Report() and returns the
+            written filename.
+        - incremental: bool, see generate_report().
+        - tasks: bool, see generate_report().
+        - period: optional ReportPeriod(), see generate_report().
+
+    RETURNS: tuple of a list and a float. The list has a dict per project,
+    with the keys 'project', 'ok', 'seconds', 'filename' and 'error', in
+    the same order as projects. The float is the wall clock seconds of the
+    whole batch.
+
+    """
+    projects = projects or find_projects(yaml_dict)
+    if not projects:
+        return [], 0.0
+    session = build_session(yaml_dict, pool_size=workers)
+    start = time.perf_counter()
+    try:
+        login_api = TaigaAPI(projects[0], yaml_dict, session=session)
+        login_api._auth()
+    except Exception as ex:
+        # Without a login no project can run.
+        seconds = time.perf_counter() - start
+        return _failed_results(projects, ex, seconds), seconds
+
+    def run_one(project):
+        start = time.perf_counter()
+        result = {"project": project, "ok": False, "filename": None,
+                  "error": None}
+        try:
+            api = login_api.for_project(project, yaml_dict)
+            result["filename"] = generate_report(api, project, yaml_dict,
+                                                 printer, incremental, tasks,
+                                                 period)
+            result["ok"] = True
+        except Exception as ex:
+            result["error"] = "{}: {}".format(type(ex).__name__, ex)
+        result["seconds"] = time.perf_counter() - start
+        return result
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(run_one, project): project
+                   for project in projects}
+        for future in as_completed(futures):
+            result = future.result()
+            results[result["project"]] = result
+            print(format_result(result))
+
+    return ([results[project] for project in projects],
+            time.perf_counter() - start)
+
+
+def run_batch_async(yaml_dict, projects=None, workers=4,
+                    printer=DocxPrinter.print_docx_bulk, incremental=False,
+                    tasks=False, period=None):
+    """Generate the reports of several projects on one event loop.
+
+    Same as run_batch(), with an AsyncTaigaAPI per project. Up to workers
+    projects are downloaded at once, each with up to 'concurrency' pages
+    in flight, all sharing one login, connection pool and thread pool.
+
+    RETURNS: tuple of a list of dicts and a float, see run_batch().
+
+    """
+    import asyncio
+
+    projects = projects or find_projects(yaml_dict)
+    if not projects:
+        return [], 0.0
+    return asyncio.run(_run_batch_async(yaml_dict, projects, workers,
+                                        printer, incremental, tasks, period))
+
+
+async def _run_batch_async(yaml_dict, projects, workers, printer,
+                           incremental, tasks, period):
+    import asyncio
+
+    from .async_api import AsyncTaigaAPI
+
+    threads = workers * connection_settings(yaml_dict)["concurrency"]
+    session = build_session(yaml_dict, pool_size=threads)
+    limit = asyncio.Semaphore(workers)
+
+    async def run_one(project):
+        async with limit:
+            start = time.perf_counter()
+            result = {"project": project, "ok": False, "filename": None,
+                      "error": None}
+            try:
+                api = await login_api.for_project(project, yaml_dict)
+                result["filename"] = await generate_report_async(
+                    api, project, yaml_dict, printer, incremental, tasks,
+                    period)
+                result["ok"] = True
+            except Exception as ex:
+                result["error"] = "{}: {}".format(type(ex).__name__, ex)
+            result["seconds"] = time.perf_counter() - start
+            print(format_result(result))
+            return result
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        start = time.perf_counter()
+        try:
+            login_api = AsyncTaigaAPI(projects[0], yaml_dict,
+                                      session=session, executor=executor)
+            await login_api._auth()
+        except Exception as ex:
+            seconds = time.perf_counter() - start
+            return _failed_results(projects, ex, seconds), seconds
+        results = await asyncio.gather(*(run_one(project)
+                                         for project in projects))
+        return results, time.perf_counter() - start
+
+
+def _failed_results(projects, ex, seconds):
+    """Return and print the results of projects that all failed with ex."""
+    results = [{"project": project, "ok": False, "filename": None,
+                "error": "{}: {}".format(type(ex).__name__, ex),
+                "seconds": seconds} for project in projects]
+    for result in results:
+        print(format_result(result))
+    return results
+
+
+def format_result(result):
+    """Format one run_batch() result as a single summary line."""
+    if result["ok"]:
+        outcome = result["filename"]
+        if isinstance(outcome, list):
+            outcome = ", ".join(outcome)
+    else:
+        outcome = "FAILED " + result["error"]
+    return "{:<20} {:>8.2f}s  {}".format(result["project"],
+                                         result["seconds"], outcome)
+
+
+def print_summary(results, seconds):
+    """Print the timings and failures of a batch run.
+
+    PARAMETERS:
+        - results: list of dicts returned by run_batch().
+        - seconds: float of the wall clock time of the batch. Projects run
+            at the same time, so it is less than the sum of their times.
+
+    """
+    failed = [result for result in results if not result["ok"]]
+    print("\nProject              Time      Result")
+    for result in results:
+        print(format_result(result))
+    print("{} projects, {} failed, {:.2f}s total".format(
+        len(results), len(failed), seconds))
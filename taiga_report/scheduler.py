@@ -0,0 +1,339 @@
+"""Paces, retries and circuit-breaks every request sent to Taiga."""
+import email.utils
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+
+from .metrics import METRICS
+
+# Defaults for the optional 'scheduler' block of the yaml.
+SCHEDULER_DEFAULTS = {
+    # Requests per second of the whole process, 0 for unlimited.
+    "requests_per_second": 0,
+    # Requests that can be sent at once after an idle period.
+    "burst": 10,
+    # Requests in flight per host, 0 for unlimited.
+    "per_host": 0,
+    # Longest Retry-After or backoff waited before giving up.
+    "max_wait": 60,
+    # Consecutive failures of a host that open its circuit.
+    "failure_threshold": 5,
+    # Seconds an open circuit rejects requests before trying again.
+    "reset_timeout": 30,
+}
+
+# Statuses meaning the request was not processed, safe to send again. A
+# 503 only throttles when it has a Retry-After, see is_throttle().
+THROTTLE_STATUSES = (429, 503)
+# Server errors only retried for idempotent methods.
+RETRY_STATUSES = (500, 502, 503, 504)
+IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS", "PUT", "DELETE")
+
+_shared = dict()
+_shared_lock = threading.Lock()
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """Raised instead of sending a request to a host that keeps failing.
+
+    It is a requests ConnectionError, so it is handled like the failures
+    that opened the circuit.
+
+    """
+
+
+class TokenBucket:
+    """Thread safe token bucket pacing the requests of the process.
+
+    To use:
+        bucket = TokenBucket(rate=5, burst=10)
+        bucket.acquire()
+
+    """
+
+    def __init__(self, rate, burst, clock=time.monotonic, sleep=time.sleep):
+        """Set up attributes for the instance.
+
+        PARAMETERS:
+            - rate: float of tokens added per second, 0 for unlimited.
+            - burst: int of tokens the bucket holds.
+            - clock, sleep: time functions, replaceable in tests.
+
+        """
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.clock = clock
+        self.sleep = sleep
+        self._updated = clock()
+        self._resume = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Take a token, sleeping until one is available.
+
+        RETURNS: float of seconds waited.
+
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = self.clock()
+                delay = self._resume - now
+                if delay <= 0:
+                    if not self.rate:
+                        return waited
+                    self.tokens = min(self.burst, self.tokens + (
+                        now - self._updated) * self.rate)
+                    self._updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return waited
+                    delay = (1 - self.tokens) / self.rate
+            self.sleep(delay)
+            waited += delay
+
+    def pause(self, seconds):
+        """Hold every acquire() for seconds, e.g. after a 429."""
+        with self._lock:
+            self._resume = max(self._resume, self.clock() + seconds)
+            # Tokens saved up before the throttle would be spent at once.
+            self.tokens = min(self.tokens, 1.0)
+
+
+class CircuitBreaker:
+    """Stops sending requests to a host after repeated failures.
+
+    After failure_threshold consecutive failures the circuit opens and
+    requests fail right away for reset_timeout seconds. Then it lets
+    requests through again: a success closes it, a failure opens it again.
+
+    """
+
+    def __init__(self, failure_threshold, reset_timeout,
+                 clock=time.monotonic):
+        """Set up attributes for the instance."""
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self.opened = None
+        self._lock = threading.Lock()
+
+    def check(self, host):
+        """Raise CircuitOpenError if requests to host must not be sent."""
+        with self._lock:
+            if (self.opened is not None
+                    and self.clock() - self.opened < self.reset_timeout):
+                raise CircuitOpenError(
+                    "Too many failures from {}, retrying in {:.0f}s.".format(
+                        host,
+                        self.reset_timeout - (self.clock() - self.opened)))
+
+    def record(self, ok):
+        """Count the outcome of a request."""
+        with self._lock:
+            if ok:
+                self.failures = 0
+                self.opened = None
+                return
+            self.failures += 1
+            if self.failure_threshold and (
+                    self.failures >= self.failure_threshold):
+                self.opened = self.clock()
+
+
+class RequestScheduler:
+    """Gate every TaigaAPI request goes through.
+
+    Requests take a token from a process-wide TokenBucket and a slot of
+    the per-host limit before being sent. A 429, or a 503 with a
+    Retry-After, pauses the whole bucket for its Retry-After (or an
+    exponential backoff with jitter) and the request is sent again. Other
+    server errors of idempotent methods are retried with backoff too. Each
+    host has a CircuitBreaker, fed by server errors and connection errors,
+    so a server that keeps failing is not hammered by every worker of a
+    batch run. Throttles don't count as
+    failures, the server is up and asking to slow down. The circuit is
+    only checked before the first attempt, so a request already sent
+    finishes its retries.
+
+    Connection errors are retried by the session adapter, see
+    taiga_api.build_session().
+
+    To use:
+        scheduler = RequestScheduler.shared(yaml_dict)
+        response = scheduler.send("GET", url, send)
+
+    """
+
+    def __init__(self, settings=None, retries=3, backoff_factor=0.5,
+                 clock=time.monotonic, sleep=time.sleep):
+        """Set up attributes for the instance.
+
+        PARAMETERS:
+            - settings: optional dict overriding SCHEDULER_DEFAULTS.
+            - retries: int of times a request is sent again.
+            - backoff_factor: float of seconds of the first backoff, which
+                doubles on each retry.
+            - clock, sleep: time functions, replaceable in tests.
+
+        """
+        self.settings = dict(SCHEDULER_DEFAULTS)
+        self.settings.update(settings or {})
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.clock = clock
+        self.sleep = sleep
+        self.bucket = TokenBucket(self.settings["requests_per_second"],
+                                  self.settings["burst"], clock, sleep)
+        self._hosts = dict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, yaml_dict):
+        """Build a scheduler from the yaml 'scheduler' and 'connection'."""
+        connection = yaml_dict.get("connection") or {}
+        return cls(yaml_dict.get("scheduler"),
+                   retries=connection.get("retries", 3),
+                   backoff_factor=connection.get("backoff_factor", 0.5))
+
+    @classmethod
+    def shared(cls, yaml_dict):
+        """Return the process-wide scheduler of these settings.
+
+        Every TaigaAPI built from the same settings gets the same
+        scheduler, so their requests share one token bucket and limits.
+
+        """
+        connection = yaml_dict.get("connection") or {}
+        key = repr((sorted((yaml_dict.get("scheduler") or {}).items()),
+                    connection.get("retries"),
+                    connection.get("backoff_factor")))
+        with _shared_lock:
+            if key not in _shared:
+                _shared[key] = cls.from_config(yaml_dict)
+            return _shared[key]
+
+    def _host(self, url):
+        """Return the (semaphore, breaker) pair of the host of url."""
+        host = urlsplit(url).netloc
+        with self._lock:
+            if host not in self._hosts:
+                per_host = self.settings["per_host"]
+                self._hosts[host] = (
+                    threading.BoundedSemaphore(per_host) if per_host
+                    else None,
+                    CircuitBreaker(self.settings["failure_threshold"],
+                                   self.settings["reset_timeout"],
+                                   self.clock))
+            return host, self._hosts[host]
+
+    def send(self, method, url, send):
+        """Send a request when allowed, retrying throttles and failures.
+
+        PARAMETERS:
+            - method: str of the HTTP method.
+            - url: str of the url, its host selects the limits.
+            - send: callable without arguments sending the request once
+                and returning the requests.Response().
+
+        RETURNS: requests.Response() object. After the last retry, the
+        error response is returned for the caller to raise_for_status().
+
+        RAISES:
+            - CircuitOpenError if the host's circuit is open.
+            - requests.exceptions.ConnectionError or Timeout from send().
+
+        """
+        host, (slots, breaker) = self._host(url)
+        attempt = 0
+        breaker.check(host)
+        while True:
+            waited = self.bucket.acquire()
+            if slots is not None:
+                start = self.clock()
+                slots.acquire()
+                waited += self.clock() - start
+            if waited:
+                METRICS.add_time("rate_limit_wait", waited)
+            try:
+                response = send()
+            except (requests.exceptions.ConnectionError,
+                    requests.exceptions.Timeout):
+                # Already retried by the session adapter.
+                breaker.record(False)
+                raise
+            finally:
+                if slots is not None:
+                    slots.release()
+            delay = self._retry_delay(method, response, attempt)
+            if not self.is_throttle(response):
+                breaker.record(response.status_code < 500)
+            if delay is None:
+                return response
+            response.close()
+            attempt += 1
+            METRICS.count("retries")
+            self.sleep(delay)
+
+    def _retry_delay(self, method, response, attempt):
+        """Return the seconds to wait before sending again, or None."""
+        if attempt >= self.retries:
+            return None
+        status = response.status_code
+        if self.is_throttle(response):
+            METRICS.count("throttled")
+            delay = self.retry_after(response)
+            if delay is None:
+                delay = self._backoff(attempt)
+            if delay > self.settings["max_wait"]:
+                return None
+            print("Throttled by the server, waiting {:.1f}s.".format(delay))
+            self.bucket.pause(delay)
+            # The bucket already waits, the request doesn't sleep again.
+            return 0
+        if status in RETRY_STATUSES and method.upper() in IDEMPOTENT_METHODS:
+            return self._backoff(attempt)
+        return None
+
+    def _backoff(self, attempt):
+        """Return an exponential backoff with full jitter."""
+        ceiling = min(self.settings["max_wait"],
+                      self.backoff_factor * 2 ** attempt)
+        return random.uniform(0, ceiling)
+
+    @staticmethod
+    def is_throttle(response):
+        """Return True if the server asked to slow down.
+
+        A bare 503 is a failing server, not a throttle, and counts for
+        its circuit.
+
+        """
+        if response.status_code == 503:
+            return bool(response.headers.get("Retry-After"))
+        return response.status_code in THROTTLE_STATUSES
+
+    @staticmethod
+    def retry_after(response):
+        """Return the seconds of the Retry-After header, or None.
+
+        Both forms of the header are accepted: seconds and an HTTP date.
+
+        """
+        value = response.headers.get("Retry-After")
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            date = email.utils.parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        return max(0.0, date.timestamp() - time.time())
@@ -0,0 +1,352 @@
+"""Keeps the report pipeline warm and serves reports on demand.
+
+A ReportService holds one login, one connection pool, the parsed config and
+the latest Report of every project in memory. A scheduler thread refreshes
+the reports periodically and a local HTTP endpoint triggers or fetches
+them, so a request only pays for the render step.
+
+To run:
+    python -m taiga_report --serve
+
+Endpoints:
+    GET  /health                          -> {"status": "ok"}
+    GET  /reports                         -> latest result of every report
+    POST /reports/<project>?format=docx   -> refresh and render the report
+    GET  /reports/<project>?format=docx   -> latest report file
+
+POST takes 'refresh=0' to render the report held in memory without
+downloading the changes first.
+
+"""
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from .output_manager import OutputManager
+from .printer_classes import PRINTERS
+from .runner import find_projects, generate_report
+from .taiga_api import TaigaAPI, build_session
+
+# Defaults for the optional 'service' block of the yaml.
+SERVICE_DEFAULTS = {
+    "host": "127.0.0.1",
+    "port": 8080,
+    "interval_minutes": 60,
+    "formats": ["docx"],
+    "incremental": True,
+    "tasks": False,
+    "output_dir": ".",
+}
+
+CONTENT_TYPES = {
+    "md": "text/markdown; charset=utf-8",
+    "docx": "application/vnd.openxmlformats-officedocument."
+            "wordprocessingml.document",
+}
+
+
+def service_settings(yaml_dict):
+    """Merge the yaml 'service' block with SERVICE_DEFAULTS."""
+    settings = dict(SERVICE_DEFAULTS)
+    settings.update(yaml_dict.get("service") or {})
+    return settings
+
+
+class ReportService:
+    """Generates the reports of the yaml projects from warm state.
+
+    PARAMETERS:
+        - yaml_dict: dict of the parsed api.yaml.
+        - output: OutputManager() the reports are written with.
+        - interval: float of seconds between scheduled refreshes, 0 or
+            None disables the scheduler.
+        - formats: iterable of PRINTERS keys rendered by the scheduler.
+        - incremental: bool, see runner.generate_report().
+        - tasks: bool, see runner.generate_report().
+
+    To use:
+        service = ReportService.from_config(yaml_dict)
+        with service.running() as url:
+            ...
+
+    """
+
+    def __init__(self, yaml_dict, output=None, interval=None,
+                 formats=("docx",), incremental=True, tasks=False):
+        """Set up attributes for the instance."""
+        self.yaml_dict = yaml_dict
+        self.projects = find_projects(yaml_dict)
+        self.output = output or OutputManager()
+        self.interval = interval
+        self.formats = tuple(formats)
+        self.incremental = incremental
+        self.tasks = tasks
+        self.session = build_session(yaml_dict,
+                                     pool_size=len(self.projects))
+        self.results = dict()
+        self._apis = dict()
+        # project: (time.monotonic() the refresh started, Report()).
+        self._reports = dict()
+        self._login_api = None
+        self._lock = threading.Lock()
+        # Guards results and _reports, which handler threads share.
+        self._state_lock = threading.Lock()
+        self._project_locks = {project: threading.Lock()
+                               for project in self.projects}
+        self._stop = threading.Event()
+
+    @classmethod
+    def from_config(cls, yaml_dict, force=False):
+        """Build the service from the yaml 'service' block.
+
+        PARAMETERS:
+            - yaml_dict: dict of the parsed api.yaml.
+            - force: bool, see OutputManager().
+
+        """
+        settings = service_settings(yaml_dict)
+        return cls(yaml_dict,
+                   output=OutputManager(settings["output_dir"], force=force),
+                   interval=settings["interval_minutes"] * 60,
+                   formats=settings["formats"],
+                   incremental=settings["incremental"],
+                   tasks=settings["tasks"])
+
+    def api(self, project):
+        """Return the TaigaAPI of a project, sharing one login and pool."""
+        with self._lock:
+            if project not in self._apis:
+                if self._login_api is None:
+                    self._login_api = TaigaAPI(project, self.yaml_dict,
+                                               session=self.session)
+                    self._login_api._auth()
+                self._apis[project] = self._login_api.for_project(
+                    project, self.yaml_dict)
+            return self._apis[project]
+
+    def _check(self, project, fmt=None):
+        if project not in self._project_locks:
+            raise KeyError("Unknown project: {}".format(project))
+        if fmt is not None and fmt not in PRINTERS:
+            raise KeyError("Unknown format: {}".format(fmt))
+
+    def refresh(self, project, since=None):
+        """Download the changes of a project and rebuild its Report.
+
+        Refreshes of one project run one at a time. A request waiting for
+        another one's refresh can pass since: if that refresh started
+        after it, its Report is already up to date and is returned without
+        downloading again.
+
+        PARAMETERS:
+            - project: str of the project block in the yaml.
+            - since: optional float of time.monotonic().
+
+        RETURNS: the new Report() object.
+
+        RAISES:
+            - KeyError if the project is not in the yaml.
+
+        """
+        self._check(project)
+        with self._project_locks[project]:
+            with self._state_lock:
+                held = self._reports.get(project)
+            if held is not None and since is not None and held[0] >= since:
+                return held[1]
+            return self._download(project)
+
+    def report(self, project):
+        """Return the Report held in memory, refreshing it if missing."""
+        self._check(project)
+        with self._project_locks[project]:
+            with self._state_lock:
+                held = self._reports.get(project)
+            if held is not None:
+                return held[1]
+            return self._download(project)
+
+    def _download(self, project):
+        """Rebuild the Report of a project, holding its project lock."""
+        started = time.monotonic()
+        report = generate_report(self.api(project), project,
+                                 self.yaml_dict, lambda report: report,
+                                 incremental=self.incremental,
+                                 tasks=self.tasks)
+        with self._state_lock:
+            self._reports[project] = (started, report)
+        return report
+
+    def render(self, project, fmt, refresh=True):
+        """Write the report of a project in one format.
+
+        PARAMETERS:
+            - project: str of the project block in the yaml.
+            - fmt: str key of PRINTERS.
+            - refresh: bool, False reuses the Report held in memory if
+                there is one.
+
+        RETURNS: dict with the keys 'project', 'format', 'filename',
+        'seconds' and 'created'.
+
+        RAISES:
+            - KeyError if the project or the format are unknown.
+
+        """
+        self._check(project, fmt)
+        start = time.perf_counter()
+        if refresh:
+            report = self.refresh(project, since=time.monotonic())
+        else:
+            report = self.report(project)
+        filename = PRINTERS[fmt](report, output=self.output)
+        result = {"project": project, "format": fmt, "filename": filename,
+                  "seconds": round(time.perf_counter() - start, 3),
+                  "created": time.strftime("%Y-%m-%dT%H:%M:%S")}
+        with self._state_lock:
+            self.results[(project, fmt)] = result
+        return result
+
+    def all_results(self):
+        """Return the latest render() result of every project and format."""
+        with self._state_lock:
+            return list(self.results.values())
+
+    def latest(self, project, fmt):
+        """Return the latest render() result, rendering it if missing."""
+        self._check(project, fmt)
+        with self._state_lock:
+            result = self.results.get((project, fmt))
+        if result is None or not os.path.exists(result["filename"]):
+            result = self.render(project, fmt, refresh=False)
+        return result
+
+    def run_scheduled(self):
+        """Refresh and render every project in the scheduled formats.
+
+        A failing project is logged and does not stop the others.
+
+        """
+        for project in self.projects:
+            try:
+                self.refresh(project)
+                for fmt in self.formats:
+                    self.render(project, fmt, refresh=False)
+            except Exception as ex:
+                print("Scheduled report of {} failed: {}: {}".format(
+                    project, type(ex).__name__, ex))
+
+    def _schedule_loop(self):
+        while not self._stop.wait(self.interval):
+            self.run_scheduled()
+
+    @contextmanager
+    def running(self, host="127.0.0.1", port=0):
+        """Serve the HTTP endpoint and the scheduler in background threads.
+
+        YIELDS: str of the root url, e.g. 'http://127.0.0.1:8080/'.
+
+        """
+        server = ThreadingHTTPServer((host, port), ServiceHandler)
+        server.daemon_threads = True
+        server.service = self
+        threads = [threading.Thread(target=server.serve_forever,
+                                    daemon=True)]
+        if self.interval:
+            threads.append(threading.Thread(target=self._schedule_loop,
+                                            daemon=True))
+        self._stop.clear()
+        for thread in threads:
+            thread.start()
+        try:
+            yield "http://{}:{}/".format(host, server.server_address[1])
+        finally:
+            self._stop.set()
+            server.shutdown()
+            server.server_close()
+
+    def serve_forever(self):
+        """Serve on the configured host and port until interrupted."""
+        settings = service_settings(self.yaml_dict)
+        with self.running(settings["host"], settings["port"]) as url:
+            print("Serving reports of {} at {}".format(
+                ", ".join(self.projects), url))
+            try:
+                while True:
+                    time.sleep(3600)
+            except KeyboardInterrupt:
+                pass
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    """Answers the requests of one connection for a ReportService."""
+
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def service(self):
+        return self.server.service
+
+    def log_message(self, format, *args):
+        print("{} {}".format(self.address_string(), format % args))
+
+    def do_GET(self):
+        path, query = self._parse()
+        if path == ["health"]:
+            self._send_json(200, {"status": "ok"})
+        elif path == ["reports"]:
+            self._send_json(200, self.service.all_results())
+        elif len(path) == 2 and path[0] == "reports":
+            self._handle(lambda: self._send_file(self.service.latest(
+                path[1], query.get("format", "docx"))))
+        else:
+            self._send_json(404, {"detail": "Not found"})
+
+    def do_POST(self):
+        path, query = self._parse()
+        if len(path) == 2 and path[0] == "reports":
+            self._handle(lambda: self._send_json(200, self.service.render(
+                path[1], query.get("format", "docx"),
+                refresh=query.get("refresh", "1") != "0")))
+        else:
+            self._send_json(404, {"detail": "Not found"})
+
+    def _parse(self):
+        url = urlparse(self.path)
+        path = [part for part in url.path.split("/") if part]
+        query = {key: values[-1] for key, values in parse_qs(
+            url.query).items()}
+        return path, query
+
+    def _handle(self, answer):
+        """Run answer() turning failures into JSON error responses."""
+        try:
+            answer()
+        except KeyError as ex:
+            self._send_json(404, {"detail": ex.args[0]})
+        except Exception as ex:
+            self._send_json(500, {"detail": "{}: {}".format(
+                type(ex).__name__, ex)})
+
+    def _send_file(self, result):
+        with open(result["filename"], "rb") as file:
+            body = file.read()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPES[result["format"]])
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Content-Disposition", 'attachment; filename="{}"'
+                         .format(os.path.basename(result["filename"])))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
@@ -0,0 +1,408 @@
+"""Keeps a local copy of each project's done user stories between runs."""
+import json
+import os
+import sqlite3
+import tempfile
+from pathlib import Path
+
+from .report_classes import SectionClassifier, UserStory
+
+# Stores remember the payload keys they were synced with. Stories synced
+# before a key joined UserStory.FIELDS lack it, so a change of the fields
+# drops the stored stories and the next sync downloads them all again.
+STORE_FIELDS = list(UserStory.FIELDS)
+
+
+class StoryStore:
+    """Persistent copy of the done user stories of one project.
+
+    Besides the stories, the store keeps the high-water mark of the last
+    sync: the newest 'modified_date' seen. The next sync only asks Taiga for
+    stories modified since then. A store synced with other STORE_FIELDS is
+    discarded.
+
+    To use:
+        store = StoryStore.from_config(yaml_dict, project)
+        sync_user_stories(api, store)
+        for us_json in store.stories():
+            ...
+
+    """
+
+    # Whether report_rows() can fill a Report (see runner.generate_report()).
+    fills_reports = False
+
+    def __init__(self, path):
+        """Set up attributes for the instance.
+
+        PARAMETERS:
+            - path: str or Path of the JSON file holding the stories.
+
+        """
+        self.path = Path(path)
+        data = self._read()
+        if data.get("fields") != STORE_FIELDS:
+            data = {}
+        self.high_water_mark = data.get("high_water_mark")
+        self._stories = data.get("stories", {})
+
+    @classmethod
+    def from_config(cls, yaml_dict, project):
+        """Build the store of a project under 'cache_dir', or None."""
+        cache_dir = yaml_dict.get("cache_dir")
+        if not cache_dir:
+            return None
+        return cls(Path(cache_dir) / "stories" / (project + ".json"))
+
+    def _read(self):
+        try:
+            with open(self.path, "r") as file:
+                return json.load(file)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def __len__(self):
+        return len(self._stories)
+
+    def upsert(self, us):
+        """Insert or update a done user story."""
+        self._stories[str(us["id"])] = us
+
+    def remove(self, us_id):
+        """Drop a user story, e.g. when it left the done status."""
+        self._stories.pop(str(us_id), None)
+
+    def stories(self):
+        """Return an iterator over the stored user story dicts."""
+        return iter(self._stories.values())
+
+    def save(self):
+        """Write the store to disk atomically."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=str(self.path.parent),
+                                        prefix=".stories-")
+        try:
+            with os.fdopen(fd, "w") as file:
+                json.dump({"fields": STORE_FIELDS,
+                           "high_water_mark": self.high_water_mark,
+                           "stories": self._stories}, file)
+            os.replace(tmp_path, str(self.path))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def close(self):
+        """Nothing to release, the stories are written by save()."""
+
+
+class SQLiteStoryStore:
+    """StoryStore backed by an embedded SQLite database.
+
+    One database can hold many projects. Stories, epics, tags and tasks get
+    their own tables, indexed by project, section, epic and finish date, so
+    a report can be filled from one query (see Report.fill_from_store())
+    and several report runs can share one downloaded dataset.
+
+    Changes are buffered and written by save() in one short transaction,
+    and the database is in WAL mode, so the stores of other projects can
+    read and write while a long download is synced.
+
+    To use:
+        store = SQLiteStoryStore.from_config(yaml_dict, "sieel")
+
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS stories (
+            id INTEGER PRIMARY KEY,
+            project TEXT NOT NULL,
+            subject TEXT NOT NULL,
+            section TEXT,
+            finish_date TEXT,
+            modified_date TEXT,
+            payload TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS epics (
+            id INTEGER PRIMARY KEY,
+            project TEXT NOT NULL,
+            subject TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS story_epics (
+            story_id INTEGER NOT NULL,
+            epic_id INTEGER NOT NULL,
+            position INTEGER NOT NULL,
+            PRIMARY KEY (story_id, epic_id)
+        );
+        CREATE TABLE IF NOT EXISTS tags (
+            story_id INTEGER NOT NULL,
+            tag TEXT NOT NULL,
+            color TEXT
+        );
+        CREATE TABLE IF NOT EXISTS tasks (
+            id INTEGER,
+            story_id INTEGER NOT NULL,
+            subject TEXT
+        );
+        CREATE TABLE IF NOT EXISTS sync_state (
+            project TEXT PRIMARY KEY,
+            high_water_mark TEXT
+        );
+        CREATE TABLE IF NOT EXISTS store_state (
+            project TEXT NOT NULL,
+            name TEXT NOT NULL,
+            value TEXT,
+            PRIMARY KEY (project, name)
+        );
+        CREATE INDEX IF NOT EXISTS stories_section
+            ON stories (project, section);
+        CREATE INDEX IF NOT EXISTS stories_finish_date
+            ON stories (project, finish_date);
+        CREATE INDEX IF NOT EXISTS story_epics_epic ON story_epics (epic_id);
+        CREATE INDEX IF NOT EXISTS tags_story ON tags (story_id);
+        CREATE INDEX IF NOT EXISTS tasks_story ON tasks (story_id);
+    """
+
+    fills_reports = True
+
+    def __init__(self, path, project, section_of, rules=None):
+        """Set up attributes for the instance.
+
+        PARAMETERS:
+            - path: str or Path of the database file.
+            - project: str of the project block in the yaml.
+            - section_of: callable that receives a user story dict and
+                returns its report section, e.g. from a SectionClassifier().
+            - rules: optional str identifying the rules of section_of, see
+                SectionClassifier.fingerprint. When it differs from the
+                one the rows were stored with, every row is classified
+                again.
+
+        """
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.project = project
+        self.section_of = section_of
+        self.connection = sqlite3.connect(str(self.path), timeout=30)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(self.SCHEMA)
+        # id: user story dict to write, or None to delete.
+        self._pending = dict()
+        fields = json.dumps(STORE_FIELDS)
+        if self._state("fields") != fields:
+            self._clear(fields)
+        row = self.connection.execute(
+            "SELECT high_water_mark FROM sync_state WHERE project = ?",
+            (project,)).fetchone()
+        self.high_water_mark = row[0] if row else None
+        if rules is not None and self._state("rules") != rules:
+            self._reclassify(rules)
+
+    @classmethod
+    def from_config(cls, yaml_dict, project):
+        """Build the store of a project in 'cache_dir'/stories.db, or None.
+
+        Stories are classified with the SectionClassifier() of the project
+        block of the yaml.
+
+        """
+        cache_dir = yaml_dict.get("cache_dir")
+        if not cache_dir:
+            return None
+        classifier = SectionClassifier.from_config(yaml_dict[project])
+        return cls(Path(cache_dir) / "stories.db", project,
+                   lambda us: classifier.classify(UserStory(us)),
+                   classifier.fingerprint)
+
+    def _state(self, name):
+        """Return the stored value of name for the project, or None."""
+        row = self.connection.execute(
+            "SELECT value FROM store_state WHERE project = ? AND name = ?",
+            (self.project, name)).fetchone()
+        return row[0] if row else None
+
+    def _set_state(self, name, value):
+        self.connection.execute(
+            "INSERT OR REPLACE INTO store_state VALUES (?, ?, ?)",
+            (self.project, name, value))
+
+    def _clear(self, fields):
+        """Drop the stories and sync state of a store of other fields."""
+        db = self.connection
+        for table in ("story_epics", "tags", "tasks"):
+            db.execute("DELETE FROM {} WHERE story_id IN (SELECT id FROM "
+                       "stories WHERE project = ?)".format(table),
+                       (self.project,))
+        for table in ("stories", "epics", "sync_state"):
+            db.execute("DELETE FROM {} WHERE project = ?".format(table),
+                       (self.project,))
+        self._set_state("fields", fields)
+        db.commit()
+
+    def _reclassify(self, rules):
+        """Store again the section of every row, after a rules change."""
+        rows = self.connection.execute(
+            "SELECT id, payload FROM stories WHERE project = ?",
+            (self.project,)).fetchall()
+        self.connection.executemany(
+            "UPDATE stories SET section = ? WHERE id = ?",
+            [(self.section_of(json.loads(payload)), us_id)
+             for us_id, payload in rows])
+        self._set_state("rules", rules)
+        self.connection.commit()
+
+    def __len__(self):
+        self._flush()
+        return self.connection.execute(
+            "SELECT COUNT(*) FROM stories WHERE project = ?",
+            (self.project,)).fetchone()[0]
+
+    def upsert(self, us):
+        """Insert or update a done user story with its epics, tags, tasks."""
+        self._pending[us["id"]] = us
+
+    def remove(self, us_id):
+        """Drop a user story, e.g. when it left the done status."""
+        self._pending[us_id] = None
+
+    def _flush(self, high_water_mark=False):
+        """Write the buffered changes, and the mark, in one transaction."""
+        if not self._pending and not high_water_mark:
+            return
+        with self.connection:
+            for us_id, us in self._pending.items():
+                self._delete(us_id)
+                if us is not None:
+                    self._insert(us)
+            if high_water_mark:
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO sync_state VALUES (?, ?)",
+                    (self.project, self.high_water_mark))
+        self._pending = dict()
+
+    def _insert(self, us):
+        db = self.connection
+        db.execute("INSERT INTO stories VALUES (?, ?, ?, ?, ?, ?, ?)",
+                   (us["id"], self.project, us["subject"], self.section_of(us),
+                    us.get("finish_date"), us.get("modified_date"),
+                    json.dumps(us)))
+        for position, epic in enumerate(us.get("epics") or []):
+            db.execute("INSERT OR REPLACE INTO epics VALUES (?, ?, ?)",
+                       (epic["id"], self.project, epic["subject"]))
+            db.execute("INSERT OR IGNORE INTO story_epics VALUES (?, ?, ?)",
+                       (us["id"], epic["id"], position))
+        for tag in us.get("tags") or []:
+            # Taiga sends [name, color] pairs, older versions plain names.
+            name, color = (tag[0], tag[1]) if isinstance(tag, list) else (
+                tag, None)
+            db.execute("INSERT INTO tags VALUES (?, ?, ?)",
+                       (us["id"], name, color))
+        for task in us.get("tasks") or []:
+            db.execute("INSERT INTO tasks VALUES (?, ?, ?)",
+                       (task.get("id"), us["id"], task.get("subject")))
+
+    def _delete(self, us_id):
+        for table, column in (("stories", "id"), ("story_epics", "story_id"),
+                              ("tags", "story_id"), ("tasks", "story_id")):
+            self.connection.execute(
+                "DELETE FROM {} WHERE {} = ?".format(table, column), (us_id,))
+
+    def stories(self):
+        """Return an iterator over the stored user story dicts."""
+        self._flush()
+        cursor = self.connection.execute(
+            "SELECT payload FROM stories WHERE project = ? ORDER BY id",
+            (self.project,))
+        return (json.loads(payload) for payload, in cursor)
+
+    def report_rows(self, start=None, end=None):
+        """Return the (section, epic, subject, id) rows of the report.
+
+        Uses the finish date index to pick the stories finished in
+        [start, end). Rows come by story id, like the downloaded listing,
+        so the sections and epics of the report appear in the same order
+        as in a report built from the API. A story linked to several epics
+        gets one row per epic, in the order of its epics.
+
+        PARAMETERS:
+            - start: optional str of an ISO 8601 date, inclusive.
+            - end: optional str of an ISO 8601 date, exclusive.
+
+        """
+        query = """
+            SELECT s.section, e.subject, s.subject, s.id
+            FROM stories s
+            LEFT JOIN story_epics se ON se.story_id = s.id
+            LEFT JOIN epics e ON e.id = se.epic_id
+            WHERE s.project = ?"""
+        self._flush()
+        params = [self.project]
+        if start:
+            query += " AND s.finish_date >= ?"
+            params.append(start)
+        if end:
+            query += " AND s.finish_date < ?"
+            params.append(end)
+        query += " ORDER BY s.id, se.position"
+        return self.connection.execute(query, params)
+
+    def save(self):
+        """Write the changes and the high-water mark in one transaction."""
+        self._flush(high_water_mark=True)
+
+    def close(self):
+        """Close the database connection."""
+        self.connection.close()
+
+
+def make_store(yaml_dict, project):
+    """Build the configured story store of a project, or None.
+
+    The 'story_store' key of the yaml selects the backend: 'json' (default)
+    or 'sqlite'. Both live under 'cache_dir'.
+
+    """
+    cache_dir = yaml_dict.get("cache_dir")
+    if not cache_dir:
+        return None
+    if yaml_dict.get("story_store", "json") == "sqlite":
+        return SQLiteStoryStore.from_config(yaml_dict, project)
+    return StoryStore.from_config(yaml_dict, project)
+
+
+def sync_user_stories(api, store):
+    """Bring a store up to date with the project of api.
+
+    The first sync downloads every done user story. Later syncs only fetch
+    the stories modified since the store's high-water mark, of any status,
+    so stories that were reopened are dropped from the store.
+
+    PARAMETERS:
+        - api: TaigaAPI() object of the project.
+        - store: StoryStore() object of the same project.
+
+    RETURNS: int of user stories received from the API.
+
+    """
+    if store.high_water_mark is None:
+        stories = api.iter_user_stories()
+        done_id = None
+    else:
+        done_id = api._get_done_status()
+        stories = api.iter_modified_user_stories(store.high_water_mark)
+
+    received = 0
+    high_water_mark = store.high_water_mark
+    for us in stories:
+        received += 1
+        if done_id is None or us["status"] == done_id:
+            store.upsert(us)
+        else:
+            store.remove(us["id"])
+        # ISO 8601 dates in the same timezone compare as strings.
+        if high_water_mark is None or us["modified_date"] > high_water_mark:
+            high_water_mark = us["modified_date"]
+
+    store.high_water_mark = high_water_mark
+    store.save()
+    print("Synced {} user stories, {} stored.".format(received, len(store)))
+    return received
@@ -1,21 +1,236 @@
 """Handles all API requests and response processing."""
 import requests
 import json
+import time
+
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .epic_catalog import EpicCatalog
+from .http_cache import ResponseCache
+from .json_stream import iter_json_array
+from .metrics import METRICS
+from .project_metadata import MetadataCache, ProjectMetadata
+from .report_classes import Task, UserStory
+from .scheduler import RequestScheduler
+from .token_store import TokenStore
+
+# Bytes read at a time when decoding paginated responses.
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Defaults for the optional 'connection' block of the yaml.
+CONNECTION_DEFAULTS = {
+    "pool_size": 10,
+    "retries": 3,
+    "backoff_factor": 0.5,
+    "connect_timeout": 5,
+    "read_timeout": 60,
+    # Pages requested at once by async_api.AsyncTaigaAPI.
+    "concurrency": 8,
+}
+
+
+def connection_settings(yaml_dict):
+    """Merge the yaml 'connection' block with CONNECTION_DEFAULTS."""
+    settings = dict(CONNECTION_DEFAULTS)
+    settings.update(yaml_dict.get("connection") or {})
+    return settings
+
+
+def build_session(yaml_dict, pool_size=None):
+    """Create a keep-alive requests.Session() with a pooled retrying adapter.
+
+    The adapter only retries connection errors, for idempotent methods
+    (urllib3's default allow list), so the login POST is never sent twice.
+    Error statuses and throttling are retried by the RequestScheduler.
+
+    PARAMETERS:
+        - yaml_dict: dict of the parsed api.yaml.
+        - pool_size: optional int overriding the configured pool size, e.g.
+            to give every worker of a batch run its own connection.
+
+    RETURNS: requests.Session() object meant to be shared by every TaigaAPI.
+
+    """
+    settings = connection_settings(yaml_dict)
+    if pool_size:
+        settings["pool_size"] = max(settings["pool_size"], pool_size)
+    retry = Retry(total=settings["retries"],
+                  backoff_factor=settings["backoff_factor"],
+                  status=0, respect_retry_after_header=False,
+                  raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=settings["pool_size"],
+                          pool_maxsize=settings["pool_size"],
+                          max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def task_listings(project_id, user_stories=None, milestone=None):
+    """Return the query parameters of each tasks listing to download.
+
+    PARAMETERS:
+        - project_id: int id of the project.
+        - user_stories: optional list of user story ids, one listing each.
+        - milestone: optional int id of a sprint, one listing of its tasks.
+
+    RETURNS: list of dicts, a single one for the whole project if neither
+    is given.
+
+    """
+    if milestone is not None:
+        return [{"project": project_id, "milestone": milestone}]
+    if user_stories is not None:
+        return [{"project": project_id, "user_story": us_id}
+                for us_id in user_stories]
+    return [{"project": project_id}]
 
 
 class TaigaAPI:
     """API class to connect to and interact with the Taiga API."""
 
-    def __init__(self, project, yaml_dict):
-        """Init TaigaAPI with default attr to specific project."""
+    def __init__(self, project, yaml_dict, session=None):
+        """Init TaigaAPI with default attr to specific project.
+
+        PARAMETERS:
+            - project: str of the project block in the yaml.
+            - yaml_dict: dict of the parsed api.yaml.
+            - session: optional requests.Session() to share its connection
+                pool with other TaigaAPI objects. A new one is built if
+                none is given.
+
+        """
         self.slug = yaml_dict[project]["slug"]
         self.authenticated = False
         self.auth_token = None
+        self.refresh_token = None
+        self.token_store = TokenStore.from_config(yaml_dict)
         self.host = yaml_dict["host"]
         self.auth_url = self.host + "auth"
-        self.headers = yaml_dict["headers"]
+        # Copied so the Authorization header never leaks into the yaml dict
+        # shared by other TaigaAPI objects.
+        self.headers = dict(yaml_dict["headers"])
         self.login_data = yaml_dict["login_data"]
-        self.project_id = yaml_dict[project]["id"] or self._project_id
+        self.username = self.login_data.get("username")
+        self.page_size = yaml_dict.get("page_size", 100)
+        settings = connection_settings(yaml_dict)
+        self.timeout = (settings["connect_timeout"], settings["read_timeout"])
+        self.session = session or build_session(yaml_dict)
+        self.scheduler = RequestScheduler.shared(yaml_dict)
+        self.response_cache = ResponseCache.shared(yaml_dict)
+        # Ids from the yaml are trusted without any lookup. Missing ones
+        # are resolved on first use, see _resolve_metadata().
+        self.project_id = yaml_dict[project].get("id")
+        self.done_status = yaml_dict[project].get("done_id")
+        self.metadata = None
+        self.metadata_fresh = False
+        self.metadata_cache = MetadataCache.from_config(yaml_dict, project)
+
+    def for_project(self, project, yaml_dict):
+        """Return a TaigaAPI for another project reusing this login and pool.
+
+        PARAMETERS:
+            - project: str of the project block in the yaml.
+            - yaml_dict: dict of the parsed api.yaml.
+
+        RETURNS: TaigaAPI() object sharing session and auth_token.
+
+        """
+        if not self.authenticated:
+            self._auth()
+        api = TaigaAPI(project, yaml_dict, session=self.session)
+        api.auth_token = self.auth_token
+        api.refresh_token = self.refresh_token
+        api._auth()
+        return api
+
+    def _request(self, method, url, **kwargs):
+        """Send a request through the shared session.
+
+        Every call to the API goes through here so they all share the same
+        connection pool, retry policy and timeouts. If the server rejects the
+        auth_token with a 401, a new one is obtained and the request is sent
+        once more.
+
+        RETURNS: requests.Response() object.
+
+        """
+        if kwargs.get("headers") is None:
+            kwargs["headers"] = self.headers
+        kwargs.setdefault("timeout", self.timeout)
+        response = self._send(method, url, kwargs)
+        if (response.status_code == 401 and self.authenticated
+                and not url.startswith(self.auth_url)):
+            print("auth_token rejected, getting a new one.")
+            self.auth_token = self._new_token(rejected=self.auth_token)
+            self._add_auth_token(self.auth_token)
+            # Custom headers (e.g. the paginated ones) are copies.
+            kwargs["headers"]["Authorization"] = self.headers["Authorization"]
+            response = self._send(method, url, kwargs)
+        return response
+
+    def _send(self, method, url, kwargs):
+        """Send one request through the scheduler and record its metrics.
+
+        The scheduler paces the request and retries it if throttled, see
+        scheduler.RequestScheduler. Streamed bodies are counted as they are
+        read, in _iter_pages().
+
+        """
+        def send():
+            with METRICS.phase("http_request"):
+                response = self.session.request(method, url, **kwargs)
+            METRICS.count("requests")
+            return response
+
+        response = self.scheduler.send(method, url, send)
+        if not kwargs.get("stream"):
+            METRICS.count("response_bytes", len(response.content))
+        return response
+
+    def _get(self, url, params=None, headers=None, cache=True, stream=False):
+        """Send a GET, revalidating against the response cache if any.
+
+        Cached responses are requested with If-None-Match/If-Modified-Since
+        and a 304 is answered with the body stored on disk, so unchanged
+        data is neither transferred again nor stored twice.
+
+        PARAMETERS:
+            - url: str of the url to get.
+            - params: optional dict of query parameters.
+            - headers: optional dict of headers. Defaults to self.headers.
+            - cache: bool, False bypasses the response cache.
+            - stream: bool, True defers downloading the body until it is
+                iterated. Cached responses are always fully read.
+
+        RETURNS: requests.Response() object.
+
+        """
+        if not (cache and self.response_cache):
+            return self._request("GET", url, params=params, headers=headers,
+                                 stream=stream)
+
+        # The key is built from the full url so paginated pages don't clash.
+        url = requests.Request("GET", url, params=params).prepare().url
+        key = self.response_cache.key(url, self.username)
+        headers = dict(headers or self.headers)
+        conditional = dict(headers, **self.response_cache.validators(key))
+        response = self._request("GET", url, headers=conditional,
+                                 stream=stream)
+        if response.status_code == 304:
+            cached = self.response_cache.load(key)
+            if cached is not None:
+                METRICS.count("cache_hits")
+                return cached
+            # The body is gone, so it is asked for again unconditionally,
+            # keeping the caller's headers (e.g. pagination) and stream.
+            response = self._request("GET", url, headers=headers,
+                                     stream=stream)
+        if response.status_code == 200:
+            self.response_cache.store(key, response)
+        return response
 
     def _login(self):
         """Log the api object to Taiga's API.
@@ -27,33 +242,100 @@ class TaigaAPI:
                 raise_for_status()
 
         """
-        response = requests.post(self.auth_url,
-                                 headers=self.headers,
-                                 data=json.dumps(self.login_data))
+        response = self._request("POST", self.auth_url,
+                                 data=json.dumps(self.login_data),
+                                 headers=self._auth_headers())
 
         # Raises http exception if status_code not ok.
         response.raise_for_status()
 
-        return response.json()["auth_token"]
+        auth_data = response.json()
+        self.refresh_token = auth_data.get("refresh")
+        return auth_data["auth_token"]
+
+    def _refresh(self):
+        """Get a new auth_token from the stored refresh token.
+
+        RETURNS: a str() of the auth_token
+
+        RAISES:
+            - requests.exceptions.HTTPError if the refresh token is rejected.
+
+        """
+        response = self._request("POST", self.auth_url + "/refresh",
+                                 data=json.dumps(
+                                     {"refresh": self.refresh_token}),
+                                 headers=self._auth_headers())
+        response.raise_for_status()
+
+        auth_data = response.json()
+        self.refresh_token = auth_data.get("refresh", self.refresh_token)
+        return auth_data["auth_token"]
+
+    def _refresh_or_login(self):
+        """Return a new auth_token, refreshing if possible or logging in."""
+        if self.refresh_token:
+            try:
+                return self._refresh()
+            except requests.exceptions.HTTPError:
+                self.refresh_token = None
+        print("No auth_token detected, logging in.")
+        return self._login()
+
+    def _new_token(self, rejected=None):
+        """Return a usable auth_token, logging in only when needed.
+
+        With a token store, a stored token that is not expired (and is not
+        the rejected one) is reused. Otherwise the token is refreshed or a
+        new login is done, and the result is stored for the next runs.
+
+        PARAMETERS:
+            - rejected: str of an auth_token the server answered 401 to.
+
+        RETURNS: a str() of the auth_token
+
+        """
+        if not self.token_store:
+            with METRICS.phase("login"):
+                return self._refresh_or_login()
+        with self.token_store.lock():
+            entry = self.token_store.get(self.host, self.username)
+            if entry:
+                if (entry["auth_token"] != rejected
+                        and not self.token_store.is_expired(entry)):
+                    self.refresh_token = entry["refresh"]
+                    return entry["auth_token"]
+                self.refresh_token = self.refresh_token or entry["refresh"]
+            with METRICS.phase("login"):
+                auth_token = self._refresh_or_login()
+            self.token_store.save(self.host, self.username, auth_token,
+                                  self.refresh_token)
+            return auth_token
 
     def _auth(self):
         """Add auth_token to request headers or get new one if none stored."""
         if not self.auth_token:
-            print("No auth_token detected, logging in.")
-            self.auth_token = self._login()
+            self.auth_token = self._new_token()
         self._add_auth_token(self.auth_token)
         self.authenticated = True
 
+    def _auth_headers(self):
+        """Return a copy of the headers without Authorization.
+
+        Taiga checks the Authorization header before the auth views run,
+        so a login sent with a rejected token would be rejected too.
+
+        """
+        return {key: value for key, value in self.headers.items()
+                if key.lower() != "authorization"}
+
     def _add_auth_token(self, auth_token):
         self.headers["Authorization"] = "Bearer " + auth_token
 
-    @property
-    def _project_id(self, yaml_dict):
-        """Retrieve the project id at init.
+    def project_metadata(self):
+        """Get the project id, status ids and tag colors in one request.
 
-        As it is a property, it can't be reassigned or deleted.
-
-        RETURNS: An int object containing the project id.
+        RETURNS: ProjectMetadata() object.
 
         RAISES:
             -requests.exceptions.HTTPError: If the request fails for any
@@ -63,13 +345,46 @@ class TaigaAPI:
         if not self.authenticated:
             self._auth()
         url = self.host + "projects/by_slug?slug=" + self.slug
-        response = requests.get(url, headers=self.headers)
+        print("Getting project info from " + url)
+        with METRICS.phase("project_lookup"):
+            response = self._get(url)
         response.raise_for_status()
-        return response.json().get("id")
+        return ProjectMetadata(response.json())
+
+    def _resolve_metadata(self, refresh=False):
+        """Set project_id and done_status from the cache or one lookup.
+
+        PARAMETERS:
+            - refresh: bool, True skips the cache and looks them up again,
+                e.g. when the cached ids didn't match the server.
+
+        """
+        metadata = None
+        if self.metadata_cache and not refresh:
+            metadata = self.metadata_cache.get()
+        self.metadata_fresh = metadata is None
+        if metadata is None:
+            metadata = self.project_metadata()
+            if self.metadata_cache:
+                self.metadata_cache.save(metadata)
+        self.metadata = metadata
+        self.project_id = metadata.id
+        self.done_status = metadata.status_id("done")
+        print("Done status id: " + str(self.done_status))
+
+    def _require_project_id(self):
+        """Return the project id, resolving it if the yaml has none."""
+        if self.project_id is None:
+            self._resolve_metadata()
+        return self.project_id
 
-    def download_user_stories(self):
+    def download_user_stories(self, period=None):
         """Get the user stories from the project at the specified slug.
 
+        PARAMETERS:
+            - period: optional ReportPeriod() the stories are filtered by
+                on the server.
+
         RETURNS: List of dicts with all the info about the user stories in the
         'DONE' category
         """
@@ -80,26 +395,202 @@ class TaigaAPI:
                                                            done_id)
         project_us_url = self.host + us_uri
         print("Downloading User Stories from " + project_us_url)
-        user_stories = requests.get(project_us_url,
-                                    headers=self.headers)
+        user_stories = self._get(project_us_url,
+                                 params=period.filters() if period else None)
         user_stories.raise_for_status()
         us_json = user_stories.json()
-        if not us_json:
+        # A month without stories is an empty report, not an error.
+        if not us_json and period is None:
             raise ValueError("No user stories were found.")
 
         return us_json
 
+    def iter_user_stories(self, page_size=None, period=None):
+        """Yield the 'DONE' user stories of the project page by page.
+
+        Unlike download_user_stories(), pagination is enabled and the
+        x-pagination-next header of each response is followed until the last
+        page, so only one page of user stories is held in memory at a time.
+
+        PARAMETERS:
+            - page_size: int of user stories per page. Defaults to the
+                'page_size' key of the yaml or 100.
+            - period: optional ReportPeriod(). Its filters are sent with
+                the request, so only the stories of the period are
+                downloaded.
+
+        YIELDS: dicts with all the info about each user story.
+
+        RAISES:
+            - requests.exceptions.HTTPError if any page request fails.
+            - ValueError if the project has no user stories. An empty
+                period yields nothing instead.
+
+        """
+        if not self.authenticated:
+            self._auth()
+        done_id = self._get_done_status()
+        while True:
+            found = False
+            params = {"project": self.project_id, "status": done_id}
+            if period is not None:
+                params.update(period.filters())
+            for us in self._iter_pages("userstories", params, page_size,
+                                       UserStory.FIELDS):
+                found = True
+                yield us
+            # An empty period says nothing about the ids, it may just have
+            # had no stories done.
+            if found or self.metadata_fresh or period is not None:
+                break
+            # Ids from the yaml or the cache may be stale. They are looked
+            # up again and the download retried once if they changed.
+            print("No user stories found, checking the project ids.")
+            ids = (self.project_id, done_id)
+            if self.metadata_cache:
+                self.metadata_cache.invalidate()
+            self._resolve_metadata(refresh=True)
+            done_id = self.done_status
+            if (self.project_id, done_id) == ids:
+                break
+
+        if not found and period is None:
+            raise ValueError("No user stories were found.")
+
+    def iter_modified_user_stories(self, since, page_size=None):
+        """Yield the user stories of any status modified since a date.
+
+        PARAMETERS:
+            - since: str of an ISO 8601 datetime, as in the stories'
+                'modified_date'.
+            - page_size: int of user stories per page.
+
+        YIELDS: dicts with all the info about each user story.
+
+        RAISES:
+            - requests.exceptions.HTTPError if any page request fails.
+
+        """
+        if not self.authenticated:
+            self._auth()
+        yield from self._iter_pages("userstories",
+                                    {"project": self._require_project_id(),
+                                     "modified_date__gte": since},
+                                    page_size, UserStory.FIELDS)
+
+    def iter_tasks(self, page_size=None, user_stories=None, milestone=None):
+        """Yield every task of the project in one paginated sweep.
+
+        Used to join the full task details to the user stories with
+        report_classes.index_tasks() for a fixed number of requests,
+        instead of one request per user story. Reports of a period only
+        need the tasks of its few stories, see runner.task_filters().
+
+        PARAMETERS:
+            - page_size: int of tasks per page.
+            - user_stories: optional list of user story ids. Only their
+                tasks are listed, one listing per story.
+            - milestone: optional int id of a sprint. Only its tasks are
+                listed.
+
+        YIELDS: dicts with the Task.FIELDS of each task.
+
+        RAISES:
+            - requests.exceptions.HTTPError if any page request fails.
+
+        """
+        if not self.authenticated:
+            self._auth()
+        for params in task_listings(self._require_project_id(),
+                                    user_stories, milestone):
+            yield from self._iter_pages("tasks", params, page_size,
+                                        Task.FIELDS)
+
+    def iter_epics(self, page_size=None):
+        """Yield every epic of the project, see EpicCatalog.
+
+        PARAMETERS:
+            - page_size: int of epics per page.
+
+        YIELDS: dicts with the EpicCatalog.FIELDS of each epic.
+
+        RAISES:
+            - requests.exceptions.HTTPError if any page request fails.
+
+        """
+        if not self.authenticated:
+            self._auth()
+        yield from self._iter_pages("epics",
+                                    {"project": self._require_project_id()},
+                                    page_size, EpicCatalog.FIELDS)
+
+    def _iter_pages(self, endpoint, params, page_size=None, fields=None):
+        """Yield every item of a paginated listing endpoint.
+
+        Follows the x-pagination-next header of each response until the
+        last page. Each page is decoded incrementally from the response
+        stream.
+
+        PARAMETERS:
+            - endpoint: str of the endpoint relative to the host.
+            - params: dict of query parameters of the first page.
+            - page_size: int of items per page. Defaults to self.page_size.
+            - fields: optional iterable of keys to keep from each item.
+
+        """
+        url = self.host + endpoint
+        params = dict(params, page_size=page_size or self.page_size)
+        headers = self._paginated_headers()
+        while url:
+            print("Downloading {} from {}".format(endpoint, url))
+            response = self._get(url, params=params, headers=headers,
+                                 stream=True)
+            response.raise_for_status()
+            # Body transfer and decoding are timed together, leaving out
+            # the time the consumer spends between items.
+            decode_time = 0.0
+            start = time.perf_counter()
+            for item in iter_json_array(
+                    self._counted(response.iter_content(STREAM_CHUNK_SIZE)),
+                    fields):
+                decode_time += time.perf_counter() - start
+                yield item
+                start = time.perf_counter()
+            METRICS.add_time("body_decode",
+                             decode_time + time.perf_counter() - start)
+            # The next page url already carries the query string.
+            url = response.headers.get("x-pagination-next")
+            params = None
+
+    @staticmethod
+    def _counted(chunks):
+        """Pass chunks through, counting their bytes in the metrics."""
+        size = 0
+        for chunk in chunks:
+            size += len(chunk)
+            yield chunk
+        METRICS.count("response_bytes", size)
+
+    def _paginated_headers(self):
+        """Return a copy of the headers without x-disable-pagination."""
+        return {key: value for key, value in self.headers.items()
+                if key.lower() != "x-disable-pagination"}
+
     def _get_done_status(self):
-        """Get the status id from the API to filter user stories."""
-        url = self.host + "userstory-statuses?project="+str(self.project_id)
-        print("Getting status info from " + url)
-        us_statuses = requests.get(url, headers=self.headers)
-        us_statuses.raise_for_status()
-
-        for us_status in us_statuses.json():
-            if us_status.get("slug") == "done":
-                print("Done status id: " + str(us_status["id"]))
-                return us_status["id"]
+        """Get the status id used to filter user stories.
+
+        Uses the yaml 'done_id' when set, otherwise the project metadata,
+        from the disk cache or one projects/by_slug lookup. The id is kept
+        once known, so long lived objects (see service.py) only resolve it
+        once.
+
+        RETURNS: int of the done status id, or None if the project has no
+        'done' status.
+
+        """
+        if self.done_status is None or self.project_id is None:
+            self._resolve_metadata()
+        return self.done_status
 
 
 class APIError(Exception):
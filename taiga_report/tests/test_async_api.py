@@ -0,0 +1,137 @@
+"""Tests of the asyncio client against the local Taiga stub server."""
+import asyncio
+import time
+
+import pytest
+import requests
+
+from taiga_report.async_api import AsyncTaigaAPI
+from taiga_report.benchmarks.dataset import generate_user_stories, project_yaml
+from taiga_report.benchmarks.stub_server import StubTaiga, run_stub_server
+from taiga_report.report_period import ReportPeriod
+from taiga_report.runner import generate_report_async, run_batch_async
+
+
+@pytest.fixture
+def taiga():
+    """Return a stub with 250 done stories."""
+    return StubTaiga(list(generate_user_stories(250)))
+
+
+@pytest.fixture
+def yaml_dict(taiga):
+    """Serve the stub and return a yaml dict pointing to it."""
+    with run_stub_server(taiga) as url:
+        yaml_dict = project_yaml(host=url)
+        yaml_dict["page_size"] = 10
+        yield yaml_dict
+
+
+def collect(yaml_dict, method="iter_user_stories", **kwargs):
+    """Return the items of an async listing of the 'bench' project."""
+    async def main():
+        api = AsyncTaigaAPI("bench", yaml_dict)
+        try:
+            return [item async for item in getattr(api, method)(**kwargs)]
+        finally:
+            api.close()
+    return asyncio.run(main())
+
+
+def test_pages_are_yielded_in_order(taiga, yaml_dict):
+    """Test that concurrent pages keep the order of the listing."""
+    stories = collect(yaml_dict)
+    assert [us["id"] for us in stories] == list(range(1, 251))
+    # Login and 25 pages.
+    assert taiga.requests == 26
+
+
+def test_pages_are_downloaded_concurrently(taiga, yaml_dict):
+    """Test that 25 pages take a few round trips instead of 25."""
+    taiga.latency = 0.05
+    yaml_dict["connection"] = {"concurrency": 8}
+    start = time.perf_counter()
+    assert len(collect(yaml_dict)) == 250
+    # Login, first page and four rounds of up to eight pages.
+    assert time.perf_counter() - start < 25 * taiga.latency
+
+
+def test_listing_without_count_is_followed(taiga, yaml_dict, monkeypatch):
+    """Test the fallback to the next links when the count is missing."""
+    monkeypatch.setattr(AsyncTaigaAPI, "_page_count",
+                        staticmethod(lambda headers: None))
+    assert len(collect(yaml_dict, "iter_tasks")) == len(taiga.tasks())
+
+
+def test_period_and_stale_ids(taiga, yaml_dict):
+    """Test the period filters and the lookup of a stale done id."""
+    period = ReportPeriod.between("2020-01-02", "2020-01-02")
+    stories = collect(yaml_dict, period=period)
+    assert [us["id"] for us in stories] == [
+        us["id"] for us in taiga.stories if period.contains(us)]
+    # An empty month is a valid report, the ids are only checked again
+    # when the whole listing is empty.
+    assert collect(yaml_dict, period=ReportPeriod.between(
+        "1999-01-01", "1999-01-31")) == []
+    yaml_dict["bench"]["done_id"] = 99
+    assert len(collect(yaml_dict)) == len(taiga.stories)
+
+
+def test_generate_report_async(taiga, yaml_dict):
+    """Test a whole report, with tasks, through the async client."""
+    async def main():
+        api = AsyncTaigaAPI("bench", yaml_dict)
+        try:
+            return await generate_report_async(api, "bench", yaml_dict,
+                                               lambda report: report,
+                                               tasks=True)
+        finally:
+            api.close()
+    report = asyncio.run(main())
+    assert report._tasks
+    assert sum(len(stories) for section in report._report.values()
+               for stories in section.values()) >= 250
+
+
+def test_generate_report_async_period_tasks(taiga, yaml_dict):
+    """Test that a sprint report only lists the tasks of that sprint."""
+    for us in taiga.stories[:3]:
+        us["milestone"] = 3
+
+    async def main():
+        api = AsyncTaigaAPI("bench", yaml_dict)
+        try:
+            return await generate_report_async(
+                api, "bench", yaml_dict, lambda report: report, tasks=True,
+                period=ReportPeriod(milestone=3))
+        finally:
+            api.close()
+    report = asyncio.run(main())
+    assert set(report._tasks) == {us["id"] for us in taiga.stories[:3]
+                                  if us["tasks"]}
+    assert taiga.task_filters == [{"milestone": "3"}]
+
+
+def test_run_batch_async_shares_one_login(taiga, yaml_dict):
+    """Test that a batch run logs in once and reports failures."""
+    yaml_dict["broken"] = {"slug": "missing", "report_sections": []}
+    results, _ = run_batch_async(yaml_dict, workers=2,
+                                 printer=lambda report: report.project)
+    assert [result["project"] for result in results] == ["bench", "broken"]
+    assert results[0]["ok"] and results[0]["filename"] == "BENCH"
+    assert not results[1]["ok"]
+    assert "HTTPError" in results[1]["error"]
+    assert len(taiga.tokens) == 1
+
+
+def test_run_batch_async_login_failure(yaml_dict, monkeypatch):
+    """Test that a rejected login fails every project of the batch."""
+    async def reject(self):
+        raise requests.exceptions.HTTPError("401 Unauthorized")
+
+    monkeypatch.setattr(AsyncTaigaAPI, "_auth", reject)
+    yaml_dict["other"] = {"slug": "other", "report_sections": []}
+    results, _ = run_batch_async(yaml_dict, printer=lambda report: None)
+    assert [result["project"] for result in results] == ["bench", "other"]
+    assert all(result["error"] == "HTTPError: 401 Unauthorized"
+               for result in results)
@@ -0,0 +1,33 @@
+"""Tests for the benchmark dataset generator and suite."""
+from taiga_report import report_classes as rc
+from taiga_report.benchmarks import dataset, suite
+
+
+def test_generator_is_seeded():
+    """Test that the same seed yields the same stories."""
+    first = list(dataset.generate_user_stories(50, seed=3))
+    assert first == list(dataset.generate_user_stories(50, seed=3))
+    assert first != list(dataset.generate_user_stories(50, seed=4))
+
+
+def test_generated_stories_fit_the_report():
+    """Test that generated payloads go through UserStory and Report."""
+    report = rc.Report("bench", dataset.project_yaml())
+    for us in dataset.generate_user_stories(200):
+        report.classify_user_story(rc.UserStory(us))
+    assert set(report._report) - {None} <= set(dataset.SECTIONS)
+    assert sum(len(stories) for section in report._report.values()
+               for stories in section.values()) == 200
+
+
+def test_suite_results_and_compare():
+    """Test that a small run can be compared against itself."""
+    results = suite.run_suite([20], stages=["classify", "markdown"],
+                              trace_memory=False)
+    assert [r["stage"] for r in results["results"]] == ["classify",
+                                                         "markdown"]
+    rows = suite.compare(results, results)
+    assert not any(row["regression"] for row in rows)
+    slower = {"results": [dict(r, seconds=r["seconds"] * 2)
+                          for r in results["results"]]}
+    assert all(row["regression"] for row in suite.compare(results, slower))
@@ -0,0 +1,74 @@
+"""Tests of the yaml config lookup and its parsed cache."""
+import os
+import sys
+
+import pytest
+
+from taiga_report import config
+
+
+@pytest.fixture
+def yaml_file(tmp_path, monkeypatch):
+    """Return a config file, with the parsed cache kept under tmp_path."""
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    monkeypatch.setattr(config, "_parsed", {})
+    path = tmp_path / "api.yaml"
+    path.write_text("host: https://example.com/api/v1/\n"
+                    "sieel:\n    slug: sieel\n    id: 6\n")
+    return path
+
+
+def test_config_path_defaults(monkeypatch):
+    """Test the environment variable and the package default."""
+    monkeypatch.delenv("TAIGA_REPORT_CONFIG", raising=False)
+    assert config.config_path() == config.DEFAULT_CONFIG
+    monkeypatch.setenv("TAIGA_REPORT_CONFIG", "other.yaml")
+    assert config.config_path() == os.path.abspath("other.yaml")
+    assert config.config_path("given.yaml") == os.path.abspath("given.yaml")
+
+
+def test_load_config_parses_yaml(yaml_file):
+    """Test that the yaml is parsed into a dict."""
+    yaml_dict = config.load_config(str(yaml_file))
+    assert yaml_dict["sieel"] == {"slug": "sieel", "id": 6}
+
+
+def test_cached_config_skips_yaml(yaml_file, monkeypatch):
+    """Test that a second process loads the JSON cache without yaml."""
+    config.load_config(str(yaml_file))
+    monkeypatch.setattr(config, "_parsed", {})
+    monkeypatch.setitem(sys.modules, "yaml", None)
+    yaml_dict = config.load_config(str(yaml_file))
+    assert yaml_dict["host"] == "https://example.com/api/v1/"
+
+
+@pytest.mark.skipif(os.name != "posix", reason="POSIX permissions")
+def test_cache_is_private(yaml_file, tmp_path):
+    """Test that the cached login data is readable by the user only."""
+    directory = tmp_path / "cache" / "taiga_report"
+    directory.mkdir(parents=True, mode=0o755)
+    config.load_config(str(yaml_file))
+    assert directory.stat().st_mode & 0o777 == 0o700
+    cached = config._cache_file(str(yaml_file))
+    assert os.stat(cached).st_mode & 0o777 == 0o600
+
+
+def test_cache_returns_copies(yaml_file):
+    """Test that changing a loaded dict doesn't change the cache."""
+    config.load_config(str(yaml_file))["host"] = "changed"
+    assert config.load_config(str(yaml_file))["host"] != "changed"
+
+
+def test_changed_file_is_parsed_again(yaml_file):
+    """Test that editing the yaml invalidates the cache."""
+    config.load_config(str(yaml_file))
+    yaml_file.write_text("host: https://other.com/api/v1/\n")
+    os.utime(str(yaml_file), ns=(0, 1))
+    assert config.load_config(str(yaml_file)) == {
+        "host": "https://other.com/api/v1/"}
+
+
+def test_missing_config_raises(tmp_path):
+    """Test that a missing file raises FileNotFoundError."""
+    with pytest.raises(FileNotFoundError):
+        config.load_config(str(tmp_path / "missing.yaml"))
@@ -0,0 +1,71 @@
+"""Tests of the epic catalog and its disk cache."""
+import json
+
+import pytest
+
+from taiga_report.epic_catalog import EpicCatalog
+
+EPICS = [{"id": 7, "ref": 3, "subject": "Later", "epics_order": 2},
+         {"id": 5, "ref": 1, "subject": "Sooner", "epics_order": 1}]
+
+
+class FakeAPI:
+    """Counts the epic sweeps of a TaigaAPI."""
+
+    def __init__(self):
+        self.sweeps = 0
+
+    def iter_epics(self):
+        self.sweeps += 1
+        return iter(EPICS)
+
+
+@pytest.fixture
+def yaml_dict(tmp_path):
+    """Return a yaml dict with the catalog enabled."""
+    return {"cache_dir": str(tmp_path),
+            "epic_catalog": {"enabled": True, "ttl_minutes": 10}}
+
+
+def test_order_and_subjects():
+    """Test the backlog order and the subject lookup by id."""
+    catalog = EpicCatalog(EPICS)
+    assert [epic["subject"] for epic in catalog.epics] == ["Sooner", "Later"]
+    assert catalog.subjects([{"id": 7, "subject": "Stale"},
+                             {"id": 9, "subject": "Brand new"}]) == [
+        "Later", "Brand new"]
+    assert catalog.position("Sooner") < catalog.position("Later")
+    assert catalog.position("Brand new") == len(catalog)
+
+
+def test_disabled_without_block():
+    """Test that no catalog is built unless the yaml asks for it."""
+    api = FakeAPI()
+    assert EpicCatalog.from_config(api, {}, "sieel") is None
+    assert EpicCatalog.from_config(
+        api, {"epic_catalog": {"enabled": False}}, "sieel") is None
+    assert api.sweeps == 0
+
+
+def test_cached_until_ttl(yaml_dict, tmp_path):
+    """Test that the epics are fetched once per TTL."""
+    api = FakeAPI()
+    assert len(EpicCatalog.from_config(api, yaml_dict, "sieel")) == 2
+    assert len(EpicCatalog.from_config(api, yaml_dict, "sieel")) == 2
+    assert api.sweeps == 1
+
+    path = tmp_path / "epics" / "sieel.json"
+    data = json.loads(path.read_text())
+    data["fetched"] -= 11 * 60
+    path.write_text(json.dumps(data))
+    EpicCatalog.from_config(api, yaml_dict, "sieel")
+    assert api.sweeps == 2
+
+
+def test_without_cache_dir(yaml_dict):
+    """Test that without cache_dir the epics are fetched every time."""
+    del yaml_dict["cache_dir"]
+    api = FakeAPI()
+    EpicCatalog.from_config(api, yaml_dict, "sieel")
+    EpicCatalog.from_config(api, yaml_dict, "sieel")
+    assert api.sweeps == 2
@@ -0,0 +1,101 @@
+"""Tests for the conditional GET response cache."""
+import pytest
+import requests
+
+from taiga_report import http_cache
+
+
+def make_response(content, headers, url="https://taiga.example/us"):
+    """Return a requests.Response() with the given body and headers."""
+    response = requests.Response()
+    response.status_code = 200
+    response._content = content
+    response.headers = requests.structures.CaseInsensitiveDict(headers)
+    response.url = url
+    return response
+
+
+@pytest.fixture
+def cache(tmp_path):
+    """Return an empty cache in a temporary directory."""
+    return http_cache.ResponseCache(tmp_path, max_bytes=10)
+
+
+def test_store_and_load(cache):
+    """Test that a stored body is replayed with its pagination headers."""
+    cache.store("key", make_response(b"[1, 2]", {
+        "ETag": '"abc"', "x-pagination-next": "next", "Server": "nginx"}))
+    assert cache.validators("key") == {"If-None-Match": '"abc"'}
+    response = cache.load("key")
+    assert response.json() == [1, 2]
+    assert response.headers["x-pagination-next"] == "next"
+    assert "Server" not in response.headers
+    assert b"".join(cache.load("key").iter_content(2)) == b"[1, 2]"
+
+
+def test_responses_without_validators_are_not_stored(cache):
+    """Test that nothing is kept if it can't be revalidated."""
+    cache.store("key", make_response(b"[]", {}))
+    assert cache.validators("key") == {}
+    assert cache.load("key") is None
+
+
+def test_least_recently_used_is_evicted(cache):
+    """Test that the cache stays under max_bytes dropping old entries."""
+    cache.store("old", make_response(b"12345", {"ETag": "1"}))
+    cache.store("used", make_response(b"12345", {"ETag": "2"}))
+    cache.load("old")
+    cache.store("new", make_response(b"12345", {"ETag": "3"}))
+    assert cache.load("used") is None
+    assert cache.load("old") is not None
+    assert cache.load("new") is not None
+
+
+def test_index_survives_restart(cache, tmp_path):
+    """Test that a new cache object sees the stored entries."""
+    cache.store("key", make_response(b"[]", {"Last-Modified": "yesterday"}))
+    reopened = http_cache.ResponseCache(tmp_path)
+    assert reopened.validators("key") == {"If-Modified-Since": "yesterday"}
+
+
+def test_from_config_can_be_disabled():
+    """Test that the cache needs cache_dir and can be turned off."""
+    assert http_cache.ResponseCache.from_config({}) is None
+    assert http_cache.ResponseCache.from_config(
+        {"cache_dir": "c", "http_cache": {"enabled": False}}) is None
+
+
+def test_loaded_response_can_be_streamed(cache):
+    """Test that a replayed body can be read like a streamed page."""
+    cache.store("key", make_response(b"[1, 2]", {"ETag": '"abc"'}))
+    response = cache.load("key")
+    assert b"".join(response.iter_content(4)) == b"[1, 2]"
+
+
+def test_caches_sharing_a_directory_keep_the_bound(cache, tmp_path):
+    """Test that two caches on one directory merge instead of overwrite."""
+    other = http_cache.ResponseCache(tmp_path, max_bytes=10)
+    cache.store("first", make_response(b"12345678", {"ETag": "1"}))
+    other.store("second", make_response(b"12345678", {"ETag": "2"}))
+    bodies = {path.stem: path.stat().st_size
+              for path in tmp_path.glob("*.body")}
+    assert bodies == {"second": 8}
+    assert set(http_cache.ResponseCache(tmp_path)._index) == {"second"}
+
+
+def test_load_does_not_write_the_index(cache, tmp_path):
+    """Test that uses are kept in memory until flush()."""
+    cache.store("key", make_response(b"[]", {"ETag": "1"}))
+    before = (tmp_path / "index.json").read_bytes()
+    cache.load("key")
+    assert (tmp_path / "index.json").read_bytes() == before
+    cache.flush()
+    assert (tmp_path / "index.json").read_bytes() != before
+
+
+def test_shared_returns_one_cache_per_directory(tmp_path):
+    """Test that every TaigaAPI of a config gets the same cache."""
+    yaml_dict = {"cache_dir": str(tmp_path)}
+    cache = http_cache.ResponseCache.shared(yaml_dict)
+    assert http_cache.ResponseCache.shared(yaml_dict) is cache
+    assert http_cache.ResponseCache.shared({}) is None
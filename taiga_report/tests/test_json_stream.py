@@ -0,0 +1,39 @@
+"""Tests for the incremental JSON array decoder."""
+import json
+
+import pytest
+
+from taiga_report.json_stream import iter_json_array
+
+
+def split(content, size):
+    """Split bytes into chunks of size."""
+    return [content[i:i + size] for i in range(0, len(content), size)]
+
+
+@pytest.mark.parametrize("size", [1, 5, 64, 1 << 20])
+def test_items_split_across_chunks(size):
+    """Test that items are decoded whatever the chunk boundaries."""
+    items = [{"subject": "ñandú {}".format(i), "tags": [["a", None]]}
+             for i in range(20)] + [12345, "text", None]
+    content = json.dumps(items).encode()
+    assert list(iter_json_array(split(content, size))) == items
+
+
+def test_fields_are_projected():
+    """Test that only the requested keys are kept."""
+    content = b'[{"subject": "US", "watchers": [1], "id": 3}]'
+    assert list(iter_json_array([content], ["id", "subject"])) == [
+        {"id": 3, "subject": "US"}]
+
+
+def test_empty_array():
+    """Test that an empty array yields nothing."""
+    assert list(iter_json_array([b" [ ] "])) == []
+
+
+@pytest.mark.parametrize("content", [b'{"a": 1}', b'[1, 2', b'[1 2]'])
+def test_malformed_content_raises(content):
+    """Test that anything but a full array raises ValueError."""
+    with pytest.raises(ValueError):
+        list(iter_json_array([content]))
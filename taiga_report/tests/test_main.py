@@ -0,0 +1,95 @@
+"""Tests of the command line interface."""
+import io
+import os
+import subprocess
+import sys
+
+import pytest
+
+import taiga_report
+from taiga_report.__main__ import FORMATS, parse_args, run
+from taiga_report.benchmarks.dataset import generate_user_stories, project_yaml
+from taiga_report.benchmarks.stub_server import StubTaiga, run_stub_server
+from taiga_report.printer_classes import PRINTERS, MarkdownPrinter
+from taiga_report.runner import generate_report
+from taiga_report.taiga_api import TaigaAPI
+
+
+def test_formats_match_printers():
+    """Test that every printer can be selected from the CLI."""
+    assert sorted(FORMATS) == sorted(PRINTERS)
+
+
+def test_parse_args():
+    """Test the project, format, config and output options."""
+    args = parse_args(["sieel", "--format", "md", "--config", "x.yaml",
+                       "--output-dir", "reports"])
+    assert (args.project, args.formats, args.config, args.output_dir) == (
+        "sieel", ["md"], "x.yaml", "reports")
+    assert parse_args([]).formats == ["docx"]
+
+
+def test_parse_repeated_formats():
+    """Test that repeated formats are kept once, in order."""
+    args = parse_args(["-f", "md", "-f", "docx", "-f", "md"])
+    assert args.formats == ["md", "docx"]
+
+
+def test_markdown_path_skips_docx():
+    """Test that the markdown printer doesn't import python-docx or lxml."""
+    code = ("import sys\n"
+            "import taiga_report.__main__, taiga_report.runner\n"
+            "from taiga_report.printer_classes import PRINTERS\n"
+            "assert PRINTERS['md']\n"
+            "print(sorted({'docx', 'lxml', 'yaml'} & set(sys.modules)))\n")
+    root = os.path.dirname(os.path.dirname(taiga_report.__file__))
+    output = subprocess.run([sys.executable, "-c", code], check=True,
+                            stdout=subprocess.PIPE, cwd=root).stdout
+    assert output.strip() == b"[]"
+
+
+def test_parse_report_period():
+    """Test that the period options build one ReportPeriod."""
+    assert parse_args([]).period is None
+    period = parse_args(["--month", "03-2024"]).period
+    assert (period.label, period.bounds()) == (
+        "03-2024", ("2024-03-01", "2024-04-01"))
+    period = parse_args(["--since", "2024-03-05", "--milestone", "7"]).period
+    assert period.filters() == {"finish_date__gte": "2024-03-05",
+                                "milestone": 7}
+
+
+def test_parse_invalid_report_period(capsys):
+    """Test that bad or conflicting periods are usage errors."""
+    for argv in (["--month", "2024"], ["--month", "13-2024"],
+                 ["--month", "03-2024", "--since", "2024-03-01"],
+                 ["--since", "2024-03-05", "--until", "2024-03-01"]):
+        with pytest.raises(SystemExit):
+            parse_args(argv)
+
+
+def test_stdout_streams_the_markdown(capsys, tmp_path, monkeypatch):
+    """Test that --stdout prints only the report to stdout."""
+    monkeypatch.chdir(tmp_path)
+    taiga = StubTaiga(list(generate_user_stories(20)))
+    with run_stub_server(taiga) as url:
+        yaml_dict = project_yaml(host=url)
+        report = generate_report(TaigaAPI("bench", yaml_dict), "bench",
+                                 yaml_dict, lambda report: report)
+        expected = io.StringIO()
+        MarkdownPrinter.write_markdown(report, expected)
+        capsys.readouterr()
+        assert run(parse_args(["bench", "--stdout"]), yaml_dict) == 0
+    out, err = capsys.readouterr()
+    assert out == expected.getvalue()
+    assert "Success :)" in err
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_stdout_only_prints_one_markdown_report():
+    """Test that --stdout can't be combined with files or batches."""
+    assert parse_args(["--stdout"]).formats == ["md"]
+    for argv in (["--stdout", "-f", "docx"], ["--stdout", "--all"],
+                 ["--stdout", "--serve"]):
+        with pytest.raises(SystemExit):
+            parse_args(argv)
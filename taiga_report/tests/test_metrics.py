@@ -0,0 +1,114 @@
+"""Tests of the phase timers and counters."""
+import json
+
+import pytest
+
+from taiga_report.benchmarks.dataset import generate_user_stories, project_yaml
+from taiga_report.benchmarks.stub_server import StubTaiga, run_stub_server
+from taiga_report import metrics as metrics_module
+from taiga_report.metrics import METRICS, Metrics
+from taiga_report.output_manager import OutputManager
+from taiga_report.printer_classes import MarkdownPrinter
+from taiga_report.runner import generate_report
+from taiga_report.taiga_api import TaigaAPI
+
+
+@pytest.fixture
+def metrics():
+    """Return the global registry, emptied before and after the test."""
+    METRICS.reset()
+    yield METRICS
+    METRICS.reset()
+
+
+def test_phase_accumulates_calls():
+    """Test that repeated phases add up their time and calls."""
+    metrics = Metrics()
+    with metrics.phase("render"):
+        pass
+    metrics.add_time("render", 2.0)
+    assert metrics.phases["render"]["calls"] == 2
+    assert metrics.phases["render"]["seconds"] >= 2.0
+
+
+def test_phase_is_timed_on_error():
+    """Test that a phase raising an exception is still recorded."""
+    metrics = Metrics()
+    with pytest.raises(KeyError):
+        with metrics.phase("login"):
+            raise KeyError("auth_token")
+    assert metrics.phases["login"]["calls"] == 1
+
+
+def test_snapshot_and_json():
+    """Test that counters and memory are exported."""
+    metrics = Metrics()
+    metrics.count("requests")
+    metrics.count("response_bytes", 512)
+    data = json.loads(metrics.to_json())
+    assert data["counters"] == {"requests": 1, "response_bytes": 512}
+    assert "peak_rss_bytes" in data["memory"]
+
+
+def test_merge_adds_phases_and_counters():
+    """Test that a worker's snapshot adds up with the local metrics."""
+    metrics = Metrics()
+    metrics.add_time("render_md", 1.0)
+    metrics.count("sections_rendered", 2)
+    worker = Metrics()
+    worker.add_time("render_md", 2.0)
+    worker.count("sections_rendered", 3)
+    worker.count("section_cache_hits")
+    metrics.merge(worker.snapshot())
+    assert metrics.phases["render_md"] == {"seconds": 3.0, "calls": 2}
+    assert metrics.counters == {"sections_rendered": 5,
+                                "section_cache_hits": 1}
+
+
+@pytest.mark.parametrize("platform, expected", [("darwin", 2048),
+                                                ("linux", 2048 * 1024)])
+def test_peak_rss_unit_follows_the_platform(monkeypatch, platform,
+                                            expected):
+    """Test that ru_maxrss is read as bytes on macOS, KB elsewhere."""
+    class Usage:
+        ru_maxrss = 2048
+
+    if metrics_module.resource is None:
+        pytest.skip("resource is not available")
+    monkeypatch.setattr(metrics_module.sys, "platform", platform)
+    monkeypatch.setattr(metrics_module.resource, "getrusage",
+                        lambda who: Usage())
+    assert metrics_module.peak_rss_bytes() == expected
+
+
+def test_prometheus_format():
+    """Test the text exposition format of phases and counters."""
+    metrics = Metrics()
+    metrics.add_time("classify", 1.5, calls=3)
+    metrics.count("requests", 4)
+    text = metrics.to_prometheus()
+    assert 'taiga_report_phase_seconds_total{phase="classify"} 1.5' in text
+    assert 'taiga_report_phase_calls_total{phase="classify"} 3' in text
+    assert "# TYPE taiga_report_requests_total counter" in text
+    assert "taiga_report_requests_total 4" in text
+    assert text.endswith("\n")
+
+
+def test_pipeline_records_metrics(metrics, tmp_path):
+    """Test that a whole run times every phase and counts its work."""
+    taiga = StubTaiga(list(generate_user_stories(150)))
+    with run_stub_server(taiga) as url:
+        yaml_dict = project_yaml(host=url)
+        yaml_dict["page_size"] = 100
+        api = TaigaAPI("bench", yaml_dict)
+        generate_report(api, "bench", yaml_dict,
+                        lambda report: MarkdownPrinter.print_markdown(
+                            report, output=OutputManager(tmp_path)))
+
+    for phase in ("login", "http_request", "body_decode",
+                  "classify", "render_md"):
+        assert phase in metrics.phases
+    assert metrics.counters["requests"] == taiga.requests
+    assert metrics.counters["response_bytes"] > 0
+    assert metrics.counters["report_stories"] == 150
+    assert metrics.counters["sections"] >= 1
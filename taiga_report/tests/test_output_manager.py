@@ -0,0 +1,118 @@
+"""Tests for the report output manager."""
+import datetime as dt
+import errno
+import os
+import types
+
+import pytest
+
+from taiga_report import output_manager as om
+from taiga_report import printer_classes as pc
+from taiga_report import report_classes as rc
+
+
+@pytest.fixture
+def output(tmp_path):
+    """Return an output manager on an empty directory."""
+    return om.OutputManager(tmp_path, label="01-2026")
+
+
+@pytest.fixture
+def report():
+    """Return a report with one story."""
+    report = rc.Report("sieel", {"sieel": {"report_sections": ["general"]}})
+    report._report = {"general": {"user_stories": [("us one", 1)]}}
+    return report
+
+
+def test_versions_past_nine(output, tmp_path):
+    """Test that versions keep counting after _9."""
+    for name in ["SIEEL_report_01-2026.md"] + [
+            "SIEEL_report_01-2026_{}.md".format(i) for i in range(1, 11)]:
+        (tmp_path / name).touch()
+    (tmp_path / "SIEEL_report_01-2026_3.docx").touch()
+    assert output.next_filename("SIEEL", ".md") == "SIEEL_report_01-2026_11.md"
+    assert output.next_filename("SIEEL", ".docx") == (
+        "SIEEL_report_01-2026_4.docx")
+
+
+def test_default_label_follows_the_month(tmp_path, monkeypatch):
+    """Test that a long lived manager names reports after today's month."""
+    output = om.OutputManager(tmp_path)
+    for today, label in ((dt.date(2026, 1, 31), "01-2026"),
+                         (dt.date(2026, 2, 1), "02-2026")):
+        monkeypatch.setattr(om, "dt", types.SimpleNamespace(
+            date=types.SimpleNamespace(today=lambda: today)))
+        assert output.next_filename("SIEEL", ".md") == (
+            "SIEEL_report_{}.md".format(label))
+
+
+def test_publish_takes_distinct_versions(output, tmp_path):
+    """Test that reports published one after another never share a name."""
+    first = output.publish(output.reserve(".md"), "SIEEL", ".md")
+    second = output.publish(output.reserve(".md"), "SIEEL", ".md")
+    assert first.endswith("SIEEL_report_01-2026.md")
+    assert second.endswith("SIEEL_report_01-2026_1.md")
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        "SIEEL_report_01-2026.md", "SIEEL_report_01-2026_1.md"]
+
+
+def test_failed_render_leaves_no_file(output, report, tmp_path,
+                                      monkeypatch):
+    """Test that a report failing to render leaves no versioned file."""
+    def fail(report, sink, cache=None):
+        raise RuntimeError("render failed")
+
+    monkeypatch.setattr(pc.MarkdownPrinter, "write_markdown", fail)
+    with pytest.raises(RuntimeError):
+        pc.MarkdownPrinter.print_markdown(report, output=output)
+    assert output.versions("sieel", ".md") == []
+    assert not [path for path in tmp_path.iterdir() if path.is_file()]
+
+
+def test_failed_publish_leaves_no_file(output, report, tmp_path,
+                                       monkeypatch):
+    """Test that the temporary file is removed if publishing fails."""
+    def fail(tmp_path, path):
+        raise OSError(errno.EIO, "publish failed")
+
+    monkeypatch.setattr(output, "_claim", fail)
+    with pytest.raises(OSError):
+        pc.MarkdownPrinter.print_markdown(report, output=output)
+    assert not [path for path in tmp_path.iterdir() if path.is_file()]
+
+
+def test_publish_without_hard_links(output, tmp_path, monkeypatch):
+    """Test that names are still claimed where links aren't supported."""
+    def link(source, target):
+        raise PermissionError(errno.EPERM, "no hard links")
+
+    monkeypatch.setattr(om.os, "link", link)
+    (tmp_path / "SIEEL_report_01-2026.md").touch()
+    tmp_file = output.reserve(".md")
+    with open(tmp_file, "w") as file:
+        file.write("report")
+    filename = output.publish(tmp_file, "SIEEL", ".md")
+    assert filename.endswith("SIEEL_report_01-2026_1.md")
+    assert open(filename).read() == "report"
+    assert not os.path.exists(tmp_file)
+
+
+def test_unchanged_report_is_not_written_again(output, report, tmp_path):
+    """Test that identical content reuses the latest version."""
+    first = pc.MarkdownPrinter.print_markdown(report, output=output)
+    again = pc.MarkdownPrinter.print_markdown(report, output=output)
+    assert again == first
+
+    report._report["general"]["user_stories"].append(("us two", 2))
+    changed = pc.MarkdownPrinter.print_markdown(report, output=output)
+    assert changed.endswith("SIEEL_report_01-2026_1.md")
+    assert "Us two" in open(changed).read()
+
+
+def test_force_writes_new_version(report, tmp_path):
+    """Test that force skips the content hash check."""
+    output = om.OutputManager(tmp_path, label="01-2026", force=True)
+    first = pc.DocxPrinter.print_docx_bulk(report, output=output)
+    second = pc.DocxPrinter.print_docx_bulk(report, output=output)
+    assert first != second
@@ -1,11 +1,13 @@
 """Contains tests for the printer classes."""
 import datetime as dt
+import io
 
 import pytest
 import docx
 from docx import Document
 
 from taiga_report import report_classes as rc
+from taiga_report import output_manager as om
 from taiga_report import printer_classes as pc
 
 
@@ -119,6 +121,80 @@ class TestMarkdownPrinterClass:
         assert pc.MarkdownPrinter.md_user_story(
             user_story) == md_user_story
 
+    EXPECTED_MD = ("# SIEEL\n\n## General\n\n* Us one\n\n"
+                   "### Epic\n\n* Us two\n\n")
+
+    def test_print_markdown_to_text_sink(self, report):
+        """Test that the report can be streamed into a text buffer."""
+        report._report = {"general": {"user_stories": [("us one", 1)],
+                                      "epic": [("us two", 2)]}}
+        sink = io.StringIO()
+        assert pc.MarkdownPrinter.print_markdown(report, sink=sink) is None
+        assert sink.getvalue() == self.EXPECTED_MD
+
+    def test_print_markdown_with_tasks(self, report):
+        """Test that tasks are listed under their user story."""
+        report._report = {"general": {"user_stories": [("us one", 1)],
+                                      "epic": [("us two", 2)]}}
+        report._tasks = {2: ["Deploy (Closed, Ana)"]}
+        sink = io.StringIO()
+        pc.MarkdownPrinter.print_markdown(report, sink=sink)
+        assert sink.getvalue() == self.EXPECTED_MD.replace(
+            "* Us two\n", "* Us two\n    * Deploy (Closed, Ana)\n")
+
+    def test_tasks_follow_the_story_id(self, report):
+        """Test that stories sharing a subject keep their own tasks."""
+        report._report = {"general": {"user_stories": [("us one", 1)],
+                                      "epic": [("us one", 2)]}}
+        report._tasks = {2: ["Deploy"]}
+        sink = io.StringIO()
+        pc.MarkdownPrinter.print_markdown(report, sink=sink)
+        assert sink.getvalue() == ("# SIEEL\n\n## General\n\n* Us one\n\n"
+                                   "### Epic\n\n* Us one\n    * Deploy\n\n")
+
+    def test_print_markdown_to_binary_sink(self, report):
+        """Test that binary sinks receive utf-8 bytes."""
+        report._report = {"general": {"user_stories": [("us one", 1)],
+                                      "epic": [("us two", 2)]}}
+        sink = io.BytesIO()
+        pc.MarkdownPrinter.print_markdown(report, sink=sink)
+        assert sink.getvalue() == self.EXPECTED_MD.encode("utf-8")
+
+    def test_print_markdown_writes_file_atomically(self, report, tmp_path,
+                                                   monkeypatch):
+        """Test that the file is complete and no temp file is left."""
+        monkeypatch.chdir(tmp_path)
+        report._report = {"general": {"user_stories": [("us one", 1)],
+                                      "epic": [("us two", 2)]}}
+        filename = pc.MarkdownPrinter.print_markdown(report)
+        assert (tmp_path / filename).read_text("utf-8") == self.EXPECTED_MD
+        assert sorted(path.name for path in tmp_path.iterdir()) == [
+            ".report_hashes.json", ".section_cache", filename]
+
+    def test_print_markdown_follows_the_umask(self, report, tmp_path,
+                                              monkeypatch):
+        """Test that the report gets the mode open() would give it."""
+        monkeypatch.chdir(tmp_path)
+        monkeypatch.setattr(om, "FILE_MODE", 0o640)
+        filename = pc.MarkdownPrinter.print_markdown(report)
+        assert (tmp_path / filename).stat().st_mode & 0o777 == 0o640
+
+    def test_buffered_sink_batches_writes(self):
+        """Test that small writes reach the sink in large chunks."""
+        class CountingSink(io.StringIO):
+            writes = 0
+
+            def write(self, text):
+                CountingSink.writes += 1
+                return super().write(text)
+
+        sink = CountingSink()
+        with pc.BufferedSink(sink, buffer_size=100) as file:
+            for _ in range(100):
+                file.write("0123456789")
+        assert sink.getvalue() == "0123456789" * 100
+        assert CountingSink.writes == 10
+
 
 class TestDocxPrinterClass:
     """Tests for the docx printer class.
@@ -161,3 +237,28 @@ class TestDocxPrinterClass:
         assert isinstance(user_story, docx.text.paragraph.Paragraph)
         assert user_story.text == generic_us
         assert user_story.style.name == "List Bullet 2"
+
+    def test_bulk_body_matches_print_docx(self, report):
+        """Test that the bulk XML path renders the same paragraphs."""
+        report._report = {
+            "expedientes": {"user_stories": [("us <one> & co", 1)],
+                            "epic": [("us two", 2), ("us three", 3)]},
+            "general": {"user_stories": [("us four", 4)]},
+        }
+        report._tasks = {3: ["task a", "task b"], 4: ["task c"]}
+        expected = Document()
+        pc.DocxPrinter.docx_title(expected, report.project)
+        for section in report._report_sections:
+            if section in report._report:
+                pc.DocxPrinter._print_section_docx(section, expected, report)
+
+        bulk = Document()
+        pc.DocxPrinter.insert_body_xml(
+            bulk, pc.DocxPrinter.docx_body_xml(report, bulk))
+
+        def paragraphs(document):
+            return [(p.text, p.style.name) for p in document.paragraphs]
+
+        assert paragraphs(bulk) == paragraphs(expected)
+        assert ("task a", "List Bullet 3") in paragraphs(bulk)
+        assert bulk.element.body[-1].tag.endswith("sectPr")
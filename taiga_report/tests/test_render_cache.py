@@ -0,0 +1,143 @@
+"""Tests of the section render cache."""
+import io
+import json
+
+import pytest
+from docx import Document
+
+from taiga_report import printer_classes as pc
+from taiga_report import render_cache
+from taiga_report.benchmarks.dataset import project_yaml
+from taiga_report.metrics import METRICS
+from taiga_report.output_manager import OutputManager
+from taiga_report.render_cache import SectionCache
+from taiga_report.report_classes import Report
+
+
+@pytest.fixture
+def report():
+    """Return a report with three sections, one of them with tasks."""
+    report = Report("bench", project_yaml())
+    report._report = {
+        "general": {"user_stories": [("us one", 1)],
+                    "epic a": [("us two", 2)]},
+        "expedientes": {"user_stories": [], "epic b": [("us three", 3)]},
+        "remitos": {"user_stories": [("us four", 4)]},
+    }
+    report._tasks = {3: ["task a"]}
+    return report
+
+
+@pytest.fixture
+def metrics():
+    """Return the global registry, emptied before and after the test."""
+    METRICS.reset()
+    yield METRICS
+    METRICS.reset()
+
+
+def test_section_key_only_covers_its_section(report):
+    """Test that changes elsewhere keep the hash of a section."""
+    key = SectionCache.section_key("general", report)
+    report._report["remitos"]["user_stories"].append(("us five", 5))
+    report._tasks[4] = ["task b"]
+    assert SectionCache.section_key("general", report) == key
+    report._report["general"]["epic a"].append(("us six", 6))
+    assert SectionCache.section_key("general", report) != key
+    assert SectionCache.section_key("general", report, "x") != \
+        SectionCache.section_key("general", report)
+
+
+def test_section_key_follows_the_story_id(report):
+    """Test that the tasks of a story don't leak into a namesake."""
+    report._report["general"]["epic a"].append(("us three", 7))
+    key = SectionCache.section_key("general", report)
+    report._tasks[3].append("task c")
+    assert SectionCache.section_key("general", report) == key
+    report._tasks[7] = ["task d"]
+    assert SectionCache.section_key("general", report) != key
+
+
+def test_only_changed_sections_are_rendered(report, metrics, tmp_path):
+    """Test that a regenerated markdown report reuses unchanged sections."""
+    output = OutputManager(tmp_path, label="01-2024")
+    pc.MarkdownPrinter.print_markdown(report, output=output)
+    assert metrics.counters["sections_rendered"] == 3
+
+    metrics.reset()
+    report._tasks[4] = ["task b"]
+    filename = pc.MarkdownPrinter.print_markdown(report, output=output)
+    assert metrics.counters["sections_rendered"] == 1
+    assert metrics.counters["section_cache_hits"] == 2
+
+    expected = io.StringIO()
+    pc.MarkdownPrinter.write_markdown(report, expected)
+    with open(filename, "r") as file:
+        assert file.read() == expected.getvalue()
+
+
+def test_cached_docx_body_matches(report, metrics, tmp_path):
+    """Test that cached sections give the same docx XML."""
+    cache = SectionCache(tmp_path / "cache.json")
+    expected = pc.DocxPrinter.docx_body_xml(report, Document())
+    pc.DocxPrinter.docx_body_xml(report, Document(), cache)
+    cache.save()
+
+    cache = SectionCache(tmp_path / "cache.json")
+    assert pc.DocxPrinter.docx_body_xml(report, Document(), cache) == \
+        expected
+    assert metrics.counters["section_cache_hits"] == 3
+
+
+def test_save_keeps_only_the_latest_sections(report, tmp_path):
+    """Test that sections of older reports are dropped."""
+    path = tmp_path / "cache.json"
+    cache = SectionCache(path)
+    for section in report._report:
+        cache.render(section, report, lambda: "old")
+    cache.save()
+
+    report._report["general"]["epic a"].append(("us six", 6))
+    cache = SectionCache(path)
+    for section in report._report:
+        cache.render(section, report, lambda: "new")
+    cache.save()
+    with open(path, "r") as file:
+        assert sorted(json.load(file).values()) == ["new", "old", "old"]
+
+
+def test_new_renderer_renders_again(report, metrics, tmp_path,
+                                    monkeypatch):
+    """Test that a RENDER_VERSION bump writes the report again."""
+    output = OutputManager(tmp_path, label="01-2024")
+    first = pc.MarkdownPrinter.print_markdown(report, output=output)
+    metrics.reset()
+    monkeypatch.setattr(render_cache, "RENDER_VERSION",
+                        render_cache.RENDER_VERSION + 1)
+    assert pc.MarkdownPrinter.print_markdown(report, output=output) != first
+    assert metrics.counters["sections_rendered"] == 3
+
+
+def test_docx_printers_share_the_cache(report, tmp_path):
+    """Test that print_docx() reuses the bulk printer's sections."""
+    output = OutputManager(tmp_path, label="01-2024", force=True)
+    pc.DocxPrinter.print_docx_bulk(report, output=output)
+    path = output.section_cache(report.project, ".docx").path
+    saved = path.read_text()
+    pc.DocxPrinter.print_docx(report, output=output)
+    assert path.read_text() == saved
+    assert len(json.loads(saved)) == 3
+
+
+def test_print_docx_uses_the_cache(report, metrics, tmp_path):
+    """Test that print_docx() reuses sections and prints the same text."""
+    output = OutputManager(tmp_path, label="01-2024", force=True)
+    first = pc.DocxPrinter.print_docx(report, output=output)
+    assert metrics.counters["sections_rendered"] == 3
+
+    metrics.reset()
+    second = pc.DocxPrinter.print_docx(report, output=output)
+    assert metrics.counters["section_cache_hits"] == 3
+    assert ([(p.text, p.style.name) for p in Document(first).paragraphs]
+            == [(p.text, p.style.name)
+                for p in Document(second).paragraphs])
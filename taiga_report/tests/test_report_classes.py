@@ -2,6 +2,7 @@
 import pytest
 
 from taiga_report import report_classes as rc
+from taiga_report.epic_catalog import EpicCatalog
 
 
 @pytest.fixture
@@ -37,7 +38,8 @@ def report():
 @pytest.fixture
 def us():
     """Create the us fixture."""
-    us = {"subject": "Subject",
+    us = {"id": 5,
+          "subject": "Subject",
           "epics": [{"subject": "Epic"}],
           "tags": [["expedientes"]],
           "tasks": [],
@@ -55,10 +57,130 @@ class TestUserStoryClass():
         assert us.tags == ["expedientes"]
 
     def test_userstory_section(self, us):
-        """Test that the US gets the specified sections only."""
+        """Test that the section is left to the SectionClassifier."""
         us.tags = ["expedientes", "abm"]
-        assert "abm" in us.tags
-        assert us.section == "expedientes"
+        assert us.section is None
+        classifier = rc.SectionClassifier.from_config(
+            {"report_sections": ["general", "expedientes"]})
+        assert classifier.classify(us) == "expedientes"
+
+    def test_epics_from_catalog(self):
+        """Test that subjects come from the catalog by epic id."""
+        catalog = EpicCatalog([{"id": 1, "ref": 1, "subject": "Renamed"}])
+        us = rc.UserStory({"subject": "Subject", "tags": [], "tasks": [],
+                           "epics": [{"id": 1, "subject": "Old"},
+                                     {"id": 2, "subject": "New"}]},
+                          catalog)
+        assert us.epic_ids == [1, 2]
+        assert us.epics == ["Renamed", "New"]
+        assert us.epic == "Renamed"
+
+    def test_epic_setter(self, us):
+        """Test that setting the epic replaces every epic."""
+        us.epic = ""
+        assert us.epics == [] and us.epic == []
+        us.epic = "Other"
+        assert us.epics == ["Other"]
+
+    def test_userstory_has_no_dict(self, us):
+        """Test that UserStory is a slotted record."""
+        assert not hasattr(us, "__dict__")
+        with pytest.raises(AttributeError):
+            us.unknown = "value"
+
+
+def make_us(subject, tags=(), epic=None):
+    """Return a UserStory() with the given subject, tags and epic."""
+    return rc.UserStory({"subject": subject,
+                         "epics": [{"subject": epic}] if epic else [],
+                         "tags": [[tag, None] for tag in tags],
+                         "tasks": []})
+
+
+class TestSectionClassifier:
+    """SectionClassifier rule compilation and lookup tests."""
+
+    @pytest.fixture
+    def classifier(self):
+        """Return a classifier with tag, epic and subject rules."""
+        return rc.SectionClassifier([
+            {"section": "remitos", "subject": "^REM-"},
+            {"section": "expedientes", "tags": ["expedientes", "Exp"],
+             "epics": ["Digitalizar"]},
+            {"section": "general", "tags": ["general", "abm"]},
+        ], fallback="administracion")
+
+    def test_all_tags_are_checked(self, classifier):
+        """Test that a matching tag after other tags is found."""
+        us = make_us("Subject", tags=["otro", "exp"])
+        assert classifier.classify(us) == "expedientes"
+
+    def test_highest_priority_rule_wins(self, classifier):
+        """Test that rule order decides between several matches."""
+        us = make_us("REM-1 subject", tags=["abm", "expedientes"])
+        assert classifier.classify(us) == "remitos"
+        us = make_us("Subject", tags=["abm"], epic="digitalizar")
+        assert classifier.classify(us) == "expedientes"
+
+    def test_priority_key_overrides_order(self):
+        """Test that an explicit priority reorders the rules."""
+        classifier = rc.SectionClassifier([
+            {"section": "general", "tags": ["general"]},
+            {"section": "remitos", "tags": ["remitos"], "priority": -1},
+        ])
+        us = make_us("Subject", tags=["general", "remitos"])
+        assert classifier.classify(us) == "remitos"
+
+    def test_fallback_section(self, classifier):
+        """Test that stories matching no rule get the fallback."""
+        assert classifier.classify(make_us("Subject")) == "administracion"
+
+    def test_default_rules_from_report_sections(self, report):
+        """Test that each report section matches its own tag by default."""
+        us = make_us("Subject", tags=["abm", "remitos"])
+        assert report.classifier.classify(us) == "remitos"
+        assert report.classifier.classify(make_us("Subject")) is None
+
+
+class TestTasks:
+    """Task details and their join to the user stories."""
+
+    TASKS = [
+        {"id": 1, "user_story": 10, "subject": "Deploy",
+         "status_extra_info": {"name": "Closed"},
+         "assigned_to_extra_info": {"full_name_display": "Ana"},
+         "is_closed": True, "finished_date": "2020-01-31T10:00:00Z"},
+        {"id": 2, "user_story": 11, "subject": "Review",
+         "status_extra_info": None, "assigned_to_extra_info": None},
+        {"id": 3, "user_story": 10, "subject": "Test"},
+    ]
+
+    def test_describe(self):
+        """Test that only the known details are shown."""
+        first, second, _ = (rc.Task(task) for task in self.TASKS)
+        assert first.describe() == "Deploy (Closed, Ana, 2020-01-31)"
+        assert second.describe() == "Review"
+
+    def test_index_tasks_groups_by_story(self):
+        """Test that tasks are grouped by user story in order."""
+        index = rc.index_tasks(self.TASKS)
+        assert [task.id for task in index[10]] == [1, 3]
+        assert [task.id for task in index[11]] == [2]
+
+    def test_attach_and_add_tasks(self, report):
+        """Test that the joined tasks reach the report."""
+        index = rc.index_tasks(self.TASKS)
+        us = rc.UserStory({"id": 10, "subject": "Subject", "epics": [],
+                           "tags": [["general", None]], "tasks": []})
+        lonely = rc.UserStory({"id": 12, "subject": "Lonely", "epics": [],
+                               "tags": [], "tasks": [{"id": 9}]})
+        for story in (us, lonely):
+            report.classify_user_story(story)
+            story.attach_tasks(index)
+            report.add_tasks(story)
+        assert lonely.subtasks == []
+        assert report._tasks == {
+            10: ["Deploy (Closed, Ana, 2020-01-31)", "Test"]}
 
 
 class TestReportClass:
@@ -72,29 +194,77 @@ class TestReportClass:
         """Test US classified correctly if new section and has no epic."""
         us.epic = ""
         report.classify_user_story(us)
-        assert "Subject" in report._report["expedientes"]["user_stories"]
+        assert ("Subject", 5) in report._report["expedientes"]["user_stories"]
 
     def test_classify_section_in_report_no_epic(self, report, us):
         """Test US classified correctly if existing section and has no epic."""
         us.epic = ""
         report._report["expedientes"] = {"user_stories": []}
         report.classify_user_story(us)
-        assert "Subject" in report._report["expedientes"]["user_stories"]
+        assert ("Subject", 5) in report._report["expedientes"]["user_stories"]
 
     def test_classify_section_not_in_report_with_epic(self, report, us):
         """Test US classified correctly if new section and has epic."""
         report.classify_user_story(us)
-        assert "Subject" in report._report["expedientes"]["Epic"]
+        assert ("Subject", 5) in report._report["expedientes"]["Epic"]
 
     def test_classify_section_in_report_with_epic(self, report, us):
         """Test US classified correctly if existing section and has epic."""
         report._report["expedientes"] = {"user_stories": []}
         report.classify_user_story(us)
-        assert "Subject" in report._report["expedientes"]["Epic"]
+        assert ("Subject", 5) in report._report["expedientes"]["Epic"]
 
     def test_classify_epic_in_report(self, report, us):
         """Test US classified correctly if epic already in report."""
         report._report["expedientes"] = {"user_stories": [],
                                          "Epic": []}
         report.classify_user_story(us)
-        assert "Subject" in report._report["expedientes"]["Epic"]
+        assert ("Subject", 5) in report._report["expedientes"]["Epic"]
+
+    def test_classify_every_epic(self, report):
+        """Test that a US with two epics is listed under both."""
+        us = rc.UserStory({"id": 5, "subject": "Subject", "tasks": [],
+                           "epics": [{"id": 1, "subject": "One"},
+                                     {"id": 2, "subject": "Two"}],
+                           "tags": [["general", None]]})
+        report.classify_user_story(us)
+        assert report._report["general"] == {
+            "user_stories": [], "One": [("Subject", 5)],
+            "Two": [("Subject", 5)]}
+
+    def test_sort_epics_by_catalog(self, report):
+        """Test that epics follow the catalog, unknown ones last."""
+        catalog = EpicCatalog([{"id": 1, "ref": 1, "subject": "First",
+                                "epics_order": 20},
+                               {"id": 2, "ref": 2, "subject": "Second",
+                                "epics_order": 10}])
+        report._report = {"general": {"user_stories": [("US-0", 0)],
+                                      "Unknown": [("US-1", 1)],
+                                      "First": [("US-2", 2)],
+                                      "Second": [("US-3", 3)]}}
+        report.sort_epics(catalog)
+        assert list(report._report["general"]) == [
+            "user_stories", "Second", "First", "Unknown"]
+
+    def test_fill_from_store(self, report):
+        """Test that rows from the store land in the report json."""
+        class FakeStore:
+            def report_rows(self, start=None, end=None):
+                return [("expedientes", None, "US-1", 1),
+                        ("expedientes", "Epic", "US-2", 2),
+                        ("expedientes", "Epic", "US-3", 3)]
+
+        report.fill_from_store(FakeStore())
+        assert report._report == {"expedientes": {
+            "user_stories": [("US-1", 1)],
+            "Epic": [("US-2", 2), ("US-3", 3)]}}
+
+    def test_snapshot_round_trip(self, report, us):
+        """Test that a report rebuilt from its snapshot prints the same."""
+        report.classify_user_story(us)
+        report._tasks = {5: ["Deploy"]}
+        copy = rc.Report.from_snapshot(report.snapshot())
+        assert copy.project == report.project
+        assert copy._report_sections == report._report_sections
+        assert copy._report == report._report
+        assert copy._tasks == report._tasks
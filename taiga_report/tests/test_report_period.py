@@ -0,0 +1,47 @@
+"""Tests of the report periods and their Taiga filters."""
+import datetime as dt
+
+import pytest
+
+from taiga_report.report_period import ReportPeriod
+
+
+def test_month_period():
+    """Test the bounds and label of a month, in both formats."""
+    period = ReportPeriod.parse_month("12-2023")
+    assert period.bounds() == ("2023-12-01", "2024-01-01")
+    assert period.label == "12-2023"
+    assert ReportPeriod.parse_month("2023-12").bounds() == period.bounds()
+    assert period.filters() == {"finish_date__gte": "2023-12-01",
+                                "finish_date__lt": "2024-01-01"}
+
+
+def test_invalid_periods():
+    """Test that empty, reversed or malformed periods are rejected."""
+    with pytest.raises(ValueError):
+        ReportPeriod()
+    with pytest.raises(ValueError):
+        ReportPeriod(dt.date(2024, 2, 1), dt.date(2024, 1, 1))
+    with pytest.raises(ValueError):
+        ReportPeriod.parse_month("march")
+
+
+def test_between_is_inclusive():
+    """Test that the last day of a range is part of it."""
+    period = ReportPeriod.between("2024-03-05", "2024-03-10")
+    assert period.bounds() == ("2024-03-05", "2024-03-11")
+    assert period.label == "2024-03-05_2024-03-10"
+    assert period.contains({"finish_date": "2024-03-10T23:59:00.000Z"})
+    assert not period.contains({"finish_date": "2024-03-11T00:00:00.000Z"})
+    assert not period.contains({"finish_date": None})
+
+
+def test_milestone_period():
+    """Test the filter, label and matching of a sprint."""
+    period = ReportPeriod.parse_month("03-2024", milestone=4)
+    assert period.label == "sprint-4_03-2024"
+    assert period.filters()["milestone"] == 4
+    us = {"finish_date": "2024-03-02T10:00:00.000Z", "milestone": 4}
+    assert period.contains(us)
+    assert not period.contains(dict(us, milestone=5))
+    assert ReportPeriod(milestone=4).label == "sprint-4"
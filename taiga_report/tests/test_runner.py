@@ -0,0 +1,187 @@
+"""Tests for the report runner."""
+import os
+import time
+
+import pytest
+import requests
+
+from taiga_report import runner
+from taiga_report.metrics import METRICS
+from taiga_report.output_manager import OutputManager
+from taiga_report.report_classes import Report, UserStory
+from taiga_report.report_period import ReportPeriod
+
+
+@pytest.fixture
+def yaml_dict():
+    """Return a yaml dict with two projects."""
+    return {
+        'login_data': {'type': 'normal', 'username': 'u', 'password': 'p'},
+        'host': 'https://taiga.example/api/v1/',
+        'headers': {'content-type': 'application/json'},
+        'sieel': {'slug': 'ignamt-sieel', 'id': 6,
+                  'report_sections': ['general', 'expedientes']},
+        'broken': {'slug': 'ignamt-broken', 'id': 7,
+                   'report_sections': ['general']},
+    }
+
+
+class FakeAPI:
+    """TaigaAPI stand-in that serves one story or fails for 'broken'."""
+
+    logins = 0
+
+    def __init__(self, project, yaml_dict, session=None):
+        self.project = project
+        self.session = session
+
+    def _auth(self):
+        FakeAPI.logins += 1
+
+    def for_project(self, project, yaml_dict):
+        return FakeAPI(project, yaml_dict, self.session)
+
+    def iter_user_stories(self, period=None):
+        if self.project == "broken":
+            raise ValueError("No user stories were found.")
+        yield {"subject": "Subject", "epics": [], "tags": [["general"]],
+               "tasks": []}
+
+
+def test_find_projects(yaml_dict):
+    """Test that only blocks with a slug are considered projects."""
+    assert runner.find_projects(yaml_dict) == ["sieel", "broken"]
+
+
+def test_run_batch_reports_failures(yaml_dict, monkeypatch):
+    """Test that a failing project doesn't stop the rest."""
+    monkeypatch.setattr(runner, "TaigaAPI", FakeAPI)
+    FakeAPI.logins = 0
+    printed = []
+
+    def printer(report):
+        printed.append(report)
+        return report.project + ".docx"
+
+    results, seconds = runner.run_batch(yaml_dict, workers=2,
+                                        printer=printer)
+    assert [result["project"] for result in results] == ["sieel", "broken"]
+    assert results[0]["ok"]
+    assert results[0]["filename"] == "SIEEL.docx"
+    assert not results[1]["ok"]
+    assert "No user stories" in results[1]["error"]
+    assert printed[0]._report == {
+        "general": {"user_stories": [("Subject", None)]}}
+    assert FakeAPI.logins == 1
+
+
+def test_run_batch_total_is_wall_clock(yaml_dict, monkeypatch, capsys):
+    """Test that the total counts projects running at once only once."""
+    monkeypatch.setattr(runner, "TaigaAPI", FakeAPI)
+    yaml_dict["other"] = dict(yaml_dict["sieel"], slug="ignamt-other")
+
+    def printer(report):
+        time.sleep(0.2)
+        return report.project
+
+    results, seconds = runner.run_batch(yaml_dict, ["sieel", "other"],
+                                        workers=2, printer=printer)
+    assert all(result["ok"] for result in results)
+    assert seconds < sum(result["seconds"] for result in results)
+    runner.print_summary(results, seconds)
+    assert "{:.2f}s total".format(seconds) in capsys.readouterr().out
+
+
+@pytest.fixture
+def report(yaml_dict):
+    """Return a classified report of the 'sieel' project."""
+    report = Report("sieel", yaml_dict)
+    report.classify_user_story(UserStory(
+        {"subject": "Subject", "epics": [], "tags": [["general"]],
+         "tasks": []}))
+    return report
+
+
+def test_task_filters(monkeypatch):
+    """Test which tasks listings a period needs."""
+    stories = [{"id": 1, "tasks": [{"id": 10}]}, {"id": 2, "tasks": []},
+               {"id": 3, "tasks": [{"id": 30}]}]
+    month = ReportPeriod.parse_month("03-2024")
+    assert runner.task_filters(stories, month) == {"user_stories": [1, 3]}
+    assert runner.task_filters(stories, ReportPeriod(milestone=7)) == {
+        "milestone": 7}
+    # Too many stories to list them one by one, the project is swept.
+    monkeypatch.setattr(runner, "TASK_LOOKUPS_MAX", 1)
+    assert runner.task_filters(stories, month) == {}
+
+
+def test_render_formats_in_processes(report, tmp_path):
+    """Test that every format is written from one classified report."""
+    output = OutputManager(tmp_path)
+    METRICS.reset()
+    filenames = runner.render_formats(report, ["md", "docx"], output)
+    # The workers' phases and counters are merged back.
+    assert {"render_md", "render_docx"} <= set(METRICS.phases)
+    assert METRICS.counters["sections_rendered"] == 2
+    assert [os.path.splitext(name)[1] for name in filenames] == [
+        ".md", ".docx"]
+    assert all(os.path.getsize(name) for name in filenames)
+    # Both processes recorded their hash in the shared manifest.
+    assert output.unchanged("SIEEL", ".md", output.content_hash(report))
+    assert output.unchanged("SIEEL", ".docx", output.content_hash(report))
+
+
+def test_render_formats_spawns_workers(report, tmp_path, monkeypatch):
+    """Test that workers are spawned, never forked from a batch thread."""
+    methods = []
+    executor = runner.ProcessPoolExecutor
+
+    def spawn_only(*args, **kwargs):
+        methods.append(kwargs["mp_context"].get_start_method())
+        return executor(*args, **kwargs)
+
+    monkeypatch.setattr(runner, "ProcessPoolExecutor", spawn_only)
+    runner.render_formats(report, ["md", "docx"], OutputManager(tmp_path))
+    assert methods == ["spawn"]
+
+
+def test_render_formats_unknown_format(report):
+    """Test that unknown formats fail before anything is rendered."""
+    with pytest.raises(KeyError):
+        runner.render_formats(report, ["md", "pdf"])
+
+
+def test_run_batch_login_failure_fails_every_project(yaml_dict,
+                                                     monkeypatch):
+    """Test that a failed login is reported for each project."""
+    class FailingAPI(FakeAPI):
+        def _auth(self):
+            raise requests.exceptions.HTTPError("401 Unauthorized")
+
+    monkeypatch.setattr(runner, "TaigaAPI", FailingAPI)
+    results, _ = runner.run_batch(yaml_dict, workers=2)
+    assert [result["project"] for result in results] == ["sieel", "broken"]
+    assert not any(result["ok"] for result in results)
+    assert all(result["error"] == "HTTPError: 401 Unauthorized"
+               for result in results)
+
+
+def test_generate_report_closes_the_store(yaml_dict, monkeypatch):
+    """Test that the story store is closed even if the sync fails."""
+    class FakeStore:
+        fills_reports = True
+        closed = False
+
+        def close(self):
+            self.closed = True
+
+    def fail(api, store):
+        raise requests.exceptions.ConnectionError("down")
+
+    store = FakeStore()
+    monkeypatch.setattr(runner, "make_store", lambda *args: store)
+    monkeypatch.setattr(runner, "sync_user_stories", fail)
+    with pytest.raises(requests.exceptions.ConnectionError):
+        runner.generate_report(FakeAPI("sieel", yaml_dict), "sieel",
+                               yaml_dict, incremental=True)
+    assert store.closed
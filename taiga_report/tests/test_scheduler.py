@@ -0,0 +1,176 @@
+"""Tests of the request scheduler, its token bucket and circuit breaker."""
+import email.utils
+import time
+
+import pytest
+
+from taiga_report.benchmarks.dataset import generate_user_stories, project_yaml
+from taiga_report.benchmarks.stub_server import StubTaiga, run_stub_server
+from taiga_report.scheduler import (CircuitOpenError, RequestScheduler,
+                                    TokenBucket)
+from taiga_report.taiga_api import TaigaAPI
+
+URL = "https://taiga.example/api/v1/userstories"
+
+
+class FakeClock:
+    """Clock whose sleep() only moves the time forward."""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class FakeResponse:
+    """Response with a status code and headers."""
+
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def replies(*responses):
+    """Return a send() callable answering the responses in order."""
+    responses = list(responses)
+    return lambda: responses.pop(0)
+
+
+@pytest.fixture
+def clock():
+    """Return a fake clock starting at 0."""
+    return FakeClock()
+
+
+def make_scheduler(clock, **settings):
+    """Return a scheduler on the fake clock with 1s of base backoff."""
+    return RequestScheduler(settings, retries=3, backoff_factor=1,
+                            clock=clock, sleep=clock.sleep)
+
+
+def test_bucket_paces_after_the_burst(clock):
+    """Test that tokens beyond the burst come at the configured rate."""
+    bucket = TokenBucket(rate=2, burst=2, clock=clock, sleep=clock.sleep)
+    waits = [bucket.acquire() for _ in range(4)]
+    assert waits[:2] == [0, 0]
+    assert waits[2:] == [pytest.approx(0.5), pytest.approx(0.5)]
+
+
+def test_bucket_pause_holds_every_request(clock):
+    """Test that a pause delays even an unlimited bucket."""
+    bucket = TokenBucket(rate=0, burst=1, clock=clock, sleep=clock.sleep)
+    bucket.pause(3)
+    assert bucket.acquire() == pytest.approx(3)
+    assert bucket.acquire() == 0
+
+
+def test_throttle_honors_retry_after(clock):
+    """Test that a 429 waits its Retry-After and is sent again."""
+    scheduler = make_scheduler(clock)
+    throttled = FakeResponse(429, {"Retry-After": "7"})
+    response = scheduler.send("GET", URL, replies(throttled,
+                                                  FakeResponse(200)))
+    assert response.status_code == 200
+    assert throttled.closed
+    assert clock.now == pytest.approx(7)
+
+
+def test_retry_after_http_date():
+    """Test the HTTP date form of Retry-After."""
+    date = email.utils.formatdate(time.time() + 30, usegmt=True)
+    delay = RequestScheduler.retry_after(FakeResponse(
+        429, {"Retry-After": date}))
+    assert 28 <= delay <= 30
+    assert RequestScheduler.retry_after(FakeResponse(429)) is None
+
+
+def test_too_long_retry_after_is_returned(clock):
+    """Test that a wait over max_wait gives the 429 to the caller."""
+    scheduler = make_scheduler(clock, max_wait=10)
+    response = scheduler.send("GET", URL, replies(
+        FakeResponse(429, {"Retry-After": "3600"})))
+    assert response.status_code == 429
+    assert clock.sleeps == []
+
+
+def test_server_errors_back_off(clock):
+    """Test that idempotent requests are retried with bounded backoff."""
+    scheduler = make_scheduler(clock)
+    response = scheduler.send("GET", URL, replies(*[FakeResponse(502)] * 4))
+    assert response.status_code == 502
+    assert len(clock.sleeps) == 3
+    assert all(0 <= delay <= 2 ** attempt
+               for attempt, delay in enumerate(clock.sleeps))
+    response = scheduler.send("POST", URL, replies(FakeResponse(500),
+                                                   FakeResponse(200)))
+    assert response.status_code == 500
+
+
+def test_circuit_opens_and_recovers(clock):
+    """Test that a failing host is skipped until the reset timeout."""
+    scheduler = make_scheduler(clock, failure_threshold=2, reset_timeout=30)
+    for _ in range(2):
+        scheduler.send("POST", URL, replies(FakeResponse(500)))
+    with pytest.raises(CircuitOpenError):
+        scheduler.send("GET", URL, replies(FakeResponse(200)))
+    # Other hosts are not affected.
+    other = "https://other.example/api/v1/"
+    assert scheduler.send("GET", other, replies(
+        FakeResponse(200))).status_code == 200
+    clock.now += 30
+    assert scheduler.send("GET", URL, replies(
+        FakeResponse(200))).status_code == 200
+
+
+def test_throttles_dont_open_the_circuit(clock):
+    """Test that a throttling server is not counted as failing."""
+    scheduler = make_scheduler(clock, failure_threshold=2)
+    for _ in range(3):
+        scheduler.send("GET", URL, replies(
+            FakeResponse(503, {"Retry-After": "1"}), FakeResponse(200)))
+    scheduler.send("GET", URL, replies(*[FakeResponse(429)] * 4))
+    assert scheduler.send("GET", URL, replies(
+        FakeResponse(200))).status_code == 200
+
+
+def test_bare_503_is_a_failure(clock):
+    """Test that a 503 without Retry-After counts for the circuit."""
+    scheduler = make_scheduler(clock, failure_threshold=2)
+    response = scheduler.send("GET", URL, replies(*[FakeResponse(503)] * 4))
+    assert response.status_code == 503
+    with pytest.raises(CircuitOpenError):
+        scheduler.send("GET", URL, replies(FakeResponse(200)))
+
+
+def test_retries_finish_with_the_circuit_open(clock):
+    """Test that a request in flight is retried even if the circuit opens."""
+    scheduler = make_scheduler(clock, failure_threshold=2)
+    response = scheduler.send("GET", URL, replies(
+        FakeResponse(502), FakeResponse(502), FakeResponse(200)))
+    assert response.status_code == 200
+    # The failures opened the circuit, the success closed it again.
+    assert scheduler.send("GET", URL, replies(
+        FakeResponse(200))).status_code == 200
+
+
+def test_rate_limit_keeps_the_server_from_throttling():
+    """Test that pacing below the server limit never gets a 429."""
+    taiga = StubTaiga(list(generate_user_stories(250)), rate_limit=5)
+    with run_stub_server(taiga) as url:
+        yaml_dict = project_yaml(host=url)
+        yaml_dict["page_size"] = 50
+        yaml_dict["scheduler"] = {"requests_per_second": 4, "burst": 1}
+        api = TaigaAPI("bench", yaml_dict)
+        assert len(list(api.iter_user_stories())) == 250
+    # Login and five pages, none of them sent twice.
+    assert taiga.requests == 6
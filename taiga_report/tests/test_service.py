@@ -0,0 +1,119 @@
+"""Tests of the long running report service against the Taiga stub."""
+import json
+import os
+import threading
+import time
+
+import pytest
+import requests
+
+from taiga_report import service as service_module
+from taiga_report.benchmarks.dataset import generate_user_stories, project_yaml
+from taiga_report.benchmarks.stub_server import StubTaiga, run_stub_server
+from taiga_report.output_manager import OutputManager
+from taiga_report.service import ReportService, service_settings
+
+
+@pytest.fixture
+def taiga():
+    """Return a stub with 120 done stories."""
+    return StubTaiga(list(generate_user_stories(120)))
+
+
+@pytest.fixture
+def service(taiga, tmp_path):
+    """Serve the stub and return a service of its only project."""
+    with run_stub_server(taiga) as url:
+        yaml_dict = project_yaml(host=url)
+        yaml_dict["cache_dir"] = str(tmp_path / "cache")
+        yield ReportService(yaml_dict,
+                            output=OutputManager(tmp_path / "reports"))
+
+
+def test_service_settings_defaults():
+    """Test that missing keys of the service block get defaults."""
+    settings = service_settings({"service": {"port": 9000}})
+    assert settings["port"] == 9000
+    assert settings["host"] == "127.0.0.1"
+    assert settings["formats"] == ["docx"]
+
+
+def test_render_reuses_login_and_report(taiga, service):
+    """Test that a second format only renders, without API requests."""
+    result = service.render("bench", "md")
+    assert os.path.exists(result["filename"])
+    requests_made = taiga.requests
+
+    result = service.render("bench", "docx", refresh=False)
+    assert result["filename"].endswith(".docx")
+    assert taiga.requests == requests_made
+
+
+def test_refresh_only_downloads_changes(taiga, service):
+    """Test that a warm refresh skips the login and the status lookup."""
+    service.refresh("bench")
+    requests_made = taiga.requests
+    service.refresh("bench")
+    # One page of the stories modified since the last sync.
+    assert taiga.requests == requests_made + 1
+
+
+def test_unknown_project_or_format(service):
+    """Test that unknown names raise KeyError."""
+    with pytest.raises(KeyError):
+        service.render("missing", "md")
+    with pytest.raises(KeyError):
+        service.render("bench", "pdf")
+
+
+def test_http_endpoint(service):
+    """Test triggering and fetching a report over HTTP."""
+    with service.running() as url:
+        assert requests.get(url + "health").json() == {"status": "ok"}
+
+        response = requests.post(url + "reports/bench?format=md")
+        assert response.status_code == 200
+        assert response.json()["format"] == "md"
+
+        response = requests.get(url + "reports/bench?format=md")
+        assert response.status_code == 200
+        assert response.headers["Content-Type"].startswith("text/markdown")
+        assert b"BENCH" in response.content
+
+        listed = requests.get(url + "reports").json()
+        assert [result["project"] for result in listed] == ["bench"]
+
+        response = requests.post(url + "reports/missing")
+        assert response.status_code == 404
+        assert "missing" in json.loads(response.content)["detail"]
+
+
+def test_concurrent_requests_share_one_refresh(service, monkeypatch):
+    """Test that requests waiting for a refresh don't download again."""
+    calls = []
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow_report(api, project, yaml_dict, printer, **kwargs):
+        calls.append(project)
+        started.set()
+        release.wait(5)
+        return "report"
+
+    monkeypatch.setattr(service_module, "generate_report", slow_report)
+    monkeypatch.setattr(service, "api", lambda project: None)
+    first = threading.Thread(target=service.refresh, args=("bench",))
+    first.start()
+    started.wait(5)
+    # They all arrive while the first refresh is running.
+    since = time.monotonic()
+    waiting = [threading.Thread(target=service.report, args=("bench",))] + [
+        threading.Thread(target=service.refresh, args=("bench",),
+                         kwargs={"since": since}) for _ in range(2)]
+    for thread in waiting:
+        thread.start()
+    release.set()
+    for thread in [first] + waiting:
+        thread.join(5)
+    # The refreshes asked for during the first one share one more.
+    assert calls == ["bench", "bench"]
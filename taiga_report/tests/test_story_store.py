@@ -0,0 +1,221 @@
+"""Tests for the local user story store and incremental sync."""
+import threading
+
+import pytest
+
+from taiga_report import story_store
+
+
+def make_us(us_id, status, modified_date):
+    """Return a minimal user story dict."""
+    return {"id": us_id, "subject": "US-{}".format(us_id), "status": status,
+            "modified_date": modified_date, "epics": [], "tags": [],
+            "tasks": []}
+
+
+class FakeAPI:
+    """Serves a full download and then a list of modified stories."""
+
+    def __init__(self, done, modified):
+        self.done = done
+        self.modified = modified
+        self.since = None
+
+    def iter_user_stories(self):
+        return iter(self.done)
+
+    def iter_modified_user_stories(self, since):
+        self.since = since
+        return iter(self.modified)
+
+    def _get_done_status(self):
+        return 35
+
+
+@pytest.fixture
+def store(tmp_path):
+    """Return an empty store in a temporary directory."""
+    return story_store.StoryStore(tmp_path / "sieel.json")
+
+
+def test_first_sync_downloads_done_stories(store):
+    """Test that the first sync stores everything and sets the mark."""
+    api = FakeAPI([make_us(1, 35, "2026-01-02T00:00:00Z"),
+                   make_us(2, 35, "2026-01-05T00:00:00Z")], [])
+    assert story_store.sync_user_stories(api, store) == 2
+    assert len(store) == 2
+    assert store.high_water_mark == "2026-01-05T00:00:00Z"
+
+
+def test_next_sync_merges_changes(store, tmp_path):
+    """Test inserts, updates and stories leaving done."""
+    store.upsert(make_us(1, 35, "2026-01-02T00:00:00Z"))
+    store.upsert(make_us(2, 35, "2026-01-05T00:00:00Z"))
+    store.high_water_mark = "2026-01-05T00:00:00Z"
+    updated = make_us(1, 35, "2026-02-01T00:00:00Z")
+    updated["subject"] = "Renamed"
+    api = FakeAPI([], [updated,
+                       make_us(2, 12, "2026-02-02T00:00:00Z"),
+                       make_us(3, 35, "2026-02-03T00:00:00Z")])
+
+    story_store.sync_user_stories(api, store)
+    assert api.since == "2026-01-05T00:00:00Z"
+
+    reopened = story_store.StoryStore(tmp_path / "sieel.json")
+    subjects = sorted(us["subject"] for us in reopened.stories())
+    assert subjects == ["Renamed", "US-3"]
+    assert reopened.high_water_mark == "2026-02-03T00:00:00Z"
+
+
+def test_from_config_without_cache_dir():
+    """Test that no store is built unless cache_dir is configured."""
+    assert story_store.StoryStore.from_config({}, "sieel") is None
+
+
+def open_sqlite_store(tmp_path, project="sieel"):
+    """Return the SQLite store of project in a temporary directory."""
+    yaml_dict = {"cache_dir": str(tmp_path),
+                 project: {"report_sections": ["general", "expedientes"]}}
+    return story_store.SQLiteStoryStore.from_config(yaml_dict, project)
+
+
+@pytest.fixture
+def sqlite_store(tmp_path):
+    """Return an empty SQLite store in a temporary directory."""
+    return open_sqlite_store(tmp_path)
+
+
+def test_sqlite_store_upsert_and_remove(sqlite_store, tmp_path):
+    """Test that stories and the mark survive reopening the database."""
+    us = make_us(1, 35, "2026-01-02T00:00:00Z")
+    us["tags"] = [["expedientes", "#fff"]]
+    us["epics"] = [{"id": 9, "subject": "Epic"}]
+    sqlite_store.upsert(us)
+    sqlite_store.upsert(make_us(2, 35, "2026-01-03T00:00:00Z"))
+    sqlite_store.remove(2)
+    sqlite_store.high_water_mark = "2026-01-03T00:00:00Z"
+    sqlite_store.save()
+    sqlite_store.close()
+
+    reopened = open_sqlite_store(tmp_path)
+    assert len(reopened) == 1
+    assert [us["id"] for us in reopened.stories()] == [1]
+    assert reopened.high_water_mark == "2026-01-03T00:00:00Z"
+    other = open_sqlite_store(tmp_path, "other")
+    assert len(other) == 0
+
+
+def test_sqlite_store_report_rows(sqlite_store):
+    """Test that rows come by story id and filtered by finish date."""
+    for us_id, finish_date in ((1, "2026-01-10"), (2, "2026-02-10"),
+                               (3, "2026-01-20")):
+        us = make_us(us_id, 35, finish_date)
+        us["finish_date"] = finish_date
+        us["tags"] = [["expedientes", None]]
+        if us_id != 3:
+            us["epics"] = [{"id": 9, "subject": "Epic"}]
+        sqlite_store.upsert(us)
+
+    rows = list(sqlite_store.report_rows("2026-01-01", "2026-02-01"))
+    assert rows == [("expedientes", "Epic", "US-1", 1),
+                    ("expedientes", None, "US-3", 3)]
+
+
+def test_sqlite_store_rows_of_every_epic(sqlite_store):
+    """Test that a story gets a row for each epic, in their order."""
+    us = make_us(1, 35, "2026-01-10")
+    us["tags"] = [["general", None]]
+    us["epics"] = [{"id": 9, "subject": "B epic"},
+                   {"id": 8, "subject": "A epic"}]
+    sqlite_store.upsert(us)
+    assert list(sqlite_store.report_rows()) == [
+        ("general", "B epic", "US-1", 1), ("general", "A epic", "US-1", 1)]
+
+
+def test_make_store_selects_backend(tmp_path):
+    """Test that the yaml picks the store backend."""
+    yaml_dict = {"cache_dir": str(tmp_path),
+                 "sieel": {"report_sections": ["general"]}}
+    assert isinstance(story_store.make_store(yaml_dict, "sieel"),
+                      story_store.StoryStore)
+    yaml_dict["story_store"] = "sqlite"
+    assert isinstance(story_store.make_store(yaml_dict, "sieel"),
+                      story_store.SQLiteStoryStore)
+    assert story_store.make_store({}, "sieel") is None
+
+
+def test_sqlite_store_follows_rules_changes(tmp_path):
+    """Test that stored sections are redone when the rules change."""
+    yaml_dict = {"cache_dir": str(tmp_path), "story_store": "sqlite",
+                 "sieel": {"report_sections": ["general", "expedientes"]}}
+    store = story_store.make_store(yaml_dict, "sieel")
+    us = make_us(1, 35, "2026-01-10")
+    us["tags"] = [["expedientes", None]]
+    store.upsert(us)
+    store.save()
+    store.close()
+
+    yaml_dict["sieel"]["section_rules"] = [
+        {"section": "general", "subject": "^US-"}]
+    store = story_store.make_store(yaml_dict, "sieel")
+    assert list(store.report_rows()) == [("general", None, "US-1", 1)]
+
+
+@pytest.mark.parametrize("backend", ["json", "sqlite"])
+def test_new_fields_force_a_full_sync(tmp_path, monkeypatch, backend):
+    """Test that stores synced with older fields are synced again."""
+    yaml_dict = {"cache_dir": str(tmp_path), "story_store": backend,
+                 "sieel": {"report_sections": ["general"]}}
+    store = story_store.make_store(yaml_dict, "sieel")
+    story_store.sync_user_stories(
+        FakeAPI([make_us(1, 35, "2026-01-02T00:00:00Z")], []), store)
+    store.close()
+
+    monkeypatch.setattr(story_store, "STORE_FIELDS",
+                        story_store.STORE_FIELDS + ["due_date"])
+    store = story_store.make_store(yaml_dict, "sieel")
+    assert store.high_water_mark is None
+    assert len(store) == 0
+    api = FakeAPI([make_us(2, 35, "2026-01-03T00:00:00Z")], [])
+    story_store.sync_user_stories(api, store)
+    assert api.since is None
+    assert [us["id"] for us in store.stories()] == [2]
+
+
+def test_projects_sync_concurrently(tmp_path):
+    """Test that a long sync doesn't lock out another project's store."""
+    first_started = threading.Event()
+    second_done = threading.Event()
+    errors = []
+
+    def slow_download():
+        yield make_us(1, 35, "2026-01-02T00:00:00Z")
+        # The first story is stored, the second project syncs meanwhile.
+        first_started.set()
+        if not second_done.wait(10):
+            errors.append("the second project waited for the first")
+        yield make_us(2, 35, "2026-01-03T00:00:00Z")
+
+    def sync_first():
+        store = open_sqlite_store(tmp_path, "one")
+        api = FakeAPI([], [])
+        api.iter_user_stories = slow_download
+        try:
+            story_store.sync_user_stories(api, store)
+        except Exception as ex:
+            errors.append(ex)
+        finally:
+            store.close()
+
+    thread = threading.Thread(target=sync_first)
+    thread.start()
+    assert first_started.wait(10)
+    second = open_sqlite_store(tmp_path, "two")
+    story_store.sync_user_stories(
+        FakeAPI([make_us(3, 35, "2026-01-04T00:00:00Z")], []), second)
+    second_done.set()
+    thread.join(10)
+    assert errors == []
+    assert [us["id"] for us in second.stories()] == [3]
+    first = open_sqlite_store(tmp_path, "one")
+    assert [us["id"] for us in first.stories()] == [1, 2]
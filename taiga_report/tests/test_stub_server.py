@@ -0,0 +1,229 @@
+"""End to end tests of TaigaAPI against the local Taiga stub server."""
+import io
+
+import pytest
+import requests
+
+from taiga_report.benchmarks.dataset import generate_user_stories, project_yaml
+from taiga_report.benchmarks.stub_server import StubTaiga, run_stub_server
+from taiga_report.output_manager import OutputManager
+from taiga_report.printer_classes import MarkdownPrinter
+from taiga_report.report_period import ReportPeriod
+from taiga_report import runner
+from taiga_report.runner import generate_report
+from taiga_report.taiga_api import TaigaAPI
+
+
+@pytest.fixture
+def taiga():
+    """Return a stub with 250 done stories."""
+    return StubTaiga(list(generate_user_stories(250)))
+
+
+@pytest.fixture
+def yaml_dict(taiga):
+    """Serve the stub and return a yaml dict pointing to it."""
+    with run_stub_server(taiga) as url:
+        yaml_dict = project_yaml(host=url)
+        yaml_dict["page_size"] = 100
+        yield yaml_dict
+
+
+def test_paginated_download(taiga, yaml_dict):
+    """Test that every page is followed."""
+    api = TaigaAPI("bench", yaml_dict)
+    stories = list(api.iter_user_stories())
+    assert [us["id"] for us in stories] == list(range(1, 251))
+    # Login and three pages, the ids come from the yaml.
+    assert taiga.requests == 4
+
+
+def test_expired_token_is_replaced(taiga, yaml_dict):
+    """Test that a 401 mid run logs in again and carries on."""
+    api = TaigaAPI("bench", yaml_dict)
+    api.auth_token = "expired"
+    api._auth()
+    assert len(list(api.iter_user_stories())) == 250
+    assert api.auth_token != "expired"
+
+
+def test_unchanged_responses_come_from_cache(taiga, yaml_dict, tmp_path):
+    """Test that a repeated request is answered with a 304."""
+    yaml_dict["cache_dir"] = str(tmp_path)
+    api = TaigaAPI("bench", yaml_dict)
+    api._auth()
+    url = yaml_dict["host"] + "userstory-statuses?project=1"
+    assert not getattr(api._get(url), "from_cache", False)
+    assert api._get(url).from_cache
+
+
+def test_throttled_request_is_retried(taiga, yaml_dict):
+    """Test that a 429 with Retry-After is retried by the session."""
+    taiga.rate_limit = 1
+    api = TaigaAPI("bench", yaml_dict)
+    api._auth()
+    assert api.project_metadata().status_id("done") == 35
+    assert taiga.requests == 3
+
+
+def test_server_errors_reach_the_caller(taiga, yaml_dict):
+    """Test that a persistent 503 ends in an HTTPError."""
+    yaml_dict["connection"] = {"retries": 1, "backoff_factor": 0}
+    api = TaigaAPI("bench", yaml_dict)
+    api._auth()
+    taiga.error_rate = 1
+    with pytest.raises(requests.exceptions.HTTPError):
+        api.project_metadata()
+
+
+def test_tasks_cost_a_fixed_number_of_requests(taiga, yaml_dict):
+    """Test that the task join adds one sweep, not a request per story."""
+    api = TaigaAPI("bench", yaml_dict)
+    reports = []
+    generate_report(api, "bench", yaml_dict, reports.append, tasks=True)
+    tasks = taiga.tasks()
+    # Login, three pages of stories and one page per 100 tasks.
+    assert taiga.requests == 4 + -(-len(tasks) // 100)
+    us_id = tasks[0]["user_story"]
+    assert tasks[0]["subject"] in reports[0]._tasks[us_id][0]
+
+
+@pytest.mark.parametrize("incremental", [False, True])
+def test_period_only_lists_its_tasks(taiga, yaml_dict, tmp_path,
+                                     monkeypatch, incremental):
+    """Test that a period lists the tasks of its stories, not all."""
+    monkeypatch.setattr(runner, "TASK_LOOKUPS_MAX", 100)
+    yaml_dict.update(cache_dir=str(tmp_path), story_store="sqlite")
+    period = ReportPeriod.between("2020-01-02", "2020-01-02")
+    stories = [us for us in taiga.stories
+               if period.contains(us) and us["tasks"]]
+    assert 0 < len(stories) < 100
+    expected = {us["id"] for us in stories}
+    report = generate_report(TaigaAPI("bench", yaml_dict), "bench",
+                             yaml_dict, lambda report: report,
+                             incremental=incremental, tasks=True,
+                             period=period)
+    assert set(report._tasks) == expected
+    assert sorted(int(query["user_story"]) for query in taiga.task_filters) \
+        == sorted(expected)
+
+
+def test_milestone_lists_its_tasks(taiga, yaml_dict):
+    """Test that a sprint report lists the tasks of that sprint only."""
+    for us in taiga.stories[:3]:
+        us["milestone"] = 3
+    period = ReportPeriod(milestone=3)
+    report = generate_report(TaigaAPI("bench", yaml_dict), "bench",
+                             yaml_dict, lambda report: report, tasks=True,
+                             period=period)
+    assert set(report._tasks) == {us["id"] for us in taiga.stories[:3]
+                                  if us["tasks"]}
+    assert taiga.task_filters == [{"milestone": "3"}]
+
+
+def test_epics_follow_the_catalog(taiga, yaml_dict, tmp_path):
+    """Test that report epics are ordered by the cached epic catalog."""
+    yaml_dict["cache_dir"] = str(tmp_path)
+    yaml_dict["epic_catalog"] = {"ttl_minutes": 10}
+    order = [epic["subject"] for epic in taiga.epics()]
+    for run in range(2):
+        reports = []
+        api = TaigaAPI("bench", yaml_dict)
+        generate_report(api, "bench", yaml_dict, reports.append)
+        for rep_section in reports[0]._report.values():
+            epics = [epic for epic in rep_section if epic != "user_stories"]
+            assert epics == sorted(epics, key=order.index)
+    assert (tmp_path / "epics" / "bench.json").exists()
+
+
+def test_missing_ids_are_resolved_in_one_lookup(taiga, yaml_dict, tmp_path):
+    """Test that ids missing from the yaml are looked up once and cached."""
+    yaml_dict["cache_dir"] = str(tmp_path)
+    del yaml_dict["bench"]["id"], yaml_dict["bench"]["done_id"]
+    api = TaigaAPI("bench", yaml_dict)
+    assert len(list(api.iter_user_stories())) == 250
+    # Login, project lookup and three pages.
+    assert taiga.requests == 5
+    assert api.metadata.tag_colors
+
+    api = TaigaAPI("bench", yaml_dict)
+    assert len(list(api.iter_user_stories())) == 250
+    # The cached token and ids go straight to the pages.
+    assert taiga.requests == 8
+
+
+def test_stale_ids_are_looked_up_again(taiga, yaml_dict):
+    """Test that a done id that matches nothing is resolved again."""
+    yaml_dict["bench"]["done_id"] = 99
+    api = TaigaAPI("bench", yaml_dict)
+    assert len(list(api.iter_user_stories())) == 250
+    assert api.done_status == 35
+
+
+def test_period_is_filtered_by_the_server(taiga, yaml_dict):
+    """Test that only the stories of the period are downloaded."""
+    taiga.stories[0]["milestone"] = 3
+    period = ReportPeriod.between("2020-01-02", "2020-01-02")
+    expected = [us["id"] for us in taiga.stories if period.contains(us)]
+    assert 0 < len(expected) < 100
+    api = TaigaAPI("bench", yaml_dict)
+    stories = list(api.iter_user_stories(period=period))
+    assert [us["id"] for us in stories] == expected
+    # Login and a single page.
+    assert taiga.requests == 2
+
+    stories = api.iter_user_stories(period=ReportPeriod(milestone=3))
+    assert [us["id"] for us in stories] == [1]
+
+
+@pytest.mark.parametrize("backend", ["json", "sqlite"])
+def test_incremental_period_is_filtered_locally(taiga, yaml_dict, tmp_path,
+                                                backend):
+    """Test that a synced store only reports the stories of the period."""
+    yaml_dict.update(cache_dir=str(tmp_path), story_store=backend)
+    period = ReportPeriod.between("2020-01-02", "2020-01-02")
+    expected = [us["id"] for us in taiga.stories if period.contains(us)]
+    report = generate_report(TaigaAPI("bench", yaml_dict), "bench",
+                             yaml_dict, lambda report: report,
+                             incremental=True, period=period)
+    ids = sorted({us_id for section in report._report.values()
+                  for stories in section.values()
+                  for _, us_id in stories})
+    assert ids == sorted(expected)
+
+
+@pytest.mark.parametrize("backend", ["json", "sqlite"])
+def test_incremental_report_matches_download(taiga, yaml_dict, tmp_path,
+                                             backend):
+    """Test that both modes give the same markdown and content hash."""
+    reports = []
+    generate_report(TaigaAPI("bench", yaml_dict), "bench", yaml_dict,
+                    reports.append)
+    yaml_dict.update(cache_dir=str(tmp_path), story_store=backend)
+    generate_report(TaigaAPI("bench", yaml_dict), "bench", yaml_dict,
+                    reports.append, incremental=True)
+    markdown = []
+    for report in reports:
+        sink = io.StringIO()
+        MarkdownPrinter.write_markdown(report, sink)
+        markdown.append(sink.getvalue())
+    assert markdown[0] == markdown[1]
+    assert (OutputManager.content_hash(reports[0])
+            == OutputManager.content_hash(reports[1]))
+
+
+def test_empty_period_is_an_empty_report(taiga, yaml_dict):
+    """Test that a month without stories is reported, not an error."""
+    period = ReportPeriod.between("1999-01-01", "1999-01-31")
+    api = TaigaAPI("bench", yaml_dict)
+    assert list(api.iter_user_stories(period=period)) == []
+    # Login and the empty page, the ids are not looked up again.
+    assert taiga.requests == 2
+    assert api.download_user_stories(period) == []
+
+    report = generate_report(TaigaAPI("bench", yaml_dict), "bench",
+                             yaml_dict, lambda report: report, period=period)
+    sink = io.StringIO()
+    MarkdownPrinter.write_markdown(report, sink)
+    assert report._report == {}
+    assert sink.getvalue() == "# BENCH\n\n"
@@ -1,8 +1,10 @@
 """Test for the TaigaAPI."""
+import json
+
 import pytest
 import requests
 
-from taiga_report import taiga_api
+from taiga_report import taiga_api, token_store, http_cache, scheduler
 
 
 @pytest.fixture
@@ -32,7 +34,10 @@ def api():
         }
     }
 
-    return taiga_api.TaigaAPI("sieel", yaml_dict)
+    api = taiga_api.TaigaAPI("sieel", yaml_dict)
+    # The shared scheduler would carry the failures of other tests.
+    api.scheduler = scheduler.RequestScheduler.from_config(yaml_dict)
+    return api
 
 
 def test_api_creation(api):
@@ -107,9 +112,200 @@ def test_api_get_done_status_not_found(api):
     """Test that HTTPError is raised when request fails."""
     with pytest.raises(requests.exceptions.HTTPError):
         api.host = api.host+"/hola/"
+        api.done_status = None
         api._get_done_status()
 
 
 def test_api_getting_project_id(api):
     """Test that api can get project id."""
     assert api.project_id == 6
+
+
+class FakeResponse:
+    """Minimal stand-in for requests.Response used by offline tests."""
+
+    def __init__(self, payload, headers=None, status_code=200):
+        self.payload = payload
+        self.headers = headers or {}
+        self.status_code = status_code
+        self.content = json.dumps(payload).encode()
+
+    def json(self):
+        return self.payload
+
+    def iter_content(self, chunk_size=1):
+        content = json.dumps(self.payload).encode()
+        for start in range(0, len(content), chunk_size):
+            yield content[start:start + chunk_size]
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(str(self.status_code))
+
+
+class FakeSession:
+    """Records requests and answers them from a dict of url: response.
+
+    A list of responses is answered one item per request.
+
+    """
+
+    def __init__(self, responses):
+        self.responses = responses
+        self.calls = []
+        self.timeouts = []
+        self.streams = []
+
+    def request(self, method, url, **kwargs):
+        self.calls.append((method, url, dict(kwargs.get("headers") or {})))
+        self.timeouts.append(kwargs.get("timeout"))
+        self.streams.append(kwargs.get("stream"))
+        response = self.responses[url]
+        if isinstance(response, list):
+            return response.pop(0)
+        return response
+
+
+def test_api_shares_given_session():
+    """Test that a given session is used instead of building a new one."""
+    session = requests.Session()
+    yaml_dict = {"host": "https://taiga.example/api/v1/", "headers": {},
+                 "login_data": {}, "sieel": {"slug": "s", "id": 1}}
+    first = taiga_api.TaigaAPI("sieel", yaml_dict, session=session)
+    second = taiga_api.TaigaAPI("sieel", yaml_dict, session=session)
+    assert first.session is second.session is session
+
+
+def test_build_session_uses_connection_settings():
+    """Test that the pool and retry settings come from the yaml."""
+    session = taiga_api.build_session({"connection": {"pool_size": 3,
+                                                      "retries": 7}})
+    adapter = session.get_adapter("https://taiga.example/")
+    assert adapter._pool_maxsize == 3
+    assert adapter.max_retries.total == 7
+
+
+def test_api_requests_use_timeout(api):
+    """Test that every request is sent with the configured timeout."""
+    api.session = FakeSession({api.auth_url: FakeResponse(
+        {"auth_token": "token"})})
+    assert api._login() == "token"
+    method, url, headers = api.session.calls[0]
+    assert method == "POST"
+    assert "Authorization" not in headers
+    assert api.session.timeouts == [api.timeout]
+
+
+def test_api_iter_user_stories_follows_pagination(api, monkeypatch):
+    """Test that every page is requested and stories are yielded in order."""
+    pages = {
+        api.host + "userstories": FakeResponse(
+            [{"subject": "US-1", "watchers": [1, 2]}, {"subject": "US-2"}],
+            {"x-pagination-next": "next-page"}),
+        "next-page": FakeResponse([{"subject": "US-3"}]),
+    }
+    api.session = FakeSession(pages)
+    api.authenticated = True
+    monkeypatch.setattr(api, "_get_done_status", lambda: 35)
+
+    stories = list(api.iter_user_stories(page_size=2))
+    assert [us["subject"] for us in stories] == ["US-1", "US-2", "US-3"]
+    # Fields the report doesn't use are dropped while decoding.
+    assert "watchers" not in stories[0]
+    assert [url for _, url, _ in api.session.calls] == [
+        api.host + "userstories", "next-page"]
+    assert "x-disable-pagination" not in api.session.calls[0][2]
+
+
+def test_api_iter_user_stories_empty_raises(api, monkeypatch):
+    """Test that an empty project raises ValueError."""
+    project_url = api.host + "projects/by_slug?slug=ignamt-sieel"
+    api.session = FakeSession({
+        api.host + "userstories": FakeResponse([]),
+        project_url: FakeResponse({"id": 6, "us_statuses": [
+            {"slug": "done", "id": 35}]}),
+    })
+    api.authenticated = True
+    with pytest.raises(ValueError):
+        list(api.iter_user_stories())
+    # The yaml ids were checked once before giving up.
+    assert [call[1] for call in api.session.calls].count(project_url) == 1
+
+
+def test_api_relogs_on_401(api):
+    """Test that a rejected token is replaced and the request resent."""
+    url = api.host + "projects/by_slug?slug=ignamt-sieel"
+    api.session = FakeSession({
+        url: [FakeResponse({}, status_code=401), FakeResponse({"id": 6})],
+        api.auth_url: FakeResponse({"auth_token": "new", "refresh": "r"}),
+    })
+    api.auth_token = "expired"
+    api._auth()
+    response = api._request("GET", url)
+    assert response.json() == {"id": 6}
+    assert api.auth_token == "new"
+    assert api.session.calls[-1][2]["Authorization"] == "Bearer new"
+    # The login itself doesn't carry the rejected token.
+    login = [call for call in api.session.calls if call[1] == api.auth_url]
+    assert "Authorization" not in login[0][2]
+
+
+def test_api_reuses_stored_token(api, tmp_path):
+    """Test that a stored token avoids logging in."""
+    store = token_store.TokenStore(tmp_path / "tokens.json")
+    store.save(api.host, api.username, "stored", "refresh")
+    api.token_store = store
+    api.session = FakeSession({})
+    api._auth()
+    assert api.auth_token == "stored"
+    assert not api.session.calls
+
+
+def test_api_refreshes_expired_stored_token(api, tmp_path):
+    """Test that an expired stored token is refreshed and stored again."""
+    store = token_store.TokenStore(tmp_path / "tokens.json", default_ttl=0)
+    store.save(api.host, api.username, "old", "refresh")
+    api.token_store = store
+    api.session = FakeSession({api.auth_url + "/refresh": FakeResponse(
+        {"auth_token": "refreshed", "refresh": "refresh-2"})})
+    api._auth()
+    assert api.auth_token == "refreshed"
+    assert store.get(api.host, api.username)["refresh"] == "refresh-2"
+
+
+def test_api_get_serves_304_from_cache(api, tmp_path):
+    """Test that a 304 answer returns the cached body."""
+    url = api.host + "userstory-statuses?project=6"
+    cached = FakeResponse([{"slug": "done", "id": 35}])
+    cached.content = b'[{"slug": "done", "id": 35}]'
+    cached.headers = requests.structures.CaseInsensitiveDict(
+        {"ETag": '"v1"'})
+    cached.url = url
+    api.response_cache = http_cache.ResponseCache(tmp_path)
+    api.session = FakeSession({url: [cached,
+                                     FakeResponse(None, status_code=304)]})
+
+    assert api._get(url).json() == [{"slug": "done", "id": 35}]
+    response = api._get(url)
+    assert response.from_cache
+    assert response.json() == [{"slug": "done", "id": 35}]
+    assert api.session.calls[1][2]["If-None-Match"] == '"v1"'
+
+
+def test_api_get_refetches_missing_cached_body(api, tmp_path):
+    """Test that a 304 without the body on disk is asked for again."""
+    url = api.host + "userstories?project=6&page=2"
+    api.response_cache = http_cache.ResponseCache(tmp_path)
+    key = api.response_cache.key(url, api.username)
+    api.response_cache._index[key] = {"etag": '"v1"', "headers": {},
+                                      "url": url, "size": 2, "last_used": 0}
+    api.session = FakeSession({url: [FakeResponse(None, status_code=304),
+                                     FakeResponse([{"id": 31}])]})
+    headers = api._paginated_headers()
+
+    response = api._get(url, headers=headers, stream=True)
+    assert response.json() == [{"id": 31}]
+    retry = api.session.calls[1][2]
+    assert "x-disable-pagination" not in retry
+    assert "If-None-Match" not in retry
+    assert api.session.streams == [True, True]
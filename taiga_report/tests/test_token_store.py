@@ -0,0 +1,56 @@
+"""Tests for the auth token store."""
+import base64
+import json
+import time
+
+import pytest
+
+from taiga_report import token_store as ts
+
+
+@pytest.fixture
+def store(tmp_path):
+    """Return an empty store in a temporary directory."""
+    return ts.TokenStore(tmp_path / "tokens.json")
+
+
+def make_jwt(exp):
+    """Return an unsigned JWT with the given exp claim."""
+    payload = base64.urlsafe_b64encode(json.dumps({"exp": exp}).encode())
+    return "header." + payload.decode().rstrip("=") + ".signature"
+
+
+def test_token_expiry_reads_jwt_exp():
+    """Test that the exp claim of a JWT is used as expiry."""
+    assert ts.token_expiry(make_jwt(1234567890)) == 1234567890
+
+
+def test_token_expiry_defaults_to_ttl():
+    """Test that opaque tokens last default_ttl seconds."""
+    before = time.time()
+    assert ts.token_expiry("opaque", default_ttl=10) >= before + 10
+
+
+def test_save_get_and_invalidate(store):
+    """Test the round trip of a token through the store."""
+    store.save("host", "user", make_jwt(time.time() + 3600), "refresh")
+    entry = store.get("host", "user")
+    assert entry["refresh"] == "refresh"
+    assert not store.is_expired(entry)
+    assert store.get("host", "other") is None
+
+    store.invalidate("host", "user")
+    assert store.get("host", "user") is None
+
+
+def test_expired_token(store):
+    """Test that a token past its exp is reported as expired."""
+    entry = store.save("host", "user", make_jwt(time.time() - 1))
+    assert store.is_expired(entry)
+
+
+def test_from_config_without_cache_dir():
+    """Test that no store is built unless cache_dir is configured."""
+    assert ts.TokenStore.from_config({}) is None
+    store = ts.TokenStore.from_config({"cache_dir": "cache"})
+    assert str(store.path) == "cache/tokens.json"
@@ -0,0 +1,143 @@
+"""Persists Taiga auth tokens between runs."""
+import base64
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows has no flock, runs fall back to a thread lock.
+    fcntl = None
+
+# Taiga access tokens last one day unless the server says otherwise.
+DEFAULT_TOKEN_TTL = 24 * 60 * 60
+# Tokens this close to expiring are considered expired already.
+EXPIRY_MARGIN = 60
+
+
+def token_expiry(auth_token, default_ttl=DEFAULT_TOKEN_TTL):
+    """Return the epoch at which auth_token expires.
+
+    Reads the 'exp' claim when the token is a JWT, otherwise assumes it lasts
+    default_ttl seconds from now.
+
+    """
+    try:
+        payload = auth_token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        return float(json.loads(base64.urlsafe_b64decode(payload))["exp"])
+    except (IndexError, ValueError, KeyError, TypeError):
+        return time.time() + default_ttl
+
+
+class TokenStore:
+    """On-disk store of auth and refresh tokens keyed by host and username.
+
+    The store is a single JSON file which is rewritten atomically, and logins
+    are serialized through a lock file so concurrent runners reuse the token
+    of whichever one logged in first instead of all hitting /auth.
+
+    To use:
+        store = TokenStore.from_config(yaml_dict)
+
+    """
+
+    _thread_lock = threading.Lock()
+
+    def __init__(self, path, default_ttl=DEFAULT_TOKEN_TTL):
+        """Set up attributes for the instance.
+
+        PARAMETERS:
+            - path: str or Path of the JSON file holding the tokens.
+            - default_ttl: seconds a non JWT token is assumed to last.
+
+        """
+        self.path = Path(path)
+        self.default_ttl = default_ttl
+
+    @classmethod
+    def from_config(cls, yaml_dict):
+        """Build a store under the yaml 'cache_dir', or None if it is unset."""
+        cache_dir = yaml_dict.get("cache_dir")
+        if not cache_dir:
+            return None
+        return cls(Path(cache_dir) / "tokens.json",
+                   yaml_dict.get("token_ttl", DEFAULT_TOKEN_TTL))
+
+    @staticmethod
+    def _key(host, username):
+        return "{}|{}".format(host, username)
+
+    def _read(self):
+        try:
+            with open(self.path, "r") as file:
+                return json.load(file)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _write(self, tokens):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=str(self.path.parent),
+                                        prefix=".tokens-")
+        try:
+            with os.fdopen(fd, "w") as file:
+                json.dump(tokens, file)
+            os.chmod(tmp_path, 0o600)
+            os.replace(tmp_path, str(self.path))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def get(self, host, username):
+        """Return the stored entry for host and username, or None.
+
+        The entry is a dict with the keys 'auth_token', 'refresh' and
+        'expires_at'. Use is_expired() to know if it can still be used.
+
+        """
+        return self._read().get(self._key(host, username))
+
+    @staticmethod
+    def is_expired(entry):
+        """Return True if the entry's auth_token should not be used."""
+        return entry["expires_at"] - EXPIRY_MARGIN <= time.time()
+
+    def save(self, host, username, auth_token, refresh=None):
+        """Store a new token and return its entry."""
+        entry = {"auth_token": auth_token,
+                 "refresh": refresh,
+                 "expires_at": token_expiry(auth_token, self.default_ttl)}
+        tokens = self._read()
+        tokens[self._key(host, username)] = entry
+        self._write(tokens)
+        return entry
+
+    def invalidate(self, host, username):
+        """Forget the token of host and username, e.g. after a 401."""
+        tokens = self._read()
+        if tokens.pop(self._key(host, username), None) is not None:
+            self._write(tokens)
+
+    @contextmanager
+    def lock(self):
+        """Hold an exclusive lock while logging in.
+
+        Uses flock on a sibling '.lock' file so it also works across
+        processes where the platform allows it.
+
+        """
+        with self._thread_lock:
+            if fcntl is None:
+                yield
+                return
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(str(self.path) + ".lock", "w") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)